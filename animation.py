@@ -0,0 +1,137 @@
+# Animation for Tile Strategy.
+# Turns still resolve the moment a key is pressed. The animator only changes where sprites are drawn while they slide to their new cells,
+# so an animation never holds up input: a new turn simply snaps every running animation to its end.
+# Animation time moves forward in fixed steps, and drawing interpolates between the last two steps.
+import math
+import time
+import numpy as np
+
+
+class Tween:
+    # kind is 'move' (slide from start to end) or 'attack' (bump from start towards end and back). Cells are (x, y) pairs.
+    def __init__(self, kind, start, end, duration):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.elapsed = 0.0
+
+    def is_done(self):
+        return self.elapsed >= self.duration
+
+    # Returns the sprite's offset from the cell it's drawn in, measured in cells, at the given time into the tween.
+    def offset(self, elapsed):
+        t = min(elapsed / self.duration, 1.0)
+        dx = self.start[0] - self.end[0]
+        dy = self.start[1] - self.end[1]
+        if self.kind == 'move':
+            # Eases out, so the sprite slows down as it settles into its new cell.
+            remaining = (1 - t) * (1 - t)
+            return dx * remaining, dy * remaining
+        else:
+            # The attacker is drawn in its own cell and bumps a third of the way towards its target.
+            bump = math.sin(math.pi * t) / 3
+            return -dx * bump, -dy * bump
+
+
+class Animator:
+    # step is the fixed timestep in seconds, duration is how long each animation lasts.
+    def __init__(self, step, duration):
+        self.step = step
+        self.duration = duration
+        # Tweens are keyed by the cell the sprite is drawn in.
+        self.tweens = {}
+        self.accumulator = 0.0
+
+    def is_active(self):
+        return len(self.tweens) > 0
+
+    # Starts animations for the moves and attacks of the turns that just resolved.
+    # motions is a list of (kind, start, end) tuples in the order they happened.
+    def start(self, motions):
+        # Anything still running belongs to an older turn and is finished off right away.
+        self.tweens = {}
+        self.accumulator = 0.0
+        for kind, start, end in motions:
+            if kind == 'move':
+                # A sprite that moved more than once since the last frame slides along from where it first started.
+                if start in self.tweens and self.tweens[start].kind == 'move':
+                    start = self.tweens.pop(start).start
+                self.tweens[end] = Tween(kind, start, end, self.duration)
+            elif start not in self.tweens:
+                self.tweens[start] = Tween(kind, start, end, self.duration)
+
+    # Moves animation time forward by elapsed seconds, in whole fixed steps. Leftover time is carried into the next frame.
+    # Returns True if anything was animating, meaning the screen needs a repaint.
+    def advance(self, elapsed):
+        if not self.tweens:
+            return False
+        self.accumulator += elapsed
+        while self.accumulator >= self.step and self.tweens:
+            self.accumulator -= self.step
+            for cell in list(self.tweens):
+                tween = self.tweens[cell]
+                tween.elapsed += self.step
+                if tween.is_done():
+                    del self.tweens[cell]
+        if not self.tweens:
+            self.accumulator = 0.0
+        return True
+
+    # Returns the draw offset of the sprite in a cell, in cells. Interpolates between the last fixed step and the next one.
+    def offset(self, cell):
+        tween = self.tweens.get(cell)
+        if tween is None:
+            return 0.0, 0.0
+        return tween.offset(tween.elapsed + self.accumulator)
+
+
+class Frame_timer:
+    # Keeps the last samples frame times and turn resolution times, in seconds.
+    def __init__(self, budget, samples=600):
+        self.budget = budget
+        self.frame_times = np.zeros(samples)
+        self.work_times = np.zeros(samples)
+        self.turn_times = np.zeros(samples)
+        self.frames = 0
+        self.turns = 0
+        self.animated_frames = 0
+        self.slow_animated_frames = 0
+        self.last_frame = None
+
+    # Called at the top of every frame.
+    def frame_start(self):
+        now = time.perf_counter()
+        if self.last_frame is not None:
+            self.frame_times[self.frames % len(self.frame_times)] = now - self.last_frame
+            self.frames += 1
+        self.last_frame = now
+        return now
+
+    # Called once the frame has been shown, before waiting for the next one. work is how long the frame took to build and show.
+    def frame_end(self, start, animating):
+        work = time.perf_counter() - start
+        self.work_times[(self.frames - 1) % len(self.work_times)] = work
+        if animating:
+            self.animated_frames += 1
+            if work > self.budget:
+                self.slow_animated_frames += 1
+
+    # Records how long a turn took from the key press until it was fully resolved.
+    def turn(self, seconds):
+        self.turn_times[self.turns % len(self.turn_times)] = seconds
+        self.turns += 1
+
+    # Returns a one line summary of the recent frames and turns.
+    def report(self):
+        frames = self.frame_times[:min(self.frames, len(self.frame_times))]
+        work = self.work_times[:min(self.frames, len(self.work_times))]
+        turns = self.turn_times[:min(self.turns, len(self.turn_times))]
+        if len(frames) == 0:
+            return 'No frames recorded.'
+        text = ('FPS: %.1f. Frame work: median %.2f ms, 99th percentile %.2f ms. Animated frames over budget: %d/%d.'
+                % (1 / frames.mean(), np.median(work) * 1000, np.percentile(work, 99) * 1000,
+                   self.slow_animated_frames, self.animated_frames))
+        if len(turns) > 0:
+            text += ' Turn resolution: median %.3f ms, max %.3f ms.' % (np.median(turns) * 1000, turns.max() * 1000)
+        return text
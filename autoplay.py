@@ -0,0 +1,169 @@
+# Autoplay for Tile Strategy: a simple built-in policy that plays the game by itself.
+# Every turn it attacks the weakest enemy next to the player if there is one. Otherwise it walks the shortest path
+# to the nearest potion, or to the stairs once no potion is in reach, going around walls and enemies, and waits if it can't.
+# If the only way to the stairs goes over the down-stairs, it takes them: coming back up, the player is past them.
+# Having come down onto the stairs, it steps off them to take them back up.
+# Press A in the game to turn it on and off. The game then plays as fast as it can and only shows some of the turns
+# (see autoplay_every and autoplay_fps in tile_strategy.py).
+# Run this file to compare the policy with random moves over many games, without a window.
+import random
+import sys
+import time
+from collections import deque
+
+# Same tile and layer numbers as tile_strategy. Importing them would be circular.
+grass = 0
+player = 1
+potion = 4
+stairs = 5
+wall = 6
+down_stairs = 7
+tile = 0
+hp = 1
+ground = 5
+
+directions = {'up': (0, -1), 'down': (0, 1), 'left': (-1, 0), 'right': (1, 0)}
+
+
+# Returns the action to play this turn for a Tile_strategy game: a direction, or None to wait.
+def choose_action(game):
+    # Plain lists are much faster to index one cell at a time than the array.
+    tiles = game.array[:, :, tile].tolist()
+    grounds = game.array[:, :, ground].tolist()
+    width, height = len(tiles), len(tiles[0])
+    x, y = game.player_x, game.player_y
+    weakest = None
+    for direction, (step_x, step_y) in directions.items():
+        to_x, to_y = x + step_x, y + step_y
+        if 0 <= to_x < width and 0 <= to_y < height and tiles[to_x][to_y] in game.enemies:
+            enemy_hp = game.array[to_x, to_y, hp]
+            if weakest is None or enemy_hp < weakest[0]:
+                weakest = (enemy_hp, direction)
+    if weakest is not None:
+        return weakest[1]
+    return (first_step(tiles, grounds, x, y, potion) or first_step(tiles, grounds, x, y, stairs) or
+            first_step(tiles, grounds, x, y, stairs, (grass, down_stairs)) or
+            (grounds[x][y] == stairs and first_step(tiles, grounds, x, y, grass)) or None)
+
+
+# Searches outward from the player over free cells, and returns the first step towards the nearest cell with target
+# on the ground, or None if there's no way there. Cells with other things on the ground than passable are walked around.
+# tiles and grounds are the board's tile and ground layers as nested lists.
+def first_step(tiles, grounds, x, y, target, passable = (grass,)):
+    width, height = len(tiles), len(tiles[0])
+    # first maps every cell reached to the direction of the player's first step on the way to it.
+    first = {(x, y): None}
+    frontier = deque([(x, y)])
+    while frontier:
+        cell_x, cell_y = frontier.popleft()
+        for direction, (step_x, step_y) in directions.items():
+            to_x, to_y = cell_x + step_x, cell_y + step_y
+            if not (0 <= to_x < width and 0 <= to_y < height) or (to_x, to_y) in first:
+                continue
+            if tiles[to_x][to_y] != grass:
+                continue
+            step = first[(cell_x, cell_y)] or direction
+            if grounds[to_x][to_y] == target:
+                return step
+            if grounds[to_x][to_y] not in passable:
+                continue
+            first[(to_x, to_y)] = step
+            frontier.append((to_x, to_y))
+    return None
+
+
+# Plays games with the policy and with random moves, without a window. Games stop at max_turns if they get that far.
+# Returns the average score and turns per second of each, in that order.
+def compare(games = 200, max_turns = 100000, seed = 0):
+    from tile_strategy import Tile_strategy
+    game = Tile_strategy()
+    game.load = False
+    results = []
+    for use_policy in (True, False):
+        random.seed(seed)
+        moves = random.Random(seed + 1)
+        scores = 0
+        turns = 0
+        start = time.perf_counter()
+        for i in range(games):
+            game.setup_game()
+            while not game.is_dead and game.total_turn < max_turns:
+                if use_policy:
+                    game.act(choose_action(game))
+                else:
+                    game.act(moves.choice([None] + list(directions)))
+                game.motions = []
+            scores += game.get_score()
+            turns += game.total_turn
+        results.append((scores / games, turns / (time.perf_counter() - start)))
+    return results
+
+
+# Puts the player of a game that just arrived on a floor into a pocket next to the down-stairs they arrived on:
+# a cell walled in on its other sides, so the only way on is back down. The walls must leave a way from the down-stairs
+# to the stairs. Returns False if no cell next to them will do.
+def make_pocket(game):
+    width, height = game.array.shape[:2]
+    x, y = game.player_x, game.player_y
+    for step_x, step_y in directions.values():
+        pocket_x, pocket_y = x + step_x, y + step_y
+        if not (0 <= pocket_x < width and 0 <= pocket_y < height) or game.array[pocket_x, pocket_y, ground] != grass:
+            continue
+        sides = [(pocket_x + side_x, pocket_y + side_y) for side_x, side_y in directions.values()]
+        sides = [(side_x, side_y) for side_x, side_y in sides
+                 if 0 <= side_x < width and 0 <= side_y < height and (side_x, side_y) != (x, y)]
+        if any(game.array[side_x, side_y, ground] != grass for side_x, side_y in sides):
+            continue
+        # Enemies move out of the way, so only walls count.
+        tiles = [[wall if cell == wall else grass for cell in column] for column in game.array[:, :, tile].tolist()]
+        for side_x, side_y in sides + [(pocket_x, pocket_y)]:
+            tiles[side_x][side_y] = wall
+        if first_step(tiles, game.array[:, :, ground].tolist(), x, y, stairs) is None:
+            continue
+        for side_x, side_y in sides:
+            if game.array[side_x, side_y, tile] in game.enemies:
+                game.enemy_count -= 1
+            game.array[side_x, side_y, tile] = wall
+        if game.array[pocket_x, pocket_y, tile] in game.enemies:
+            game.enemy_count -= 1
+        game.array[x, y, tile] = grass
+        game.array[pocket_x, pocket_y, tile] = player
+        game.player_x, game.player_y = pocket_x, pocket_y
+        return True
+    return False
+
+
+# Walls the player into a pocket next to the down-stairs on arriving at the second floor, in games of its own,
+# and checks that the policy gets out: down the down-stairs and back up. Returns how many pockets it got out of.
+def verify(games = 20, max_turns = 2000, seed = 0):
+    from tile_strategy import Tile_strategy
+    game = Tile_strategy()
+    game.load = False
+    random.seed(seed)
+    pockets = 0
+    for i in range(games):
+        game.setup_game()
+        game.potion_count = 1000
+        floor = game.floor
+        while game.floor == floor and game.total_turn < max_turns:
+            game.act(choose_action(game))
+            game.motions = []
+        if game.floor != floor + 1 or not make_pocket(game):
+            continue
+        start = game.total_turn
+        went_down = False
+        while not (went_down and game.floor == floor + 1):
+            assert game.total_turn - start < max_turns, 'Game %d: autoplay is stuck in a pocket' % i
+            game.act(choose_action(game))
+            game.motions = []
+            went_down = went_down or game.floor == floor
+        pockets += 1
+    return pockets
+
+
+if __name__ == '__main__':
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print('Got out of %d pockets by the down-stairs.' % verify())
+    (policy_score, policy_speed), (random_score, random_speed) = compare(games)
+    print('Average score over %d games: %.0f with autoplay, %.0f with random moves.' % (games, policy_score, random_score))
+    print('Turns per second: %.0f with autoplay, %.0f with random moves.' % (policy_speed, random_speed))
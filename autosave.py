@@ -0,0 +1,83 @@
+# Autosaving for Tile Strategy.
+# Saves are pickled and written on a worker thread, so the game never waits on the disk.
+# Each save goes to a temp file first and is then renamed over the old one, so a crash mid-write leaves the old save intact.
+import os
+import pickle
+import tempfile
+import threading
+
+
+# Writes a game state to path, after the header bytes if there are any (see save_slots.py).
+# The temp file is made in the same folder so the rename never crosses filesystems.
+def write_save(path, game_state, header=b''):
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.save-', suffix='.tmp', dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            pickle.dump(game_state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class Autosaver:
+    # Starts the worker thread. Nothing is written until a game state is submitted.
+    def __init__(self, path):
+        self.path = path
+        self.condition = threading.Condition()
+        # pending is the newest game state that hasn't been written yet. Older unwritten states are simply replaced.
+        self.pending = None
+        self.writing = False
+        self.running = True
+        self.saves = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.work, name='autosave', daemon=True)
+        self.thread.start()
+
+    # Hands a game state, and the header to write before it, to the worker thread and returns right away.
+    # The state must be a snapshot: the game can't change it after submitting.
+    def submit(self, game_state, header=b''):
+        with self.condition:
+            self.pending = (game_state, header)
+            self.condition.notify_all()
+
+    # Blocks until every submitted game state is on disk.
+    def flush(self):
+        with self.condition:
+            while self.pending is not None or self.writing:
+                self.condition.wait()
+
+    # Stops the worker thread. Pending saves are written first unless discard is True.
+    def stop(self, discard=False):
+        with self.condition:
+            if discard:
+                self.pending = None
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+
+    # The worker thread's loop: waits for a game state, then writes it outside of the lock.
+    def work(self):
+        while True:
+            with self.condition:
+                while self.pending is None and self.running:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                game_state, header = self.pending
+                self.pending = None
+                self.writing = True
+            try:
+                write_save(self.path, game_state, header)
+                self.saves += 1
+            except Exception as e:
+                # A failed autosave shouldn't take the game down with it. The next save will try again.
+                self.error = e
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
@@ -0,0 +1,408 @@
+# Bitboard engine for Tile Strategy.
+# The default board is 8 by 8, so each kind of thing on it fits in one 64-bit integer with a bit per cell:
+# the player, the enemies, the walls, the potions, and the stairs. Cell (x, y) is bit x * 8 + y, which is the order
+# Tile_strategy scans the board in. Adjacency becomes shifts and masks, and picking a free cell becomes popcount/select.
+# It plays by the same rules as Tile_strategy, without drawing anything, which makes it suited to search agents and bulk simulation.
+# Run this file to check it against Tile_strategy.
+import random
+import sys
+import time
+from bisect import bisect_right
+from floor_gen import generate_floor
+from tile_strategy import (Tile_strategy, board_width, board_height, up, down, left, right,
+                           grass, player, potion, stairs, wall, down_stairs, tile, hp, atk, exp, ground,
+                           spawn_cooldown, max_enemies, wall_density, wall_passes, state_scalars)
+
+if board_width * board_height != 64:
+    raise ImportError('The bitboard engine needs a board with exactly 64 cells')
+
+full = (1 << 64) - 1
+# Masks of the cells that have a neighbour above (y > 0) and below (y < 7).
+has_up   = sum(1 << (x * board_height + y) for x in range(board_width) for y in range(1, board_height))
+has_down = sum(1 << (x * board_height + y) for x in range(board_width) for y in range(board_height - 1))
+
+
+# Returns the cells next to any of the given cells.
+def neighbors(bits):
+    return ((bits & has_up) >> 1) | ((bits & has_down) << 1) | (bits >> board_height) | ((bits << board_height) & full)
+
+
+# Returns the index of the k-th lowest set bit.
+def select(bits, k):
+    for i in range(k):
+        bits &= bits - 1
+    return (bits & -bits).bit_length() - 1
+
+
+class Bitboard_game:
+    # species is the Species_registry the enemies come from.
+    # rng is anything with randint, randrange and getrandbits, like the random module.
+    def __init__(self, species, rng = random):
+        self.rng = rng
+        self.species_tiles = [int(enemy_type) for enemy_type in species.tiles]
+        self.species_base = species.base.tolist()
+        self.species_growth = species.growth.tolist()
+        # Same EXP curve as Tile_strategy.
+        self.levels = [x + 1 + x * x * 2 for x in range(100)]
+        # Enemy stats, indexed by cell. Only cells with their bit set in enemy_bits mean anything.
+        self.enemy_type = [grass] * 64
+        self.enemy_hp = [0] * 64
+        self.enemy_atk = [0] * 64
+        self.enemy_exp = [0] * 64
+        self.player_bit = 0
+        self.enemy_bits = 0
+        self.wall_bits = 0
+        self.potion_bits = 0
+        self.stairs_bits = 0
+        self.down_bits = 0
+        # Floors the player left, by floor number, as returned by floor_state.
+        self.visited = {}
+
+    # Starts a new game, like Tile_strategy.setup_game.
+    def new_game(self):
+        self.player_x = 0
+        self.player_y = 0
+        self.player_bit = 1
+        self.player_max_hp = 20
+        self.player_hp = self.player_max_hp
+        self.player_atk = 10
+        self.player_exp = 1
+        self.level = 1
+        self.level_ups = 1
+        self.potion_count = 0
+        self.floor = 1
+        self.total_turn = 0
+        self.seed = self.rng.getrandbits(32)
+        self.visited = {}
+        self.build_board()
+        self.enemy_count = 0
+        self.floor_turn = 0
+        self.is_dead = False
+
+    # Returns a copy of the game that can be played on without changing this one.
+    # kind makes the copy a different subclass of Bitboard_game, like one that hashes its state.
+    def clone(self, kind = None):
+        other = Bitboard_game.__new__(kind or type(self))
+        other.__dict__.update(self.__dict__)
+        other.enemy_type = self.enemy_type[:]
+        other.enemy_hp = self.enemy_hp[:]
+        other.enemy_atk = self.enemy_atk[:]
+        other.enemy_exp = self.enemy_exp[:]
+        other.visited = dict(self.visited)
+        return other
+
+    # Builds a bitboard game from the state of a Tile_strategy game. The floors it has cached are not copied.
+    @staticmethod
+    def from_game(game, rng = random):
+        board = Bitboard_game(game.species, rng)
+        for name in state_scalars:
+            setattr(board, name, int(getattr(game, name)))
+        board.is_dead = game.is_dead
+        board.seed = game.seed
+        for x in range(board_width):
+            for y in range(board_height):
+                bit = 1 << (x * board_height + y)
+                cell = game.array[x][y]
+                if cell[tile] == player:
+                    board.player_bit = bit
+                elif cell[tile] == wall:
+                    board.wall_bits |= bit
+                elif cell[tile] != grass:
+                    board.set_enemy(x * board_height + y, int(cell[tile]), int(cell[hp]), int(cell[atk]), int(cell[exp]))
+                if cell[ground] == potion:
+                    board.potion_bits |= bit
+                elif cell[ground] == stairs:
+                    board.stairs_bits |= bit
+                elif cell[ground] == down_stairs:
+                    board.down_bits |= bit
+        return board
+
+    # Writes the board into the tile, hp, atk, exp and ground layers of a Tile_strategy board array.
+    # Layers that only hold leftovers in Tile_strategy (the moved flags, and the stats of empty cells) are left at 0.
+    def to_array(self, array):
+        array.fill(grass)
+        for i in range(64):
+            x, y = divmod(i, board_height)
+            bit = 1 << i
+            if self.player_bit & bit:
+                array[x][y][tile] = player
+            elif self.wall_bits & bit:
+                array[x][y][tile] = wall
+            elif self.enemy_bits & bit:
+                array[x][y][tile] = self.enemy_type[i]
+                array[x][y][hp] = self.enemy_hp[i]
+                array[x][y][atk] = self.enemy_atk[i]
+                array[x][y][exp] = self.enemy_exp[i]
+            if self.potion_bits & bit:
+                array[x][y][ground] = potion
+            elif self.stairs_bits & bit:
+                array[x][y][ground] = stairs
+            elif self.down_bits & bit:
+                array[x][y][ground] = down_stairs
+        return array
+
+    def set_enemy(self, i, enemy_type, enemy_hp, enemy_atk, enemy_exp):
+        self.enemy_bits |= 1 << i
+        self.enemy_type[i] = enemy_type
+        self.enemy_hp[i] = enemy_hp
+        self.enemy_atk[i] = enemy_atk
+        self.enemy_exp[i] = enemy_exp
+
+    # Cells with nothing on them, neither on the tile layer nor on the ground.
+    def free_cells(self):
+        return full & ~(self.player_bit | self.enemy_bits | self.wall_bits | self.potion_bits | self.stairs_bits | self.down_bits)
+
+    # Picks a random free cell with popcount/select. Every free cell is equally likely, just like Tile_strategy.check_tile,
+    # but this takes one random number instead of retrying, and raises instead of spinning forever on a full board.
+    def random_free_cell(self):
+        free = self.free_cells()
+        count = free.bit_count()
+        if count == 0:
+            raise ValueError('There is no free cell on the board')
+        return select(free, self.rng.randrange(count))
+
+    # Creates a blank board for floor number self.floor, from the same seeded layout as Tile_strategy.build_board.
+    def build_board(self):
+        self.enemy_count = 0
+        self.floor_turn = 0
+        self.enemy_bits = 0
+        self.potion_bits = 0
+        plan = generate_floor(self.seed, self.floor, self.player_x, self.player_y, board_width, board_height, wall_density, wall_passes)
+        self.wall_bits = 0
+        for x, y in zip(*plan.walls.nonzero()):
+            self.wall_bits |= 1 << (int(x) * board_height + int(y))
+        self.stairs_bits = 1 << (plan.stairs[0] * board_height + plan.stairs[1])
+        for potion_x, potion_y in plan.potions:
+            self.potion_bits |= 1 << (potion_x * board_height + potion_y)
+        self.down_bits = 0
+        if self.floor > 1:
+            self.down_bits = 1 << (plan.arrival[0] * board_height + plan.arrival[1])
+
+    # The parts of the state that belong to the current floor. The enemy lists are copied, so clones can share the result.
+    def floor_state(self):
+        return (self.enemy_bits, self.enemy_type[:], self.enemy_hp[:], self.enemy_atk[:], self.enemy_exp[:],
+                self.wall_bits, self.potion_bits, self.stairs_bits, self.down_bits, self.floor_turn, self.enemy_count)
+
+    # Goes to another floor, like Tile_strategy.change_floor: floors visited before come back as the player left them.
+    def change_floor(self, floor):
+        self.visited[self.floor] = self.floor_state()
+        going_up = floor > self.floor
+        self.floor = floor
+        if floor not in self.visited:
+            self.build_board()
+            return
+        state = self.visited.pop(floor)
+        (self.enemy_bits, enemy_type, enemy_hp, enemy_atk, enemy_exp,
+         self.wall_bits, self.potion_bits, self.stairs_bits, self.down_bits, self.floor_turn, self.enemy_count) = state
+        self.enemy_type = enemy_type[:]
+        self.enemy_hp = enemy_hp[:]
+        self.enemy_atk = enemy_atk[:]
+        self.enemy_exp = enemy_exp[:]
+        self.player_bit = self.down_bits if going_up else self.stairs_bits
+        i = self.player_bit.bit_length() - 1
+        self.player_x, self.player_y = divmod(i, board_height)
+        # An enemy standing on the stairs is pushed off the floor.
+        if self.enemy_bits & self.player_bit:
+            self.enemy_bits &= ~self.player_bit
+            self.enemy_count -= 1
+
+    # Moves or attacks in the input direction. Returns True if the player did something, like Tile_strategy.check_move.
+    def check_move(self, direction):
+        i = self.player_x * board_height + self.player_y
+        if direction == up and self.player_y > 0:
+            target = i - 1
+        elif direction == down and self.player_y < board_height - 1:
+            target = i + 1
+        elif direction == left and self.player_x > 0:
+            target = i - board_height
+        elif direction == right and self.player_x < board_width - 1:
+            target = i + board_height
+        else:
+            return False
+        if self.enemy_bits >> target & 1:
+            self.player_attack(target)
+        elif self.wall_bits >> target & 1:
+            return False
+        else:
+            self.move_player(target)
+        return True
+
+    def move_player(self, target):
+        bit = 1 << target
+        self.player_bit = bit
+        self.player_x, self.player_y = divmod(target, board_height)
+        if self.potion_bits & bit:
+            self.potion_count += 1
+            self.potion_bits &= ~bit
+        if self.stairs_bits & bit:
+            self.change_floor(self.floor + 1)
+        elif self.down_bits & bit:
+            self.change_floor(self.floor - 1)
+
+    def player_attack(self, target):
+        self.enemy_hp[target] -= self.player_atk
+        if self.enemy_hp[target] <= 0:
+            self.player_exp += self.enemy_exp[target]
+            self.enemy_bits &= ~(1 << target)
+            self.enemy_count -= 1
+        self.level_update()
+
+    # Same as Tile_strategy.level_update: the level is how many EXP thresholds the player has passed.
+    def level_update(self):
+        passed = bisect_right(self.levels, self.player_exp)
+        if passed > 0:
+            self.level = passed
+        level_up = self.level_ups < self.level
+        if level_up:
+            self.level_ups = self.level
+        self.player_atk = 10 + self.level - 1
+        self.player_max_hp = 20 + self.level - 1
+        if level_up:
+            self.player_hp = self.player_max_hp
+
+    def play_turn(self):
+        self.move_enemies()
+        if self.floor_turn % spawn_cooldown == 0 and self.enemy_count < max_enemies:
+            self.spawn_enemy()
+        self.floor_turn += 1
+        self.total_turn += 1
+
+    # Enemies take their turns in board order. Each enemy that was on the board when the turn started acts once:
+    # it attacks the player if they're next to each other, and otherwise steps towards the player.
+    def move_enemies(self):
+        next_to_player = neighbors(self.player_bit)
+        pending = self.enemy_bits
+        while pending:
+            bit = pending & -pending
+            pending ^= bit
+            i = bit.bit_length() - 1
+            if next_to_player & bit:
+                self.player_hp -= self.enemy_atk[i]
+                self.is_dead = self.death_check()
+                continue
+            x, y = divmod(i, board_height)
+            blocked = self.player_bit | self.enemy_bits | self.wall_bits
+            if self.player_y < y and not blocked & (bit >> 1):
+                self.move_enemy(i, i - 1)
+            elif self.player_y > y and not blocked & (bit << 1):
+                self.move_enemy(i, i + 1)
+            elif self.player_x < x and not blocked & (bit >> board_height):
+                self.move_enemy(i, i - board_height)
+            elif self.player_x > x and not blocked & (bit << board_height):
+                self.move_enemy(i, i + board_height)
+
+    def move_enemy(self, i, j):
+        self.enemy_bits ^= (1 << i) | (1 << j)
+        self.enemy_type[j] = self.enemy_type[i]
+        self.enemy_hp[j] = self.enemy_hp[i]
+        self.enemy_atk[j] = self.enemy_atk[i]
+        self.enemy_exp[j] = self.enemy_exp[i]
+
+    # Same as Tile_strategy.death_check, including returning None while the player is still standing.
+    def death_check(self):
+        if self.player_hp <= 0:
+            if self.potion_count > 0:
+                self.player_hp = self.player_max_hp
+                self.potion_count -= 1
+                return False
+            else:
+                return True
+
+    def spawn_enemy(self):
+        if not self.free_cells():
+            return
+        row = self.rng.randint(0, len(self.species_tiles) - 1)
+        scale = self.total_turn // 5 + self.floor
+        enemy_hp = self.species_base[row][0] + self.species_growth[row][0] * scale
+        enemy_atk = self.species_base[row][1] + self.species_growth[row][1] * scale
+        i = self.random_free_cell()
+        self.set_enemy(i, self.species_tiles[row], enemy_hp, enemy_atk, (enemy_hp + enemy_atk) // 2)
+        self.enemy_count += 1
+
+
+# A bitboard game that picks free cells by retrying random cells, exactly like Tile_strategy.check_tile.
+# Given the same random numbers, it plays out the exact same game as Tile_strategy, which is what verify relies on.
+class Rejection_sampling_game(Bitboard_game):
+    def random_free_cell(self):
+        free = self.free_cells()
+        while True:
+            x = self.rng.randint(0, board_width - 1)
+            y = self.rng.randint(0, board_height - 1)
+            if free >> (x * board_height + y) & 1:
+                return x * board_height + y
+
+
+# Returns a list of differences between a Tile_strategy game and a bitboard game. Empty if they match.
+def compare(game, board):
+    differences = []
+    for name in state_scalars:
+        if int(getattr(game, name)) != getattr(board, name):
+            differences.append('%s: %d != %d' % (name, getattr(game, name), getattr(board, name)))
+    if bool(game.is_dead) != bool(board.is_dead):
+        differences.append('is_dead: %s != %s' % (game.is_dead, board.is_dead))
+    array = board.to_array(game.array.copy())
+    for layer in (tile, ground):
+        if (game.array[:, :, layer] != array[:, :, layer]).any():
+            differences.append('layer %d differs' % layer)
+    enemies = (game.array[:, :, tile] > player) & (game.array[:, :, tile] != wall)
+    for layer in (hp, atk, exp):
+        if (game.array[:, :, layer][enemies] != array[:, :, layer][enemies]).any():
+            differences.append('enemy layer %d differs' % layer)
+    return differences
+
+
+# Plays random games on Tile_strategy and a bitboard game side by side, feeding both the same random numbers,
+# and checks after every move that they are still in the same state. Raises an AssertionError on the first difference.
+def verify(games = 100, max_turns = 2000, seed = 0):
+    random.seed(seed)
+    policy = random.Random(seed + 1)
+    actions = [up, down, left, right, None]
+    turns = 0
+    for g in range(games):
+        game = Tile_strategy()
+        game.load = False
+        board = Rejection_sampling_game(game.species)
+        state = random.getstate()
+        game.setup_game()
+        random.setstate(state)
+        board.new_game()
+        for turn in range(max_turns):
+            if game.is_dead:
+                break
+            action = policy.choice(actions)
+            state = random.getstate()
+            if action is None or game.check_move(action):
+                game.play_turn()
+            after = random.getstate()
+            random.setstate(state)
+            if action is None or board.check_move(action):
+                board.play_turn()
+            differences = compare(game, board)
+            if random.getstate() != after:
+                differences.append('used different random numbers')
+            assert not differences, 'Game %d, turn %d: %s' % (g, game.total_turn, ', '.join(differences))
+            turns += 1
+    return turns
+
+
+# Times random play on the bitboard engine, in turns per second.
+def benchmark(turns = 200000, seed = 0):
+    rng = random.Random(seed)
+    species = Tile_strategy().species
+    board = Bitboard_game(species, rng)
+    board.new_game()
+    actions = [up, down, left, right, None]
+    start = time.perf_counter()
+    for i in range(turns):
+        if board.is_dead:
+            board.new_game()
+        action = rng.choice(actions)
+        if action is None or board.check_move(action):
+            board.play_turn()
+    return turns / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print('Checked %d turns against Tile_strategy.' % verify(games))
+    print('Bitboard engine: %.0f turns per second.' % benchmark())
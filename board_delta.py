@@ -0,0 +1,97 @@
+# Board deltas for Tile Strategy.
+# A delta holds only what changed during one turn: the board cells whose values changed and the player values that changed.
+# They are small enough to send to a renderer, a spectator, a journal or a replay file every turn instead of the full state.
+import struct
+import numpy as np
+
+# Byte layout of an encoded delta: turn, number of changed cells, values per cell, number of changed player values, index width.
+header = struct.Struct('<IIBBB')
+scalar_entry = struct.Struct('<Bq')
+
+
+class Board_delta:
+    # cells holds the flat indices of the changed cells, values holds every layer of those cells after the turn.
+    # scalars is a list of (index, value) pairs for the player values that changed.
+    def __init__(self, turn, cells, values, scalars):
+        self.turn = turn
+        self.cells = cells
+        self.values = values
+        self.scalars = scalars
+
+    # Returns True if nothing changed during the turn.
+    def is_empty(self):
+        return len(self.cells) == 0 and len(self.scalars) == 0
+
+    # Writes the changes onto a board array and a list of player values, in place.
+    def apply(self, array, scalars):
+        layers = array.shape[-1]
+        array.reshape(-1, layers)[self.cells] = self.values
+        for index, value in self.scalars:
+            scalars[index] = value
+        return array, scalars
+
+    # Packs the delta into bytes. Cell indices take 2 bytes each unless the board has more than 65536 cells.
+    def to_bytes(self):
+        index_type = np.uint16 if len(self.cells) == 0 or self.cells.max() < 65536 else np.uint32
+        layers = self.values.shape[1] if self.values.ndim == 2 else 0
+        data = [header.pack(self.turn, len(self.cells), layers, len(self.scalars), np.dtype(index_type).itemsize)]
+        data.append(self.cells.astype(index_type).tobytes())
+        data.append(self.values.astype(np.int32).tobytes())
+        for index, value in self.scalars:
+            data.append(scalar_entry.pack(index, value))
+        return b''.join(data)
+
+    # Rebuilds a delta from the bytes made by to_bytes.
+    @staticmethod
+    def from_bytes(data):
+        turn, num_cells, layers, num_scalars, index_size = header.unpack_from(data, 0)
+        offset = header.size
+        index_type = np.uint16 if index_size == 2 else np.uint32
+        cells = np.frombuffer(data, dtype=index_type, count=num_cells, offset=offset).astype(np.intp)
+        offset += num_cells * index_size
+        values = np.frombuffer(data, dtype=np.int32, count=num_cells * layers, offset=offset)
+        values = values.reshape(num_cells, layers).astype(int)
+        offset += num_cells * layers * 4
+        scalars = []
+        for i in range(num_scalars):
+            scalars.append(scalar_entry.unpack_from(data, offset))
+            offset += scalar_entry.size
+        return Board_delta(turn, cells, values, scalars)
+
+
+# Compares the board and player values before and after a turn and returns the delta between them.
+# A cell counts as changed if any of its layers changed; the whole cell is stored so the delta can be applied on its own.
+def encode(turn, old_array, new_array, old_scalars, new_scalars):
+    layers = new_array.shape[-1]
+    old_cells = old_array.reshape(-1, layers)
+    new_cells = new_array.reshape(-1, layers)
+    cells = np.flatnonzero((old_cells != new_cells).any(axis=1))
+    values = new_cells[cells].copy()
+    scalars = [(i, int(new_scalars[i])) for i in range(len(new_scalars)) if old_scalars[i] != new_scalars[i]]
+    return Board_delta(turn, cells, values, scalars)
+
+
+# Returns the delta that undoes a turn: the same cells and player values, with the values they had before it.
+# old_array and old_scalars are the board and player values before the turn.
+def reverse(delta, old_array, old_scalars):
+    layers = old_array.shape[-1]
+    values = old_array.reshape(-1, layers)[delta.cells].copy()
+    scalars = [(index, int(old_scalars[index])) for index, value in delta.scalars]
+    return Board_delta(delta.turn - 1, delta.cells, values, scalars)
+
+
+# Returns a new board array and list of player values with the delta applied, leaving the originals alone.
+def decode(delta, old_array, old_scalars):
+    return delta.apply(old_array.copy(), list(old_scalars))
+
+
+# Round-trip check: packs the delta to bytes, unpacks it, applies it to the old state, and makes sure the new state comes out.
+# Raises a ValueError if anything is lost on the way.
+def verify(delta, old_array, new_array, old_scalars, new_scalars):
+    decoded = Board_delta.from_bytes(delta.to_bytes())
+    array, scalars = decode(decoded, old_array, old_scalars)
+    if decoded.turn != delta.turn or not np.array_equal(array, new_array):
+        raise ValueError('Board delta for turn %d does not reproduce the board' % delta.turn)
+    if [int(value) for value in scalars] != [int(value) for value in new_scalars]:
+        raise ValueError('Board delta for turn %d does not reproduce the player values' % delta.turn)
+    return True
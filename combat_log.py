@@ -0,0 +1,72 @@
+# Combat log for Tile Strategy.
+# Combat events are written into a fixed-size ring buffer instead of being printed as they happen.
+# Printing, or sending events anywhere else, is left to optional sinks that receive events in batches.
+import numpy as np
+
+# Kinds of combat events
+hit = 0
+potion_used = 1
+
+# Each event is one row: the turn it happened on, what happened, who attacked whom, the damage dealt,
+# whether the target died, the exp gained, and for potions, how many potions were left.
+event_dtype = np.dtype([('turn', np.int64), ('kind', np.int8), ('attacker', np.int16), ('target', np.int16),
+                        ('damage', np.int32), ('kill', np.bool_), ('exp', np.int32), ('potions', np.int32)])
+
+
+class Combat_log:
+    # size is how many events are kept. batch is how many new events are collected before the sinks get them.
+    def __init__(self, size = 256, batch = 32):
+        self.events = np.zeros(size, dtype = event_dtype)
+        self.batch = batch
+        # count is the number of events ever recorded, flushed is how many of them were handed to the sinks.
+        self.count = 0
+        self.flushed = 0
+        self.sinks = []
+        # Events before start are gone for good, and high is the most events there ever were. Both only matter after rewind.
+        self.start = 0
+        self.high = 0
+
+    def __len__(self):
+        return min(self.count - self.start, len(self.events))
+
+    # Adds a sink: a function called with an array of new events whenever the log is flushed.
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    # Records a combat event. The oldest event is overwritten once the buffer is full.
+    def record(self, turn, kind, attacker, target, damage = 0, kill = False, exp = 0, potions = 0):
+        self.events[self.count % len(self.events)] = (turn, kind, attacker, target, damage, kill, exp, potions)
+        self.count += 1
+        self.high = max(self.high, self.count)
+        if self.sinks and self.count - self.flushed >= self.batch:
+            self.flush()
+
+    # Returns the most recent event, or None if nothing has happened yet.
+    def last(self):
+        if self.count == self.start:
+            return None
+        return self.events[(self.count - 1) % len(self.events)]
+
+    # Returns the last n events that are still in the buffer, oldest first.
+    def recent(self, n):
+        n = min(n, len(self))
+        indices = np.arange(self.count - n, self.count) % len(self.events)
+        return self.events[indices]
+
+    # Sets the log back to when count events had been recorded, like when turns are taken back,
+    # or forward again up to the most there were, as long as nothing was recorded in between.
+    # Events the buffer overwrote since can't come back. Events after count go to the sinks again if they come back.
+    def rewind(self, count):
+        self.start = min(count, max(self.start, self.high - len(self.events)))
+        self.count = count
+        self.flushed = min(self.flushed, count)
+
+    # Hands every event recorded since the last flush to the sinks.
+    # Events that were overwritten before a flush are lost, which only happens when batch is larger than the buffer.
+    def flush(self):
+        pending = self.count - self.flushed
+        self.flushed = self.count
+        if pending > 0 and self.sinks:
+            events = self.recent(pending)
+            for sink in self.sinks:
+                sink(events)
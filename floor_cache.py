@@ -0,0 +1,124 @@
+# Cache of visited floors for Tile Strategy.
+# Floors the player has left are kept so they can be visited again through the down-stairs.
+# The most recently left floors stay in memory as full board arrays, up to a budget in bytes. Past the budget,
+# the floor left the longest ago is evicted: written to a compressed .npz file if the cache has a spill directory,
+# and otherwise shrunk to a board delta against the floor as it was generated, which can be generated again from the seed.
+import os
+from collections import OrderedDict
+import numpy as np
+import board_delta
+
+
+class Floor_cache:
+    # rebuild is a function that takes the arguments a floor was generated with and returns its board array as generated.
+    # budget is how many bytes of board arrays are kept in memory.
+    # With spill_dir, evicted floors are written to files there instead of being kept as deltas.
+    def __init__(self, rebuild, budget = 1 << 16, spill_dir = None):
+        self.rebuild = rebuild
+        self.budget = budget
+        self.spill_dir = spill_dir
+        # Spilled files are named after the process and the cache, so games sharing the directory keep their own floors.
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok = True)
+        self.spill_prefix = 'floor_%d_%x_' % (os.getpid(), id(self))
+        # Floors in memory as (array, values, args), the one left the longest ago first.
+        self.floors = OrderedDict()
+        # Evicted floors as (data, values, args), where data is either the path of the file or the bytes of the delta.
+        self.evicted = {}
+        # size counts the bytes of the arrays in memory, delta_size the bytes of the deltas.
+        self.size = 0
+        self.delta_size = 0
+        self.spills = 0
+        self.rebuilds = 0
+
+    def __contains__(self, floor):
+        return floor in self.floors or floor in self.evicted
+
+    def __len__(self):
+        return len(self.floors) + len(self.evicted)
+
+    # Keeps a floor the player is leaving. values are the per-floor numbers that go with the board, like its turn count.
+    # args are the arguments the floor was generated with. The array is kept as it is, so pass a copy.
+    def store(self, floor, array, values, args):
+        self.discard(floor)
+        self.floors[floor] = (array, list(values), args)
+        self.size += array.nbytes
+        while self.size > self.budget and self.floors:
+            self.evict()
+
+    # Returns the (array, values, args) of a floor and removes it from the cache, or None if the floor isn't cached.
+    def take(self, floor):
+        cached = self.peek(floor)
+        self.discard(floor)
+        return cached
+
+    # Same as take, but leaves the floor in the cache.
+    def peek(self, floor):
+        if floor in self.floors:
+            array, values, args = self.floors[floor]
+            return array.copy(), list(values), args
+        if floor not in self.evicted:
+            return None
+        data, values, args = self.evicted[floor]
+        if isinstance(data, str):
+            with np.load(data) as snapshot:
+                array = snapshot['array']
+        else:
+            self.rebuilds += 1
+            array = self.rebuild(args)
+            board_delta.Board_delta.from_bytes(data).apply(array, [])
+        return array, list(values), args
+
+    # Returns every cached floor as a dict of floor number to (delta, values, args), like for a replay keyframe.
+    # Deltas keep it small, since a floor usually differs from its generated layout in only a few cells.
+    def snapshot(self):
+        floors = {}
+        for floor, (array, values, args) in self.floors.items():
+            floors[floor] = (self.encode(array, args), list(values), args)
+        for floor, (data, values, args) in self.evicted.items():
+            if isinstance(data, str):
+                data = self.encode(self.peek(floor)[0], args)
+            floors[floor] = (data, list(values), args)
+        return floors
+
+    # Replaces the cached floors with the ones from a snapshot. They stay deltas until they're taken.
+    def restore(self, floors):
+        self.clear()
+        for floor, (data, values, args) in floors.items():
+            self.evicted[floor] = (data, list(values), args)
+            self.delta_size += len(data)
+
+    # Packs a floor's board as a delta against its generated layout.
+    def encode(self, array, args):
+        return board_delta.encode(0, self.rebuild(args), array, [], []).to_bytes()
+
+    # Moves the floor left the longest ago out of memory.
+    def evict(self):
+        floor, (array, values, args) = self.floors.popitem(last = False)
+        self.size -= array.nbytes
+        if self.spill_dir is not None:
+            path = os.path.join(self.spill_dir, '%s%d.npz' % (self.spill_prefix, floor))
+            np.savez_compressed(path, array = array)
+            self.spills += 1
+            self.evicted[floor] = (path, values, args)
+        else:
+            data = self.encode(array, args)
+            self.delta_size += len(data)
+            self.evicted[floor] = (data, values, args)
+
+    # Forgets a floor, deleting its file if it was spilled.
+    def discard(self, floor):
+        if floor in self.floors:
+            self.size -= self.floors.pop(floor)[0].nbytes
+        elif floor in self.evicted:
+            data = self.evicted.pop(floor)[0]
+            if isinstance(data, str):
+                if os.path.exists(data):
+                    os.remove(data)
+            else:
+                self.delta_size -= len(data)
+
+    # Forgets every floor, like when a new game starts.
+    def clear(self):
+        for floor in list(self.floors) + list(self.evicted):
+            self.discard(floor)
@@ -0,0 +1,162 @@
+# Floor generation for Tile Strategy.
+# A floor's layout depends only on the game's seed, the floor number and where the player arrives,
+# so it can be generated ahead of time, on another thread or process, while the player is still on the floor before.
+# Walls are made with NumPy: random noise smoothed by cellular automaton passes. A connectivity pass then walls off
+# anything the player can't reach, and the stairs and potions are only placed where the player can get to them.
+# Run this file to time the generation of a large floor.
+import random
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# SciPy labels regions faster, but isn't needed.
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
+
+
+# The layout of a floor: the cell of the stairs and the cells of the potions, as (x, y) pairs,
+# a boolean array that is True where there are walls, and the cell the player arrives on.
+class Floor_plan:
+    def __init__(self, stairs, potions, walls, arrival):
+        self.stairs = stairs
+        self.potions = potions
+        self.walls = walls
+        self.arrival = arrival
+
+
+# Makes walls: each cell starts as a wall with the given chance, then each pass of the cellular automaton
+# turns a cell into a wall if at least 5 of its 8 neighbours are walls, and keeps it a wall if at least 4 are.
+# A few passes turn noise into caves. Cells outside the board count as open.
+def generate_walls(rng, width, height, density, passes):
+    walls = rng.random((width, height)) < density
+    for i in range(passes):
+        padded = np.pad(walls, 1).astype(np.uint8)
+        neighbours = (padded[:-2, :-2] + padded[:-2, 1:-1] + padded[:-2, 2:] +
+                      padded[1:-1, :-2] + padded[1:-1, 2:] +
+                      padded[2:, :-2] + padded[2:, 1:-1] + padded[2:, 2:])
+        walls = (neighbours >= 5) | (walls & (neighbours >= 4))
+    return walls
+
+
+# Labels the open regions of a board: cells that can reach each other through up, down, left and right moves share a label.
+# Walls get the label -1.
+def label_regions(open_cells):
+    if ndimage is not None:
+        labels, count = ndimage.label(open_cells)
+        return np.where(open_cells, labels, -1)
+    # Splits every column of cells (fixed x) into runs of open cells, then joins runs that touch in neighbouring columns
+    # with a union-find where every round is a couple of array operations.
+    starts = open_cells & ~np.pad(open_cells, ((0, 0), (1, 0)))[:, :-1]
+    run_ids = np.cumsum(starts.ravel(), dtype = np.int32).reshape(open_cells.shape) - 1
+    count = int(starts.sum())
+    touching = open_cells[:-1] & open_cells[1:]
+    a = run_ids[:-1][touching]
+    b = run_ids[1:][touching]
+    # Two runs usually touch along several cells in a row. Only one link per stretch is kept.
+    first = np.ones(len(a), dtype = bool)
+    first[1:] = (a[1:] != a[:-1]) | (b[1:] != b[:-1])
+    a = a[first]
+    b = b[first]
+    parent = np.arange(count)
+    while True:
+        parent_a = parent[a]
+        parent_b = parent[b]
+        joined = np.minimum(parent_a, parent_b)
+        if (parent_a == parent_b).all():
+            break
+        np.minimum.at(parent, parent_a, joined)
+        np.minimum.at(parent, parent_b, joined)
+        while True:
+            jumped = parent[parent]
+            if (jumped == parent).all():
+                break
+            parent = jumped
+    return np.where(open_cells, parent[run_ids] if count else -1, -1)
+
+
+# Returns a boolean array of the open cells reachable from (x, y).
+def reachable_from(walls, x, y):
+    labels = label_regions(~walls)
+    return labels == labels[x, y]
+
+
+# Every floor of a game gets its own random numbers, made from the game's seed and the floor number.
+def floor_seed(seed, floor):
+    return seed * 65536 + floor
+
+
+# Generates the layout of a floor. The player's cell is kept free, and everything is placed where the player can reach it.
+# Higher floors are likely to have more potions.
+def generate_floor(seed, floor, player_x, player_y, width, height, wall_density = 0.0, wall_passes = 0):
+    rng = random.Random(floor_seed(seed, floor))
+    walls = generate_walls(np.random.default_rng(floor_seed(seed, floor)), width, height, wall_density, wall_passes)
+    walls[player_x, player_y] = False
+    # Open cells the player can't get to are filled in, so nothing gets placed or spawned there.
+    walls |= ~reachable_from(walls, player_x, player_y)
+    free_count = width * height - int(walls.sum()) - 1
+    taken = {(player_x, player_y)}
+    # Picks random cells until it finds one that's free.
+    def free_cell():
+        while True:
+            x = rng.randint(0, width - 1)
+            y = rng.randint(0, height - 1)
+            if (x, y) not in taken and not walls[x, y]:
+                taken.add((x, y))
+                return x, y
+    # If the walls leave no room for the stairs, the floor is left without walls.
+    if free_count < 1:
+        walls[:] = False
+        free_count = width * height - 1
+    stairs = free_cell()
+    num_potions = min(rng.randint(0, (floor - 1) // 2), free_count - 1)
+    potions = [free_cell() for i in range(num_potions)]
+    return Floor_plan(stairs, potions, walls, (player_x, player_y))
+
+
+# Generates the next floor in the background while the current one is being played.
+class Floor_pregenerator:
+    # With use_processes the floor is generated in another process, for maps big enough to be worth it.
+    def __init__(self, use_processes = False):
+        if use_processes:
+            self.executor = ProcessPoolExecutor(max_workers = 1)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'floor_gen')
+        self.future = None
+        self.args = None
+        # ready counts floors that were generated ahead of time, missed counts those that had to be generated on the spot.
+        self.ready = 0
+        self.missed = 0
+
+    # Starts generating a floor in the background. Replaces any floor that was requested before.
+    # Takes the same arguments as generate_floor.
+    def request(self, *args):
+        if self.future is not None:
+            self.future.cancel()
+        self.args = args
+        self.future = self.executor.submit(generate_floor, *args)
+
+    # Returns the layout of a floor. If it was requested, this waits for it (usually it's long done);
+    # otherwise it's generated right away. Either way the result is the same.
+    def take(self, *args):
+        future = self.future
+        self.future = None
+        if future is not None and self.args == args and not future.cancelled():
+            self.ready += 1
+            return future.result()
+        if future is not None:
+            future.cancel()
+        self.missed += 1
+        return generate_floor(*args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait = False, cancel_futures = True)
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    start = time.perf_counter()
+    plan = generate_floor(1, 10, 0, 0, size, size, wall_density = 0.45, wall_passes = 4)
+    print('Generated a %dx%d floor in %.1f ms (%.0f%% walls).' % (size, size, (time.perf_counter() - start) * 1000, plan.walls.mean() * 100))
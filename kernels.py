@@ -0,0 +1,216 @@
+# Compiled turn kernels for Tile Strategy.
+# The enemy turn (the board scan, the adjacency test, enemy moves and attacks) and the player's attack are written here
+# as plain loops over the board array. When Numba is installed they are compiled to machine code;
+# otherwise they run as ordinary Python and Tile_strategy keeps using its own loops, which these kernels must match exactly.
+# Run this file to check the kernels against Tile_strategy over random games, and to time both.
+import random
+import sys
+import time
+
+# Numba compiles the kernels, but isn't needed.
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# True when the kernels are compiled. Tile_strategy only uses them then.
+compiled = njit is not None
+
+# Same tile and layer numbers as tile_strategy. Importing them would be circular.
+grass = 0
+player = 1
+tile = 0
+hp = 1
+atk = 2
+exp = 3
+moved = 4
+
+# Event kinds, same as combat_log, and motion kinds.
+hit = 0
+potion_used = 1
+move_motion = 0
+attack_motion = 1
+
+
+def jit(function):
+    if njit is None:
+        return function
+    return njit(cache = True)(function)
+
+
+# Returns True if the player is right above, below, left or right of cell (x, y).
+@jit
+def player_is_adjacent(array, x, y):
+    width = array.shape[0]
+    height = array.shape[1]
+    return ((y > 0 and array[x, y - 1, tile] == player) or
+            (y < height - 1 and array[x, y + 1, tile] == player) or
+            (x > 0 and array[x - 1, y, tile] == player) or
+            (x < width - 1 and array[x + 1, y, tile] == player))
+
+
+# Moves the enemy in cell (x, y) to cell (to_x, to_y), with its stats and moved flag.
+@jit
+def move_enemy(array, x, y, to_x, to_y):
+    for layer in range(moved + 1):
+        array[to_x, to_y, layer] = array[x, y, layer]
+    array[x, y, tile] = grass
+
+
+# The enemy turn, like Tile_strategy.move_enemies: every enemy that hasn't moved yet attacks the player if it's next to them,
+# and otherwise takes a step towards them if it can see them. is_enemy is indexed by tile value,
+# and sees_player is True for the cells the player can be seen from.
+# What happened is written into events, one row per combat event (kind, attacker, damage, kill flag or potions left),
+# and motions, one row per move or attack (kind, x, y, to_x, to_y). Both need room for two rows per cell.
+# Returns the player's hp and potions after the turn, whether the player is dead, and how many events and motions there were.
+@jit
+def enemy_turn(array, is_enemy, sees_player, player_x, player_y, player_hp, player_max_hp, potion_count, events, motions):
+    width = array.shape[0]
+    height = array.shape[1]
+    event_count = 0
+    motion_count = 0
+    dead = False
+    for x in range(width):
+        for y in range(height):
+            array[x, y, moved] = 0
+    for x in range(width):
+        for y in range(height):
+            enemy_type = array[x, y, tile]
+            if enemy_type >= len(is_enemy) or not is_enemy[enemy_type] or array[x, y, moved] != 0:
+                continue
+            array[x, y, moved] = 1
+            if player_is_adjacent(array, x, y):
+                motions[motion_count, 0] = attack_motion
+                motions[motion_count, 1] = x
+                motions[motion_count, 2] = y
+                motions[motion_count, 3] = player_x
+                motions[motion_count, 4] = player_y
+                motion_count += 1
+                player_hp -= array[x, y, atk]
+                events[event_count, 0] = hit
+                events[event_count, 1] = enemy_type
+                events[event_count, 2] = array[x, y, atk]
+                events[event_count, 3] = player_hp <= 0 and potion_count == 0
+                event_count += 1
+                # A potion saves the player if they have one.
+                dead = False
+                if player_hp <= 0:
+                    if potion_count > 0:
+                        player_hp = player_max_hp
+                        potion_count -= 1
+                        events[event_count, 0] = potion_used
+                        events[event_count, 1] = player
+                        events[event_count, 2] = 0
+                        events[event_count, 3] = potion_count
+                        event_count += 1
+                    else:
+                        dead = True
+                continue
+            if not sees_player[x, y]:
+                continue
+            to_x = x
+            to_y = y
+            if player_y < y and array[x, y - 1, tile] == grass:
+                to_y = y - 1
+            elif player_y > y and array[x, y + 1, tile] == grass:
+                to_y = y + 1
+            elif player_x < x and array[x - 1, y, tile] == grass:
+                to_x = x - 1
+            elif player_x > x and array[x + 1, y, tile] == grass:
+                to_x = x + 1
+            else:
+                continue
+            move_enemy(array, x, y, to_x, to_y)
+            motions[motion_count, 0] = move_motion
+            motions[motion_count, 1] = x
+            motions[motion_count, 2] = y
+            motions[motion_count, 3] = to_x
+            motions[motion_count, 4] = to_y
+            motion_count += 1
+    return player_hp, potion_count, dead, event_count, motion_count
+
+
+# The player hits the enemy in cell (x, y), like Tile_strategy.player_attack.
+# Returns the enemy's type, whether it died, and the exp it gave.
+@jit
+def resolve_attack(array, x, y, player_atk):
+    enemy_type = array[x, y, tile]
+    array[x, y, hp] -= player_atk
+    killed = array[x, y, hp] <= 0
+    gained_exp = 0
+    if killed:
+        gained_exp = array[x, y, exp]
+        array[x, y, tile] = grass
+    return enemy_type, killed, gained_exp
+
+
+# Plays random games side by side, one on Tile_strategy's own loops and one on the kernels, with the same random numbers,
+# and checks after every turn that the board, the player values, the combat log and the motions are identical.
+# Every other game is played with fog of war. Without Numba this checks the kernels as plain Python, which is the same code Numba compiles.
+def verify(games = 200, max_turns = 500, seed = 0):
+    from tile_strategy import Tile_strategy, up, down, left, right
+    random.seed(seed)
+    policy = random.Random(seed + 1)
+    actions = [up, down, left, right, None]
+    turns = 0
+    for g in range(games):
+        reference = Tile_strategy()
+        reference.load = False
+        reference.use_kernels = False
+        game = Tile_strategy()
+        game.load = False
+        game.use_kernels = True
+        reference.fog_of_war = game.fog_of_war = g % 2 == 1
+        state = random.getstate()
+        reference.setup_game()
+        random.setstate(state)
+        game.setup_game()
+        for turn in range(max_turns):
+            if reference.is_dead:
+                break
+            action = policy.choice(actions)
+            state = random.getstate()
+            played = reference.act(action)
+            reference_motions, reference.motions = reference.motions, []
+            after = random.getstate()
+            random.setstate(state)
+            assert game.act(action) == played, 'Game %d, turn %d: the action played differently' % (g, turn)
+            motions, game.motions = game.motions, []
+            assert random.getstate() == after, 'Game %d, turn %d: used different random numbers' % (g, turn)
+            assert (reference.array == game.array).all(), 'Game %d, turn %d: boards differ' % (g, turn)
+            assert reference.get_scalars() == game.get_scalars(), 'Game %d, turn %d: player values differ' % (g, turn)
+            assert bool(reference.is_dead) == bool(game.is_dead), 'Game %d, turn %d: is_dead differs' % (g, turn)
+            assert reference_motions == motions, 'Game %d, turn %d: motions differ' % (g, turn)
+            assert reference.combat_log.count == game.combat_log.count, 'Game %d, turn %d: combat logs differ' % (g, turn)
+            assert (reference.combat_log.recent(64) == game.combat_log.recent(64)).all(), 'Game %d, turn %d: combat logs differ' % (g, turn)
+            turns += 1
+    return turns
+
+
+# Times random play with Tile_strategy's loops and with the kernels, in turns per second.
+def benchmark(turns = 20000, seed = 0):
+    from tile_strategy import Tile_strategy, up, down, left, right
+    speeds = []
+    for use_kernels in (False, True):
+        random.seed(seed)
+        policy = random.Random(seed + 1)
+        game = Tile_strategy()
+        game.load = False
+        game.use_kernels = use_kernels
+        game.setup_game()
+        start = time.perf_counter()
+        for i in range(turns):
+            if game.is_dead:
+                game.setup_game()
+            game.act(policy.choice([up, down, left, right, None]))
+            game.motions = []
+        speeds.append(turns / (time.perf_counter() - start))
+    return speeds
+
+
+if __name__ == '__main__':
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print('Numba is %s.' % ('installed, kernels are compiled' if compiled else 'not installed, kernels run as Python'))
+    print('Checked %d turns of the kernels against Tile_strategy.' % verify(games))
+    python_speed, kernel_speed = benchmark()
+    print('Turns per second: %.0f with Tile_strategy loops, %.0f with the kernels.' % (python_speed, kernel_speed))
@@ -0,0 +1,118 @@
+# Input-to-photon latency for Tile Strategy.
+# With measure_latency on in tile_strategy.py, every key press that plays a turn is timed through the game loop:
+# from the moment it comes out of pygame.event.get, until check_move is done with the player's move, until play_turn is
+# done with the rest of the turn, until the screen is drawn, and until pygame.display.update returns and the frame is on
+# its way to the screen. A wait has no move, so its check_move time is when act started on it.
+# A key pressed while the loop sleeps in clock.tick waits in the queue before any of that, and that wait can't be seen
+# from here, so the time every frame spent in clock.tick is kept too: a key waits at most that long.
+# Times go into histograms whose buckets each get sqrt(2) times wider, so they take the same memory however long
+# the game runs, and they're printed when the game is over or quit.
+# Run this file to play with latency measured.
+import math
+import time
+import numpy as np
+
+# The stages an input is timed to, and the clock.tick wait.
+stages = ('check_move', 'play_turn', 'draw', 'update', 'tick')
+# Buckets start at smallest seconds and each one is growth times wider than the one before.
+smallest = 0.00005
+growth = math.sqrt(2)
+buckets = 36
+
+
+# Returns the bucket of a time in seconds. The first and last buckets also hold anything below or above them.
+def bucket(seconds):
+    if seconds <= smallest:
+        return 0
+    return min(buckets - 1, int(math.log(seconds / smallest, growth)) + 1)
+
+
+# Returns the time in seconds where bucket i starts.
+def bucket_start(i):
+    return 0.0 if i == 0 else smallest * growth ** (i - 1)
+
+
+class Latency_probe:
+    def __init__(self):
+        self.counts = np.zeros((len(stages), buckets), dtype = np.int64)
+        self.totals = np.zeros(len(stages))
+        self.maxima = np.zeros(len(stages))
+        # Key press times of the inputs played this frame, and when their moves and turns were done.
+        self.pressed = []
+        self.acted_times = []
+        self.moved_time = None
+        self.played_time = None
+        self.drawn_time = None
+
+    def add(self, stage, seconds):
+        i = stages.index(stage)
+        self.counts[i, bucket(seconds)] += 1
+        self.totals[i] += seconds
+        self.maxima[i] = max(self.maxima[i], seconds)
+
+    # Called by act once check_move is done, and once play_turn is done. Turns autoplay plays call them too,
+    # but only a turn played by a key press is kept, by acted.
+    def moved(self):
+        self.moved_time = time.perf_counter()
+
+    def played(self):
+        self.played_time = time.perf_counter()
+
+    # Called once a key press has played its turn. key_time is when it came out of pygame.event.get.
+    def acted(self, key_time):
+        self.pressed.append(key_time)
+        self.acted_times.append((self.moved_time, self.played_time))
+
+    # Called once the frame is drawn, before display.update.
+    def drawn(self):
+        self.drawn_time = time.perf_counter()
+
+    # Called once display.update returns. Every input played this frame is done.
+    def shown(self):
+        now = time.perf_counter()
+        for key_time, (moved_time, played_time) in zip(self.pressed, self.acted_times):
+            self.add('check_move', moved_time - key_time)
+            self.add('play_turn', played_time - key_time)
+            self.add('draw', self.drawn_time - key_time)
+            self.add('update', now - key_time)
+        self.pressed = []
+        self.acted_times = []
+
+    # Called with how long the frame slept in clock.tick.
+    def ticked(self, seconds):
+        self.add('tick', seconds)
+
+    # Returns the time in seconds below which the given fraction of a stage's times are, to the end of its bucket.
+    def percentile(self, stage, fraction):
+        counts = self.counts[stages.index(stage)]
+        total = counts.sum()
+        if total == 0:
+            return 0.0
+        i = int(np.searchsorted(np.cumsum(counts), fraction * total))
+        return min(bucket_start(i + 1), self.maxima[stages.index(stage)])
+
+    # Returns a report: a summary line per stage, then a histogram of the time from key press to display.update.
+    def report(self, width = 40):
+        lines = []
+        for i, stage in enumerate(stages):
+            count = self.counts[i].sum()
+            if count == 0:
+                continue
+            lines.append('%-10s %6d times: mean %7.2f ms, median under %7.2f ms, 99%% under %7.2f ms, max %7.2f ms' % (
+                stage, count, self.totals[i] / count * 1000, self.percentile(stage, 0.5) * 1000,
+                self.percentile(stage, 0.99) * 1000, self.maxima[i] * 1000))
+        counts = self.counts[stages.index('update')]
+        if counts.sum() == 0:
+            return 'No inputs timed.'
+        lines.append('Key press to display.update:')
+        used = np.nonzero(counts)[0]
+        for i in range(used[0], used[-1] + 1):
+            bar = '#' * int(math.ceil(width * counts[i] / counts.max()))
+            lines.append('  %7.2f - %7.2f ms %-*s %d' % (bucket_start(i) * 1000, bucket_start(i + 1) * 1000, width, bar, counts[i]))
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import tile_strategy
+    tile_strategy.measure_latency = True
+    tile_strategy.Tile_strategy().main()
@@ -0,0 +1,316 @@
+# Shared leaderboard for Tile Strategy: a small HTTP service that games send their scores to.
+# Every score is kept in memory in rank order, so the top scores, the scores around a player's and the percentile of a score
+# are answered without touching the disk. The top scores are also kept as a ready-made reply, redone only when a new score
+# gets into them. Scores are durable in leaderboard.dat, an append-only file of fixed-size records: new scores are written
+# behind, in batches, every flush_interval seconds or every batch_size scores, on a worker thread. A crash loses at most the
+# last batch; on restart the file is read back in.
+# Requests and replies are JSON:
+#   POST /scores {"name": ..., "score": ...}  ->  {"id", "rank", "total"}
+#   GET /top?k=10                             ->  {"scores": [{"rank", "id", "name", "score"}, ...], "total"}
+#   GET /around?id=ID&n=5                     ->  the n scores either side of entry ID, the same way
+#   GET /percentile?score=S                   ->  {"percentile": the percent of scores below S, "total"}
+# Run this file with 'serve' and a port to run the service, or without arguments to check it against localhost and time it.
+import asyncio
+import bisect
+import json
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import urllib.request
+from urllib.parse import urlsplit, parse_qs
+
+default_port = 8135
+# Names are stored as up to this many bytes of UTF-8.
+name_size = 32
+# Byte layout of a record: entry id, score, the time it was submitted, the name.
+record = struct.Struct('<qqd%ds' % name_size)
+statuses = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+
+class Leaderboard:
+    def __init__(self, path, top_size = 10, batch_size = 256, flush_interval = 0.5):
+        self.path = path
+        self.top_size = top_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # entries holds every score as (-score, id, name), so higher scores come first and ties go to the earlier score.
+        self.entries = []
+        self.by_id = {}
+        # Records submitted but not written yet, and how many batches were written.
+        self.pending = []
+        self.batch_full = asyncio.Event()
+        self.write_lock = threading.Lock()
+        self.batches = 0
+        self.top_reply = None
+        self.load()
+        self.next_id = max(self.by_id, default = 0) + 1
+
+    # Reads the scores back from the file. A record cut short by a crash is dropped.
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        whole = len(data) - len(data) % record.size
+        for entry_id, score, timestamp, name in record.iter_unpack(data[:whole]):
+            self.by_id[entry_id] = (-score, entry_id, name.rstrip(b'\0').decode('utf-8', 'ignore'))
+        self.entries = sorted(self.by_id.values())
+        if whole < len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(whole)
+
+    # Adds a score. Returns its id and rank. It's written to the file with the next batch.
+    def submit(self, name, score):
+        name = name.encode('utf-8')[:name_size].decode('utf-8', 'ignore')
+        entry = (-int(score), self.next_id, name)
+        self.next_id += 1
+        self.by_id[entry[1]] = entry
+        index = bisect.bisect_left(self.entries, entry)
+        self.entries.insert(index, entry)
+        if index < self.top_size:
+            self.top_reply = None
+        self.pending.append(record.pack(entry[1], -entry[0], time.time(), name.encode('utf-8')))
+        if len(self.pending) >= self.batch_size:
+            self.batch_full.set()
+        return entry[1], index + 1
+
+    def rows(self, start, stop):
+        start = max(0, start)
+        return [{'rank': start + i + 1, 'id': entry_id, 'name': name, 'score': -negative_score}
+                for i, (negative_score, entry_id, name) in enumerate(self.entries[start:stop])]
+
+    def top(self, k):
+        return {'scores': self.rows(0, k), 'total': len(self.entries)}
+
+    # The reply to a top scores request with the usual k, made once per change to the top scores.
+    def top_cached(self):
+        if self.top_reply is None:
+            self.top_reply = json.dumps(self.top(self.top_size)).encode()
+        return self.top_reply
+
+    # Returns the n scores either side of entry entry_id, and the entry's own. Raises KeyError if there's no such entry.
+    def around(self, entry_id, n):
+        index = bisect.bisect_left(self.entries, self.by_id[entry_id])
+        return {'scores': self.rows(index - n, index + n + 1), 'total': len(self.entries)}
+
+    # The percent of scores that are lower than score.
+    def percentile(self, score):
+        total = len(self.entries)
+        at_least = bisect.bisect_right(self.entries, -score, key = lambda entry: entry[0])
+        return {'percentile': 100.0 * (total - at_least) / total if total else 0.0, 'total': total}
+
+    # Appends a batch of records to the file and makes sure they're on disk. Batches are written one at a time, in order.
+    def write(self, batch):
+        with self.write_lock:
+            with open(self.path, 'ab') as f:
+                f.write(b''.join(batch))
+                f.flush()
+                os.fsync(f.fileno())
+            self.batches += 1
+
+    # Writes the pending records, on a worker thread so requests keep being answered.
+    async def flush(self):
+        if self.pending:
+            batch, self.pending = self.pending, []
+            await asyncio.to_thread(self.write, batch)
+
+    # Writes pending records every flush_interval seconds, or as soon as a batch is full.
+    async def write_behind(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.batch_full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_full.clear()
+            await self.flush()
+
+
+class Leaderboard_server:
+    def __init__(self, leaderboard):
+        self.leaderboard = leaderboard
+        self.requests = 0
+
+    async def start(self, host = '127.0.0.1', port = default_port):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.writer = asyncio.create_task(self.leaderboard.write_behind())
+        return self.server.sockets[0].getsockname()[1]
+
+    # Stops taking requests and writes whatever is pending.
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.writer.cancel()
+        await self.leaderboard.flush()
+
+    # Answers HTTP/1.1 requests on one connection until the client closes it.
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, separator, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, reply = self.route(method, target, body)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n'
+                             % (status, statuses[status].encode(), len(reply), b'keep-alive' if keep_alive else b'close') + reply)
+                await writer.drain()
+                self.requests += 1
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # Returns the status and the body of the reply to a request.
+    def route(self, method, target, body):
+        url = urlsplit(target)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        leaderboard = self.leaderboard
+        try:
+            if url.path == '/scores':
+                if method != 'POST':
+                    return 405, b'{}'
+                submitted = json.loads(body)
+                entry_id, rank = leaderboard.submit(str(submitted['name']), int(submitted['score']))
+                reply = {'id': entry_id, 'rank': rank, 'total': len(leaderboard.entries)}
+            elif method != 'GET':
+                return 405, b'{}'
+            elif url.path == '/top':
+                k = int(query.get('k', leaderboard.top_size))
+                if k == leaderboard.top_size:
+                    return 200, leaderboard.top_cached()
+                reply = leaderboard.top(k)
+            elif url.path == '/around':
+                reply = leaderboard.around(int(query['id']), int(query.get('n', 5)))
+            elif url.path == '/percentile':
+                reply = leaderboard.percentile(int(query['score']))
+            else:
+                return 404, b'{}'
+        except (KeyError, ValueError, TypeError):
+            return 400, b'{}'
+        return 200, json.dumps(reply).encode()
+
+
+def serve(path = 'leaderboard.dat', port = default_port, host = '127.0.0.1'):
+    async def run():
+        server = Leaderboard_server(Leaderboard(path))
+        port_used = await server.start(host, port)
+        print('Leaderboard on http://%s:%d with %d scores.' % (host, port_used, len(server.leaderboard.entries)))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+# Sends a request to the service at url and returns the reply. Blocks; games call this from a worker thread.
+def request(url, path, data = None, timeout = 2.0):
+    body = None if data is None else json.dumps(data).encode()
+    with urllib.request.urlopen(urllib.request.Request(url.rstrip('/') + path, data = body), timeout = timeout) as reply:
+        return json.loads(reply.read())
+
+
+def submit_score(url, name, score, timeout = 2.0):
+    return request(url, '/scores', {'name': name, 'score': score}, timeout)
+
+
+# Sends a request on an open connection and reads the reply, for the check below.
+async def call(reader, writer, method, path, data = None):
+    body = b'' if data is None else json.dumps(data).encode()
+    writer.write(b'%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\n\r\n' % (method.encode(), path.encode(), len(body)) + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line == b'\r\n':
+            break
+        name, separator, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+# Runs the service on localhost, has clients submit scores and ask for every view at once, and checks the replies
+# against a plain sorted list. Then starts the service again from its file and checks nothing was lost.
+# Returns the requests per second.
+def verify(path, clients = 20, submissions = 500, seed = 0):
+    rng = random.Random(seed)
+    submitted = {}
+
+    async def client(port, number):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for i in range(submissions):
+            name = 'client %d' % number
+            score = rng.randrange(10000)
+            status, reply = await call(reader, writer, 'POST', '/scores', {'name': name, 'score': score})
+            assert status == 200
+            submitted[reply['id']] = (score, name)
+            status, reply = await call(reader, writer, 'GET', '/around?id=%d&n=2' % reply['id'])
+            assert status == 200 and len(reply['scores']) >= 1
+            if i % 10 == 0:
+                assert (await call(reader, writer, 'GET', '/top'))[0] == 200
+                assert (await call(reader, writer, 'GET', '/percentile?score=%d' % score))[0] == 200
+        writer.close()
+
+    async def check():
+        server = Leaderboard_server(Leaderboard(path))
+        port = await server.start(port = 0)
+        start = time.perf_counter()
+        await asyncio.gather(*[client(port, number) for number in range(clients)])
+        seconds = time.perf_counter() - start
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        expected = sorted((-score, entry_id, name) for entry_id, (score, name) in submitted.items())
+        status, reply = await call(reader, writer, 'GET', '/top')
+        assert [(-row['score'], row['id'], row['name']) for row in reply['scores']] == expected[:10], 'The top scores are wrong'
+        status, reply = await call(reader, writer, 'GET', '/top?k=100')
+        assert [(-row['score'], row['id'], row['name']) for row in reply['scores']] == expected[:100], 'The top 100 are wrong'
+        for entry_id in rng.sample(sorted(submitted), 50):
+            index = expected.index((-submitted[entry_id][0], entry_id, submitted[entry_id][1]))
+            status, reply = await call(reader, writer, 'GET', '/around?id=%d&n=3' % entry_id)
+            assert [row['id'] for row in reply['scores']] == [entry[1] for entry in expected[max(0, index - 3):index + 4]], \
+                'The scores around %d are wrong' % entry_id
+            assert reply['scores'][min(index, 3)]['rank'] == index + 1
+            score = submitted[entry_id][0]
+            status, reply = await call(reader, writer, 'GET', '/percentile?score=%d' % score)
+            below = sum(1 for other, name in submitted.values() if other < score)
+            assert abs(reply['percentile'] - 100.0 * below / len(submitted)) < 1e-9, 'The percentile of %d is wrong' % score
+        assert (await call(reader, writer, 'GET', '/around?id=0'))[0] == 400
+        assert (await call(reader, writer, 'GET', '/nowhere'))[0] == 404
+        writer.close()
+        requests = server.requests
+        await server.stop()
+        return requests / seconds, server.leaderboard.batches
+
+    rate, batches = asyncio.run(check())
+    reloaded = Leaderboard(path)
+    assert reloaded.entries == sorted((-score, entry_id, name) for entry_id, (score, name) in submitted.items()), \
+        'Scores were lost or changed on restart'
+    return rate, len(submitted), batches
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        serve(port = int(sys.argv[2]) if len(sys.argv) > 2 else default_port)
+    else:
+        import tempfile
+        with tempfile.TemporaryDirectory() as folder:
+            rate, scores, batches = verify(os.path.join(folder, 'leaderboard.dat'))
+        print('Checked %d scores from concurrent clients, written in %d batches, and read back after a restart.' % (scores, batches))
+        print('%.0f requests per second on localhost.' % rate)
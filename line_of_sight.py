@@ -0,0 +1,146 @@
+# Line of sight for Tile Strategy's fog of war.
+# A cell can be seen from another if the straight line between their centers doesn't pass through a wall.
+# The lines never change for a board size, so they're worked out once: for every pair of cells, the table holds a bitmask
+# of the cells in between, packed into 64-bit words with cell (x, y) at bit x * height + y, like bitboard.py.
+# Seeing from a cell then takes one lookup and an AND with the mask of the walls: a cell is hidden if any wall is in between.
+# Lines are symmetric, so an enemy can see the player exactly when the player can see the enemy.
+# Run this file to check the tables against casting every line, and to time both.
+import functools
+import random
+import sys
+import time
+import numpy as np
+
+# Cells are shrunk by this much on every side when checking if a line passes through them.
+# A line that only grazes the corner of a wall, like a diagonal between two walls, isn't blocked.
+corner_margin = 0.01
+
+
+# Returns which cells the line from the center of cell (x, y) to the center of every cell passes through,
+# leaving out both ends, as a bool array indexed by (end cell, cell in between).
+def lines_from(x, y, width, height):
+    cells = np.arange(width * height)
+    end_x = (cells // height).astype(float)[:, None]
+    end_y = (cells % height).astype(float)[:, None]
+    cell_x = (cells // height).astype(float)[None, :]
+    cell_y = (cells % height).astype(float)[None, :]
+    half = 0.5 - corner_margin
+    # The part of the line, from 0 at (x, y) to 1 at the end, that's inside each cell's square, one axis at a time.
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        first = np.zeros((len(cells), len(cells)))
+        last = np.ones((len(cells), len(cells)))
+        for start, end, center in ((x, end_x, cell_x), (y, end_y, cell_y)):
+            step = end - start
+            enter = (center - half - start) / step
+            leave = (center + half - start) / step
+            low = np.minimum(enter, leave)
+            high = np.maximum(enter, leave)
+            # Along an axis the line doesn't move on, it's inside the square all the way or not at all.
+            inside = np.abs(center - start) <= half
+            low = np.where(step == 0, np.where(inside, 0.0, np.inf), low)
+            high = np.where(step == 0, np.where(inside, 1.0, -np.inf), high)
+            first = np.maximum(first, low)
+            last = np.minimum(last, high)
+    between = first <= last
+    between[:, x * height + y] = False
+    between[cells, cells] = False
+    return between
+
+
+# Packs the rows of a bool array into 64-bit words, the first cell in the lowest bit.
+def pack(bits):
+    packed = np.packbits(bits, axis = -1, bitorder = 'little')
+    padding = -packed.shape[-1] % 8
+    if padding:
+        packed = np.concatenate([packed, np.zeros(packed.shape[:-1] + (padding,), dtype = np.uint8)], axis = -1)
+    return np.ascontiguousarray(packed).view('<u8')
+
+
+# Returns the table for a board size: for every cell the player could be in, and every cell, the mask of the cells in between.
+# Its shape is (cells, cells, words). Tables are made the first time a board size is asked for and kept.
+@functools.lru_cache(maxsize = None)
+def sight_table(width, height):
+    return np.stack([pack(lines_from(x, y, width, height)) for x in range(width) for y in range(height)])
+
+
+# Returns a bool array the shape of walls with the cells that can be seen from cell (x, y).
+# walls is a bool array, True for every cell with a wall.
+def visible_cells(walls, x, y):
+    width, height = walls.shape
+    table = sight_table(width, height)
+    hidden = (table[x * height + y] & pack(walls.ravel())).any(axis = 1)
+    return ~hidden.reshape(width, height)
+
+
+# Returns True if the line from the center of cell (x, y) to the center of cell (to_x, to_y) passes through cell (cell_x, cell_y).
+# Clips the line against the cell's shrunk square one side at a time.
+def crosses(x, y, to_x, to_y, cell_x, cell_y):
+    half = 0.5 - corner_margin
+    first = 0.0
+    last = 1.0
+    for step, room in ((x - to_x, x - cell_x + half), (to_x - x, cell_x + half - x),
+                       (y - to_y, y - cell_y + half), (to_y - y, cell_y + half - y)):
+        if step == 0:
+            if room < 0:
+                return False
+        elif step < 0:
+            first = max(first, room / step)
+        else:
+            last = min(last, room / step)
+    return first <= last
+
+
+# Works out what can be seen from cell (x, y) by casting the line to every cell and checking it against every wall.
+# It's the slow way, to check the tables against.
+def cast_lines(walls, x, y):
+    width, height = walls.shape
+    wall_cells = [(wall_x, wall_y) for wall_x in range(width) for wall_y in range(height) if walls[wall_x, wall_y]]
+    seen = np.zeros((width, height), dtype = bool)
+    for to_x in range(width):
+        for to_y in range(height):
+            seen[to_x, to_y] = not any(crosses(x, y, to_x, to_y, wall_x, wall_y) for wall_x, wall_y in wall_cells
+                                       if (wall_x, wall_y) != (x, y) and (wall_x, wall_y) != (to_x, to_y))
+    return seen
+
+
+# Checks the tables against cast_lines on random walls, and that every line is symmetric.
+def verify(width = 8, height = 8, boards = 50, density = 0.2, seed = 0):
+    rng = np.random.default_rng(seed)
+    table = sight_table(width, height)
+    cells = width * height
+    for a in range(cells):
+        for b in range(cells):
+            assert (table[a, b] == table[b, a]).all(), 'The line between cells %d and %d is not symmetric' % (a, b)
+    checked = 0
+    for board in range(boards):
+        walls = rng.random((width, height)) < density
+        for x in range(width):
+            for y in range(height):
+                assert (visible_cells(walls, x, y) == cast_lines(walls, x, y)).all(), \
+                    'Board %d: what is seen from (%d, %d) differs' % (board, x, y)
+                checked += 1
+    return checked
+
+
+# Times working out what the player sees with the table and by casting lines, in seconds per update.
+def benchmark(width = 8, height = 8, updates = 1000, density = 0.12, seed = 0):
+    rng = random.Random(seed)
+    walls = np.random.default_rng(seed).random((width, height)) < density
+    sight_table(width, height)
+    times = []
+    for see in (visible_cells, cast_lines):
+        start = time.perf_counter()
+        for i in range(updates):
+            see(walls, rng.randrange(width), rng.randrange(height))
+        times.append((time.perf_counter() - start) / updates)
+    return times
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    start = time.perf_counter()
+    sight_table(size, size)
+    print('Made the %d by %d table in %.1f ms.' % (size, size, (time.perf_counter() - start) * 1000))
+    print('Checked %d positions against casting lines.' % verify(size, size))
+    table_time, cast_time = benchmark(size, size)
+    print('Seeing from a cell: %.1f us with the table, %.1f us casting lines.' % (table_time * 1e6, cast_time * 1e6))
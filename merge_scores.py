@@ -0,0 +1,233 @@
+# Merges the score boards of many kiosks into one global ranking.
+# Takes any number of 'high scores.dat' files (pickled lists of (score, name) pairs, the score as a string) and leaderboard
+# files (the fixed-size records of leaderboard.py), and folders to look for them in. Scores are parsed once, as they're read.
+# Memory stays bounded however many files there are: scores are sorted chunk_size at a time into run files in a temp folder,
+# and the runs are merged with a heap, at most fan_in at a time, in as many passes as it takes.
+# Entries with the same score and name are the same entry, like the 'default' score every board starts with, and are kept once.
+# The ranking is written as a leaderboard file, best score first, with the rank as the id, so leaderboard.py can serve it.
+# Run this file with the output file and the inputs, or without arguments to check it on made-up kiosk files and time it.
+import heapq
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from leaderboard import record, name_size
+
+# Records are read and written this many at a time.
+block_records = 4096
+
+
+# Returns the name the way the leaderboard stores it: at most name_size bytes of UTF-8.
+def stored_name(name):
+    return str(name).encode('utf-8')[:name_size].decode('utf-8', 'ignore')
+
+
+# Returns 'pickle' or 'records', the format of a score file, going by how it starts and its size.
+# score_board's pickles start with a protocol header: PROTO, the protocol, then a FRAME (protocol 4 and up) or the list.
+# Records have no header, but are always whole. Raises a ValueError for a file that's neither, rather than guess.
+def score_format(path):
+    with open(path, 'rb') as f:
+        head = f.read(3)
+    if (len(head) == 3 and head[:1] == pickle.PROTO and 2 <= head[1] <= pickle.HIGHEST_PROTOCOL
+            and head[2:] in (pickle.FRAME, pickle.EMPTY_LIST, pickle.MARK)):
+        return 'pickle'
+    if os.path.getsize(path) % record.size == 0:
+        return 'records'
+    raise ValueError('%s is neither a pickled score list nor a file of whole leaderboard records' % path)
+
+
+# Yields every entry of a score file as (-score, name, timestamp). Pickled score lists have no timestamps; they get 0.
+def read_scores(path):
+    if score_format(path) == 'records':
+        for entry_id, score, timestamp, name in read_records(path):
+            yield -score, name, timestamp
+        return
+    with open(path, 'rb') as f:
+        scores = pickle.load(f)
+    if not isinstance(scores, list):
+        raise ValueError('%s does not hold a list of scores' % path)
+    for score, name in scores:
+        yield -int(score), stored_name(name), 0.0
+
+
+# Yields the records of a leaderboard file or a run file. A record cut short at the end is skipped.
+def read_records(path):
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(record.size * block_records)
+            whole = len(data) - len(data) % record.size
+            for entry_id, score, timestamp, name in record.iter_unpack(data[:whole]):
+                yield entry_id, score, timestamp, name.rstrip(b'\0').decode('utf-8', 'ignore')
+            if len(data) < record.size * block_records:
+                return
+
+
+# Writes entries to a file as records. The id of every record is its rank.
+def write_records(path, entries):
+    count = 0
+    with open(path, 'wb') as f:
+        block = []
+        for negative_score, name, timestamp in entries:
+            count += 1
+            block.append(record.pack(count, -negative_score, timestamp, name.encode('utf-8')))
+            if len(block) == block_records:
+                f.write(b''.join(block))
+                block = []
+        f.write(b''.join(block))
+    return count
+
+
+def read_run(path):
+    for entry_id, score, timestamp, name in read_records(path):
+        yield -score, name, timestamp
+
+
+# Drops entries with the same score and name as the one before. In sorted entries, that's every duplicate.
+def unique(entries):
+    last = None
+    for entry in entries:
+        if entry[:2] != last:
+            last = entry[:2]
+            yield entry
+
+
+# Yields the files to merge: every file given, and every file in the folders given, with their subfolders.
+def score_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, subfolders, names in os.walk(path):
+                subfolders.sort()
+                for name in sorted(names):
+                    yield os.path.join(folder, name)
+        else:
+            yield path
+
+
+class Score_merger:
+    def __init__(self, folder, chunk_size = 100000, fan_in = 64):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.fan_in = fan_in
+        self.runs_made = 0
+        self.entries_read = 0
+
+    def new_run(self, entries):
+        path = os.path.join(self.folder, 'run_%06d.dat' % self.runs_made)
+        self.runs_made += 1
+        write_records(path, entries)
+        return path
+
+    # Reads the files and sorts them chunk_size entries at a time into runs. Returns the paths of the runs.
+    def sort_runs(self, paths):
+        runs = []
+        chunk = []
+        for path in score_files(paths):
+            for entry in read_scores(path):
+                chunk.append(entry)
+                if len(chunk) >= self.chunk_size:
+                    chunk.sort()
+                    runs.append(self.new_run(unique(chunk)))
+                    self.entries_read += len(chunk)
+                    chunk = []
+        chunk.sort()
+        runs.append(self.new_run(unique(chunk)))
+        self.entries_read += len(chunk)
+        return runs
+
+    # Merges runs fan_in at a time until there are few enough for the last merge, and returns the merged entries.
+    def merge_runs(self, runs):
+        while len(runs) > self.fan_in:
+            merged = []
+            for start in range(0, len(runs), self.fan_in):
+                group = runs[start:start + self.fan_in]
+                merged.append(self.new_run(unique(heapq.merge(*[read_run(run) for run in group]))))
+                for run in group:
+                    os.remove(run)
+            runs = merged
+        return unique(heapq.merge(*[read_run(run) for run in runs]))
+
+    # Merges the score files into one ranking, written to output. Returns how many entries went in and how many came out.
+    def merge(self, paths, output):
+        count = write_records(output, self.merge_runs(self.sort_runs(paths)))
+        return self.entries_read, count
+
+
+def merge(paths, output, chunk_size = 100000, fan_in = 64):
+    with tempfile.TemporaryDirectory(prefix = 'merge-') as folder:
+        return Score_merger(folder, chunk_size, fan_in).merge(paths, output)
+
+
+# Makes kiosk score files the way score_board writes them, with the same games often showing up on several kiosks.
+def make_kiosks(folder, kiosks, seed = 0):
+    rng = random.Random(seed)
+    names = ['kiosk player %d' % i for i in range(500)]
+    for kiosk in range(kiosks):
+        scores = [('99', 'default')] + [(str(rng.randrange(2000)), rng.choice(names)) for i in range(rng.randrange(1, 10))]
+        scores.sort(key = lambda score: int(score[0]), reverse = True)
+        os.makedirs(os.path.join(folder, 'kiosk_%05d' % kiosk))
+        with open(os.path.join(folder, 'kiosk_%05d' % kiosk, 'high scores.dat'), 'wb') as f:
+            pickle.dump(scores, f)
+
+
+# Makes a leaderboard file of count records with ids from first_id on.
+def make_leaderboard(path, count, first_id, seed = 0):
+    rng = random.Random(seed)
+    with open(path, 'wb') as f:
+        for i in range(count):
+            name = 'leaderboard player %d' % rng.randrange(500)
+            f.write(record.pack(first_id + i, rng.randrange(5000), time.time(), name.encode('utf-8')))
+
+
+# Merges made-up kiosk files with small chunks and fan-in, so every pass gets used, and checks the ranking against
+# sorting everything in memory. Returns the seconds taken and the peak memory of the merge, in bytes.
+# A leaderboard file goes in too. Its first id is 11869, whose bytes start like a pickle of an empty list,
+# so it has to be told apart from the pickles by more than whether it unpickles.
+def verify(kiosks, chunk_size = 5000, fan_in = 16, seed = 0):
+    with tempfile.TemporaryDirectory(prefix = 'kiosks-') as folder:
+        make_kiosks(os.path.join(folder, 'kiosks'), kiosks, seed)
+        leaderboard_path = os.path.join(folder, 'kiosks', 'leaderboard.dat')
+        make_leaderboard(leaderboard_path, 1000, 11869, seed)
+        assert len(list(read_scores(leaderboard_path))) == 1000, 'The leaderboard file was not read as records'
+        bad_path = os.path.join(folder, 'bad.dat')
+        with open(bad_path, 'wb') as f:
+            f.write(b'not a score file')
+        try:
+            list(read_scores(bad_path))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('A file of neither format was read')
+        output = os.path.join(folder, 'ranking.dat')
+        tracemalloc.start()
+        start = time.perf_counter()
+        read, written = merge([os.path.join(folder, 'kiosks')], output, chunk_size, fan_in)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        expected = set((-score, name) for entry_id, score, timestamp, name in read_records(leaderboard_path))
+        for path in score_files([os.path.join(folder, 'kiosks')]):
+            if path != leaderboard_path:
+                with open(path, 'rb') as f:
+                    expected.update((-int(score), name) for score, name in pickle.load(f))
+        ranking = [(-score, name) for entry_id, score, timestamp, name in read_records(output)]
+        assert ranking == sorted(expected), 'The merged ranking is wrong'
+        assert [entry_id for entry_id, score, timestamp, name in read_records(output)] == list(range(1, written + 1))
+    return seconds, peak
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        read, written = merge(sys.argv[2:], sys.argv[1])
+        print('Merged %d scores into %d in %s.' % (read, written, sys.argv[1]))
+        for entry_id, score, timestamp, name in read_records(sys.argv[1]):
+            if entry_id > 10:
+                break
+            print('%3d %6d %s' % (entry_id, score, name))
+    else:
+        # Past fan_in runs, the peak stays the same however many files there are.
+        for kiosks in (16000, 32000):
+            seconds, peak = verify(kiosks)
+            print('Merged %d kiosk files in %.2f s; peak memory %.0f KB.' % (kiosks, seconds, peak / 1024))
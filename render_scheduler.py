@@ -0,0 +1,29 @@
+# Render scheduling for Tile Strategy.
+# Instead of repainting the screen every time something changes, the game marks the view as dirty and repaints once per displayed frame.
+# Several changes inside one frame (a move plus the turn after it, or a few queued key presses) cost a single draw.
+
+
+class Render_scheduler:
+    # draw is the function that repaints the whole screen.
+    def __init__(self, draw):
+        self.draw = draw
+        self.dirty = False
+        # draws counts real repaints, saved counts requests that were folded into a repaint that was already pending.
+        self.draws = 0
+        self.saved = 0
+
+    # Marks the view as needing a repaint before the next frame is shown.
+    def request(self):
+        if self.dirty:
+            self.saved += 1
+        self.dirty = True
+
+    # Called once per frame, right before display.update. Repaints only if something asked for it.
+    # Returns True if the screen was repainted.
+    def flush(self):
+        if not self.dirty:
+            return False
+        self.dirty = False
+        self.draw()
+        self.draws += 1
+        return True
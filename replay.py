@@ -0,0 +1,122 @@
+# Replays for Tile Strategy.
+# A replay holds the player's action on every turn, plus a keyframe every so many turns: a full snapshot of the game,
+# including the state of the random numbers. Everything else in a game follows from the seed and the actions,
+# so any turn can be reached by loading the keyframe before it and playing the actions forward from there.
+# That takes at most keyframe_interval turns however long the game is.
+# A game rewound with undo (see undo.py) drops the actions it took back, and gets a keyframe at the turn it was rewound to,
+# since the random numbers from there on aren't the ones the turns were first played with.
+# replay_viewer.py plays replay files back.
+import bisect
+import os
+import pickle
+import autosave
+
+# The player's actions, by the number they are stored as: skipping the turn, then the directions of tile_strategy.
+actions = (None, 'up', 'down', 'left', 'right')
+action_codes = {action: code for code, action in enumerate(actions)}
+
+# A keyframe is taken every this many turns.
+keyframe_interval = 250
+
+
+# Records a game as it's played. The game calls record after every turn.
+class Replay_recorder:
+    # game is a Tile_strategy game, set up and ready for its next turn. The replay starts there.
+    def __init__(self, game, path, interval = keyframe_interval):
+        self.game = game
+        self.path = path
+        self.interval = interval
+        self.start_turn = game.total_turn
+        self.actions = bytearray()
+        self.keyframes = {game.total_turn: game.get_keyframe()}
+        # Turns the game was rewound to. Playback puts the game in their keyframes' state on reaching them.
+        self.rewinds = set()
+        # The floor the game is on, and the floor_args and floor snapshot of a keyframe taken there, if any.
+        # Undo never crosses floors, so rewinds reuse them instead of snapshotting the floor cache again.
+        self.floor = game.floor
+        self.floors = tuple(self.keyframes[game.total_turn][1:3])
+
+    def record(self, action):
+        self.actions.append(action_codes[action])
+        if self.game.floor != self.floor:
+            self.floor = self.game.floor
+            self.floors = None
+        if (self.game.total_turn - self.start_turn) % self.interval == 0 and not self.game.is_dead:
+            self.keyframes[self.game.total_turn] = self.game.get_keyframe(self.floors)
+            self.floors = tuple(self.keyframes[self.game.total_turn][1:3])
+
+    # Called after a turn was undone. The game can't be rewound past the start of the replay.
+    def undone(self):
+        turn = max(self.start_turn, self.game.total_turn)
+        del self.actions[turn - self.start_turn:]
+        for later in [later for later in self.keyframes if later > turn]:
+            del self.keyframes[later]
+        self.rewinds = {rewind for rewind in self.rewinds if rewind < turn}
+        self.rewound()
+
+    # Called after a turn was redone, with the action it was played with.
+    def redone(self, action):
+        self.actions.append(action_codes[action])
+        self.rewound()
+
+    # Keyframes the turn the game was rewound to. Takes time for the board, not for the floors in the cache.
+    def rewound(self):
+        self.keyframes[self.game.total_turn] = self.game.get_keyframe(self.floors)
+        self.floors = tuple(self.keyframes[self.game.total_turn][1:3])
+        self.rewinds.add(self.game.total_turn)
+
+    def to_replay(self):
+        return Replay(self.start_turn, bytes(self.actions), dict(self.keyframes), set(self.rewinds))
+
+    # Writes the replay file. Like saves, it goes to a temp file first, so a crash never leaves half a replay.
+    def save(self):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok = True)
+        autosave.write_save(self.path, self.to_replay().to_state())
+
+
+class Replay:
+    # keyframes maps turn numbers to snapshots made by Tile_strategy.get_keyframe. There is always one at start_turn.
+    # rewinds are the turns the game was rewound to with undo. Each has a keyframe.
+    def __init__(self, start_turn, actions, keyframes, rewinds = ()):
+        self.start_turn = start_turn
+        self.actions = actions
+        self.keyframes = keyframes
+        self.rewinds = set(rewinds)
+        self.keyframe_turns = sorted(keyframes)
+        self.end_turn = start_turn + len(actions)
+
+    def to_state(self):
+        return {'start_turn': self.start_turn, 'actions': self.actions, 'keyframes': self.keyframes, 'rewinds': self.rewinds}
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        # Replays from before undo have no rewinds.
+        return Replay(state['start_turn'], state['actions'], state['keyframes'], state.get('rewinds', ()))
+
+    # Puts a game in its state at the given turn: restores the last keyframe at or before the turn, then plays forward.
+    # Returns how many turns had to be played.
+    def seek(self, game, turn):
+        turn = max(self.start_turn, min(turn, self.end_turn))
+        keyframe_turn = self.keyframe_turns[bisect.bisect_right(self.keyframe_turns, turn) - 1]
+        game.restore_keyframe(self.keyframes[keyframe_turn])
+        while game.total_turn < turn:
+            self.step(game)
+        return turn - keyframe_turn
+
+    # Plays the game's next turn from the replay. Returns False once the replay is over.
+    def step(self, game):
+        if game.total_turn >= self.end_turn:
+            return False
+        action = actions[self.actions[game.total_turn - self.start_turn]]
+        if not game.act(action):
+            raise ValueError('Replay is out of sync at turn %d' % game.total_turn)
+        # Past a rewind, the game went on from the keyframe, not from the turns played the first time.
+        if game.total_turn in self.rewinds:
+            motions = game.motions
+            game.restore_keyframe(self.keyframes[game.total_turn])
+            game.motions = motions
+        return True
@@ -0,0 +1,348 @@
+# Offscreen export of Tile Strategy replays, for highlight clips.
+# Replay files (see replay.py) are drawn turn by turn with the game's own draw(), without a window: SDL's dummy video driver
+# gives pygame a screen in memory. Each turn becomes a frame, shown for turn_time seconds.
+# A turn that looks just like the one before it, like waiting with nothing around, isn't drawn again: the frame before it
+# is shown for longer. Which turns need a frame is worked out first by playing each replay through without drawing.
+# The frames are then drawn and encoded chunk_frames at a time on a pool of processes. Each chunk seeks to its first turn
+# through the replay's keyframes, so the chunks don't depend on each other.
+# Frames are written as PNG files with a frames.txt list of how long each is shown, which ffmpeg can turn into a video:
+#     ffmpeg -f concat -i frames.txt clip.mp4
+# or, with Pillow installed, as a GIF. Each chunk is then encoded as a GIF of its own, and they're joined at the end.
+# Run this file with an output folder and replay files, and optionally --gif, --turns FIRST:LAST and --workers N.
+# Without arguments, it checks the frames against drawing every turn of two games one by one.
+import bisect
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+# The dummy driver has to be picked before pygame starts up, in the pool's processes too.
+# SDL's own signal handlers would keep the pool from stopping its processes.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('SDL_NO_SIGNAL_HANDLERS', '1')
+import numpy as np
+import pygame
+from combat_log import Combat_log
+from replay import Replay, Replay_recorder
+from replay_viewer import start_speed
+from tile_strategy import Tile_strategy, tile, ground, grass, wall, board_width, board_height, up, down, left, right
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Seconds each turn is shown for, like the replay viewer at its starting speed.
+turn_time = 1 / start_speed
+# Frames drawn and encoded by one task of the pool.
+chunk_frames = 64
+
+# The game each process of the pool draws with, and the replay it last loaded.
+worker_game = None
+worker_replay = (None, None)
+
+
+# Sets up a process of the pool: a game with its screen in memory. Turns played there are never taken back.
+def start_worker():
+    global worker_game
+    worker_game = Tile_strategy()
+    worker_game.load = False
+    worker_game.open_window()
+    worker_game.setup_game()
+    worker_game.undo = None
+
+
+def load_replay(path):
+    global worker_replay
+    if worker_replay[0] != path:
+        worker_replay = (path, Replay.load(path))
+    return worker_replay[1]
+
+
+# What draw() shows of a game, apart from animations: the cells the player can see and what's in them,
+# the player's stats and the message at the bottom. Turns with the same key look the same.
+def frame_key(game):
+    visible = game.visible_cells()
+    cells = np.where(visible[:, :, None], game.array[:, :, [tile, ground]], -1)
+    return (cells.tobytes(), game.floor, game.level, game.player_hp, game.player_max_hp, game.player_atk,
+            game.player_exp, game.potion_count, game.combat_text(game.combat_log.last()))
+
+
+# Plays a replay through without drawing and works out its frames from turn first to turn last.
+# A range that ends before the replay starts has no frames.
+# Returns the frames as [turn, turns shown] pairs, and the last combat event at every keyframe, since the message at the
+# bottom of the screen can come from before the keyframe a chunk starts from.
+def plan(task):
+    path, first, last = task
+    replay = load_replay(path)
+    # A range past the end of the replay gets its last turn.
+    first = min(first, replay.end_turn)
+    game = worker_game
+    game.combat_log = Combat_log()
+    replay.seek(game, replay.start_turn)
+    frames = []
+    events = {}
+    key = None
+    while True:
+        if game.total_turn in replay.keyframes:
+            event = game.combat_log.last()
+            events[game.total_turn] = None if event is None else event.item()
+        if first <= game.total_turn <= last:
+            turn_key = frame_key(game)
+            if turn_key != key:
+                frames.append([game.total_turn, 0])
+                key = turn_key
+            frames[-1][1] += 1
+        if game.total_turn >= last or not replay.step(game):
+            break
+        game.motions = []
+    return frames, events
+
+
+# Draws one chunk of a replay's frames and writes them to folder, as PNG files or, with gif_path, as a GIF.
+# Settings come with the task, since the pool's processes only have their defaults. Returns how many frames were drawn.
+def render_chunk(task):
+    path, frames, events, folder, gif_path, seconds_per_turn = task
+    replay = load_replay(path)
+    game = worker_game
+    game.combat_log = Combat_log()
+    first = frames[0][0]
+    keyframe_turn = first - replay.seek(game, first)
+    # If nothing happened since the keyframe, the message is the last one from before it.
+    if game.combat_log.last() is None and events[keyframe_turn] is not None:
+        game.combat_log.record(*events[keyframe_turn])
+    images = []
+    for turn, shown in frames:
+        while game.total_turn < turn:
+            replay.step(game)
+            game.motions = []
+        game.draw()
+        if gif_path is None:
+            pygame.image.save(game.screen, os.path.join(folder, 'frame_%06d.png' % turn))
+        else:
+            image = Image.frombytes('RGB', game.screen.get_size(), pygame.image.tobytes(game.screen, 'RGB'))
+            images.append(image.convert('P', palette = Image.ADAPTIVE))
+    if images:
+        images[0].save(gif_path, save_all = True, append_images = images[1:], loop = 0,
+                       duration = [round(shown * seconds_per_turn * 1000) for turn, shown in frames])
+    return len(frames)
+
+
+# Writes the list of frames ffmpeg's concat demuxer reads: every file with how long it's shown.
+# The last file is listed twice, or ffmpeg cuts its time short.
+def write_frame_list(folder, frames):
+    with open(os.path.join(folder, 'frames.txt'), 'w') as f:
+        f.write('ffconcat version 1.0\n')
+        for turn, shown in frames:
+            f.write("file 'frame_%06d.png'\nduration %g\n" % (turn, shown * turn_time))
+        f.write("file 'frame_%06d.png'\n" % frames[-1][0])
+
+
+def skip_sub_blocks(data, offset):
+    while data[offset]:
+        offset += data[offset] + 1
+    return offset + 1
+
+
+# Joins GIF files into one, their frames one after the other. Every frame gets its file's colors as a table of its own,
+# so files with different colors can be joined. The header and the loop setting come from the first file.
+def join_gifs(path, parts):
+    with open(path, 'wb') as out:
+        for i, part in enumerate(parts):
+            with open(part, 'rb') as f:
+                data = f.read()
+            flags = data[10]
+            table = data[13:13 + (3 << ((flags & 7) + 1) if flags & 0x80 else 0)]
+            if i == 0:
+                out.write(data[:10] + bytes([flags & 0x70]) + data[11:13])
+            offset = 13 + len(table)
+            while data[offset] != 0x3b:
+                if data[offset] == 0x21:
+                    end = skip_sub_blocks(data, offset + 2)
+                    # Application extensions, like the loop setting, are only kept from the first file.
+                    if i == 0 or data[offset + 1] != 0xff:
+                        out.write(data[offset:end])
+                elif data[offset] == 0x2c:
+                    image_flags = data[offset + 9]
+                    start = offset + 10
+                    if image_flags & 0x80:
+                        start += 3 << ((image_flags & 7) + 1)
+                        out.write(data[offset:start])
+                    else:
+                        out.write(data[offset:offset + 9] + bytes([(image_flags & 0x60) | 0x80 | (flags & 7)]) + table)
+                    end = skip_sub_blocks(data, start + 1)
+                    out.write(data[start:end])
+                else:
+                    raise ValueError('%s is not a GIF file this can join' % part)
+                offset = end
+        out.write(b'\x3b')
+
+
+# Exports replay files into the output folder: each into a folder of PNG frames named after the replay,
+# or with gif, into a GIF named after it. Only turns first to last are exported, as far as each replay goes;
+# a replay with none of them is left out. Returns how many turns were exported and how many frames it took.
+def export(paths, output, gif = False, first = 0, last = None, workers = None):
+    if gif and Image is None:
+        raise ImportError('Exporting GIFs needs Pillow')
+    if first < 0 or last is not None and last < first:
+        raise ValueError('Turns %d to %s are not a range of turns' % (first, last))
+    os.makedirs(output, exist_ok = True)
+    turns = 0
+    frame_count = 0
+    with tempfile.TemporaryDirectory(prefix = 'export-', dir = output) as parts_folder, \
+         multiprocessing.get_context('spawn').Pool(workers, initializer = start_worker) as pool:
+        plans = pool.map(plan, [(path, first, float('inf') if last is None else last) for path in paths])
+        tasks = []
+        joins = []
+        for path, (frames, events) in zip(paths, plans):
+            if not frames:
+                continue
+            name = os.path.splitext(os.path.basename(path))[0]
+            folder = os.path.join(output, name)
+            if not gif:
+                os.makedirs(folder, exist_ok = True)
+                write_frame_list(folder, frames)
+            parts = []
+            for start in range(0, len(frames), chunk_frames):
+                part = os.path.join(parts_folder, '%s_%06d.gif' % (name, start)) if gif else None
+                parts.append(part)
+                tasks.append((path, frames[start:start + chunk_frames], events, folder, part, turn_time))
+            joins.append((os.path.join(output, name + '.gif'), parts))
+            turns += sum(shown for turn, shown in frames)
+            frame_count += len(frames)
+        pool.map(render_chunk, tasks)
+        if gif:
+            for path, parts in joins:
+                join_gifs(path, parts)
+    return turns, frame_count
+
+
+# Draws every turn of a replay one by one, and returns the screens as arrays of pixels by turn.
+def draw_every_turn(path):
+    start_worker()
+    replay = Replay.load(path)
+    game = worker_game
+    replay.seek(game, replay.start_turn)
+    screens = {}
+    while True:
+        game.draw()
+        screens[game.total_turn] = pygame.surfarray.array3d(game.screen)
+        if not replay.step(game):
+            return screens
+        game.motions = []
+
+
+# Plays a game with actions picked by policy and records turns start to turns into a replay at path.
+# The player starts with a stack of potions, so the game runs long enough. walled puts walls on every side of the player:
+# the enemies get stuck against them, so a player that waits soon sees the same turn over and over.
+def record_game(path, policy, actions, turns, start = 0, potions = 1000, walled = False):
+    game = Tile_strategy()
+    game.load = False
+    game.setup_game()
+    game.potion_count = potions
+    if walled:
+        for x, y in ((game.player_x, game.player_y - 1), (game.player_x, game.player_y + 1),
+                     (game.player_x - 1, game.player_y), (game.player_x + 1, game.player_y)):
+            if 0 <= x < board_width and 0 <= y < board_height and game.array[x, y, tile] == grass:
+                game.array[x, y, tile] = wall
+    while game.total_turn < start:
+        game.act(policy.choice(actions))
+    game.recorder = Replay_recorder(game, path, interval = 25)
+    while game.total_turn < turns and not game.is_dead:
+        game.act(policy.choice(actions))
+    game.save_replay()
+
+
+# Checks exported frames against the screens of every turn: the frame shown on a turn has to be what drawing it shows.
+# frame_turns are the turns the frames were drawn on, and durations, if given, how many milliseconds each is shown.
+# tolerance is how far a color may be off.
+def check_frames(screens, frame_turns, frames, durations = None, tolerance = 0):
+    for turn, screen in screens.items():
+        shown = bisect.bisect_right(frame_turns, turn) - 1
+        assert (np.abs(frames[shown].astype(np.int16) - screen) <= tolerance).all(), 'Turn %d looks different in the export' % turn
+    if durations is not None:
+        ends = frame_turns[1:] + [max(screens) + 1]
+        for turn, end, duration in zip(frame_turns, ends, durations):
+            # GIFs keep durations in hundredths of a second.
+            assert abs(duration - (end - turn) * turn_time * 1000) <= 10, 'The frame of turn %d is shown too long' % turn
+
+
+# Records two games, exports them as PNG frames and checks every turn against drawing it. One has random moves;
+# in the other the player waits, walled in, so most of its turns show the frame of a turn before them.
+# The games have small keyframe intervals and chunks, so chunks start all over the place.
+# With Pillow installed, the games are also exported as GIFs, whose frames are checked the same way, durations too.
+# The waiting game is recorded from a few turns in, and a range of turns before that has to export nothing.
+# Returns how many turns were checked, how many frames were drawn for them, and the seconds the PNG export took.
+def verify(turns = 600, workers = 2, seed = 0):
+    global chunk_frames
+    random.seed(seed)
+    policy = random.Random(seed + 1)
+    with tempfile.TemporaryDirectory(prefix = 'replay-export-') as folder:
+        paths = [os.path.join(folder, 'moving.dat'), os.path.join(folder, 'waiting.dat')]
+        record_game(paths[0], policy, [up, down, left, right, None, None, None], turns)
+        record_game(paths[1], policy, [None], turns, start = 5, walled = True)
+        saved_chunk_frames = chunk_frames
+        chunk_frames = 16
+        try:
+            start = time.perf_counter()
+            exported, frame_count = export(paths, os.path.join(folder, 'frames'), workers = workers)
+            seconds = time.perf_counter() - start
+            if Image is not None:
+                export(paths, os.path.join(folder, 'gifs'), gif = True, workers = workers)
+            assert export(paths[1:], os.path.join(folder, 'none'), first = 0, last = 4, workers = workers) == (0, 0), \
+                'Turns from before the replay were exported'
+            assert not os.listdir(os.path.join(folder, 'none')), 'A replay without turns to export was written'
+        finally:
+            chunk_frames = saved_chunk_frames
+        checked = 0
+        for path in paths:
+            name = os.path.splitext(os.path.basename(path))[0]
+            screens = draw_every_turn(path)
+            checked += len(screens)
+            frames_folder = os.path.join(folder, 'frames', name)
+            frame_turns = sorted(int(file[6:12]) for file in os.listdir(frames_folder) if file.endswith('.png'))
+            frames = [pygame.surfarray.array3d(pygame.image.load(os.path.join(frames_folder, 'frame_%06d.png' % turn)))
+                      for turn in frame_turns]
+            check_frames(screens, frame_turns, frames)
+            if name == 'waiting':
+                assert len(frame_turns) < len(screens) // 2, 'Turns that look the same were drawn again'
+            if Image is not None:
+                with Image.open(os.path.join(folder, 'gifs', name + '.gif')) as image:
+                    assert image.n_frames == len(frame_turns), 'The GIF has %d frames' % image.n_frames
+                    frames = []
+                    durations = []
+                    for i in range(image.n_frames):
+                        image.seek(i)
+                        frames.append(np.asarray(image.convert('RGB')).transpose(1, 0, 2))
+                        durations.append(image.info['duration'])
+                # A GIF has 256 colors at most, so the smoothed edges of the text come out a shade off.
+                check_frames(screens, frame_turns, frames, durations, tolerance = 4)
+        assert checked == exported and len(os.listdir(os.path.join(folder, 'frames'))) == len(paths) and \
+            sum(len(os.listdir(os.path.join(folder, 'frames', name))) - 1 for name in ('moving', 'waiting')) == frame_count, \
+            'Frames are missing'
+    return checked, frame_count, seconds
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    gif = '--gif' in arguments
+    first, last, workers = 0, None, None
+    if '--turns' in arguments:
+        i = arguments.index('--turns')
+        first, last = arguments.pop(i + 1).split(':')
+        arguments.pop(i)
+        first = int(first or 0)
+        last = int(last) if last else None
+    if '--workers' in arguments:
+        i = arguments.index('--workers')
+        workers = int(arguments.pop(i + 1))
+        arguments.pop(i)
+    arguments = [argument for argument in arguments if argument != '--gif']
+    if len(arguments) > 1:
+        start = time.perf_counter()
+        turns, frames = export(arguments[1:], arguments[0], gif, first, last, workers)
+        print('Exported %d turns as %d frames in %.1f s.' % (turns, frames, time.perf_counter() - start))
+    else:
+        turns, frames, seconds = verify()
+        print('Checked %d turns against drawing them one by one. %d frames were drawn, in %.1f s.' % (turns, frames, seconds))
@@ -0,0 +1,159 @@
+# Replay viewer for Tile Strategy.
+# Plays back a replay file made by a game (see replay.py) in the game's own window.
+# Space pauses. Up and Down double or halve the speed. Left and Right step one turn back or forward,
+# Page Up and Page Down jump 100 turns, Home and End go to the start and the end, and the number keys jump to a tenth of the way through.
+# Run this file with a replay file to watch it. Without one, it checks that seeking lands on the same states as the game had,
+# and times seeking in a long game.
+import random
+import sys
+import time
+import pygame
+from pygame.locals import *
+from replay import Replay, Replay_recorder
+from tile_strategy import Tile_strategy, fps, window_width, white, black, up, down, left, right
+
+# Turns per second when playback starts, and the limits of the speed controls.
+start_speed = 4.0
+min_speed = 0.25
+max_speed = 4096.0
+# Above this speed turns go by too fast for the sliding animations, so they're skipped.
+animation_speed = 8.0
+
+
+class Replay_viewer:
+    def __init__(self, replay):
+        self.replay = replay
+        self.game = Tile_strategy()
+        self.game.load = False
+        self.speed = start_speed
+        self.paused = False
+        # Turns that are due but haven't been played, as a fraction, so slow speeds work.
+        self.due = 0.0
+
+    def seek(self, turn):
+        self.replay.seek(self.game, turn)
+        self.due = 0.0
+
+    def main(self):
+        self.game.open_window()
+        pygame.display.set_caption('Tile Strategy replay')
+        self.game.setup_game()
+        self.seek(self.replay.start_turn)
+        while True:
+            for event in pygame.event.get():
+                if event.type == QUIT:
+                    return
+                elif event.type == KEYDOWN:
+                    self.key(event.key)
+                    if event.key == K_ESCAPE:
+                        return
+            if not self.paused:
+                self.due += self.speed * self.game.clock.get_time() / 1000
+                while self.due >= 1:
+                    self.due -= 1
+                    if not self.replay.step(self.game):
+                        self.paused = True
+                        break
+            if self.game.motions:
+                if self.speed <= animation_speed and not self.paused:
+                    self.game.animator.start(self.game.motions)
+                self.game.motions = []
+            self.game.renderer.flush()
+            self.draw_status()
+            pygame.display.update()
+            if self.game.animator.advance(self.game.clock.tick(fps) / 1000):
+                self.game.renderer.request()
+
+    def key(self, key):
+        turn = self.game.total_turn
+        if key == K_SPACE:
+            self.paused = not self.paused
+        elif key == K_UP:
+            self.speed = min(self.speed * 2, max_speed)
+        elif key == K_DOWN:
+            self.speed = max(self.speed / 2, min_speed)
+        elif key == K_RIGHT:
+            self.paused = True
+            self.replay.step(self.game)
+        elif key == K_LEFT:
+            self.paused = True
+            self.seek(turn - 1)
+        elif key == K_PAGEUP:
+            self.seek(turn - 100)
+        elif key == K_PAGEDOWN:
+            self.seek(turn + 100)
+        elif key == K_HOME:
+            self.seek(self.replay.start_turn)
+        elif key == K_END:
+            self.seek(self.replay.end_turn)
+        elif K_0 <= key <= K_9:
+            length = self.replay.end_turn - self.replay.start_turn
+            self.seek(self.replay.start_turn + length * (key - K_0) // 10)
+        self.game.renderer.request()
+
+    # Draws the replay's position and speed under the player's stats.
+    def draw_status(self):
+        left_side = 572
+        top = 264
+        text_space = 32
+        pygame.draw.rect(self.game.screen, black, (left_side, top, window_width - left_side, text_space * 3))
+        lines = ['Turn %d/%d' % (self.game.total_turn, self.replay.end_turn),
+                 'Speed %gx' % self.speed,
+                 'Paused' if self.paused else '']
+        for i, line in enumerate(lines):
+            text = self.game.font.render(line, True, white)
+            self.game.screen.blit(text, (left_side, top + text_space * i))
+
+
+# Plays a game with random actions, recording it, then seeks to turns all over the replay and checks that every seek
+# lands on the same state the game was in. The player starts with a stack of potions, so the game runs long enough.
+def verify(turns = 20000, potions = 30000, seed = 0):
+    random.seed(seed)
+    policy = random.Random(seed + 1)
+    game = Tile_strategy()
+    game.load = False
+    game.setup_game()
+    game.potion_count = potions
+    game.recorder = Replay_recorder(game, None)
+    states = {game.total_turn: game.get_game_state()}
+    while game.total_turn < turns and not game.is_dead:
+        if game.act(policy.choice([up, down, left, right, None])):
+            states[game.total_turn] = game.get_game_state()
+    replay = game.recorder.to_replay()
+    viewer_game = Tile_strategy()
+    viewer_game.load = False
+    viewer_game.setup_game()
+    checked = 0
+    for turn in sorted(policy.sample(sorted(states), min(200, len(states)))):
+        replay.seek(viewer_game, turn)
+        expected = states[turn]
+        actual = viewer_game.get_game_state()
+        assert (expected[0] == actual[0]).all() and expected[1:] == actual[1:], 'Seeking to turn %d gives a different state' % turn
+        checked += 1
+    return checked, replay
+
+
+# Times seeks to random turns of a replay, in seconds.
+def time_seeks(replay, seeks = 50, seed = 0):
+    rng = random.Random(seed)
+    game = Tile_strategy()
+    game.load = False
+    game.setup_game()
+    times = []
+    for i in range(seeks):
+        start = time.perf_counter()
+        replay.seek(game, rng.randint(replay.start_turn, replay.end_turn))
+        times.append(time.perf_counter() - start)
+    return times
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        Replay_viewer(Replay.load(sys.argv[1])).main()
+        pygame.quit()
+    else:
+        checked, replay = verify()
+        print('Checked %d seeks against the recorded game.' % checked)
+        times = time_seeks(replay)
+        print('Seeking in a %d turn game: %.1f ms on average, %.1f ms at most.' %
+              (replay.end_turn - replay.start_turn, sum(times) / len(times) * 1000, max(times) * 1000))
@@ -0,0 +1,92 @@
+# Save slots for Tile Strategy.
+# Every slot is a file in the saves folder: a small fixed-size header, then the pickled game state.
+# The header says where the game is (floor, level, turn), when it was saved, and holds a thumbnail of the board,
+# so the title screen can list the slots by reading a hundred bytes of each instead of unpickling every board.
+import os
+import pickle
+import struct
+import time
+import numpy as np
+import autosave
+
+magic = b'TSAV'
+version = 1
+# The thumbnail is the board scaled to thumbnail_size by thumbnail_size cells, one byte per cell.
+thumbnail_size = 8
+# Byte layout of a header: magic, version, floor, level, turn, the time it was saved, the thumbnail.
+header = struct.Struct('<4sHiiqd%ds' % (thumbnail_size * thumbnail_size))
+
+
+class Slot_info:
+    def __init__(self, path, floor, level, turn, timestamp, thumbnail):
+        self.path = path
+        self.floor = floor
+        self.level = level
+        self.turn = turn
+        self.timestamp = timestamp
+        self.thumbnail = thumbnail
+
+
+def slot_path(directory, number):
+    return os.path.join(directory, 'slot_%03d.dat' % number)
+
+
+# Returns the path of a slot that isn't used yet, numbered after every slot there is.
+def new_slot_path(directory):
+    os.makedirs(directory, exist_ok = True)
+    numbers = [int(name[5:-4]) for name in os.listdir(directory) if name.startswith('slot_') and name.endswith('.dat')]
+    return slot_path(directory, max(numbers, default = 0) + 1)
+
+
+# Packs a header. cells is the board with one value per cell, like its tile layer.
+def pack_header(floor, level, turn, cells, timestamp = None):
+    if timestamp is None:
+        timestamp = time.time()
+    rows = np.arange(thumbnail_size) * cells.shape[0] // thumbnail_size
+    columns = np.arange(thumbnail_size) * cells.shape[1] // thumbnail_size
+    thumbnail = cells[np.ix_(rows, columns)].astype(np.uint8)
+    return header.pack(magic, version, int(floor), int(level), int(turn), timestamp, thumbnail.tobytes())
+
+
+# Reads just the header of a slot. Returns None if the file isn't a slot, or is a slot of another version,
+# whose header this can't read.
+def read_header(path):
+    with open(path, 'rb') as f:
+        data = f.read(header.size)
+    if len(data) < header.size or data[:4] != magic:
+        return None
+    tag, file_version, floor, level, turn, timestamp, thumbnail = header.unpack(data)
+    if file_version != version:
+        return None
+    thumbnail = np.frombuffer(thumbnail, dtype = np.uint8).reshape(thumbnail_size, thumbnail_size)
+    return Slot_info(path, floor, level, turn, timestamp, thumbnail)
+
+
+# Returns the headers of every slot in a folder, the most recently saved first.
+def list_slots(directory):
+    if not os.path.isdir(directory):
+        return []
+    slots = []
+    for entry in os.scandir(directory):
+        if entry.name.startswith('slot_') and entry.name.endswith('.dat'):
+            info = read_header(entry.path)
+            if info is not None:
+                slots.append(info)
+    slots.sort(key = lambda info: info.timestamp, reverse = True)
+    return slots
+
+
+def write_slot(path, game_state, slot_header):
+    autosave.write_save(path, game_state, slot_header)
+
+
+# Loads the game state of a slot, skipping its header. Raises a ValueError for a slot of another version.
+def load_slot(path):
+    with open(path, 'rb') as f:
+        if f.read(4) == magic:
+            if struct.unpack('<H', f.read(2))[0] != version:
+                raise ValueError('%s is a save slot of another version' % path)
+            f.seek(header.size)
+        else:
+            f.seek(0)
+        return pickle.load(f)
@@ -0,0 +1,252 @@
+# Soak test for Tile Strategy.
+# Plays game after game through the real game loop (the title screen, run, game over, the score board, then a restart)
+# in a window under SDL's dummy video driver, with key presses fed in instead of read from a keyboard.
+# Kiosks have slowed down after days of uptime; this plays days' worth of turns in one go to show why.
+# Every sample_interval turns it samples the memory Python has allocated (with tracemalloc) and the resident size of the process.
+# The soak fails if either grew more than memory_threshold bytes since the first sample, and lists the lines of code whose
+# allocations grew the most. tracemalloc makes the game several times slower; with --no-trace only the resident size
+# and Python's count of allocated blocks are sampled, which is enough to see whether anything grows. A watchdog thread fails it when the game stops asking for input for stall_time seconds,
+# like check_tile spinning on a full board would, and prints where the game was stuck.
+# Run this file with the number of turns to play, a million by default, and --no-trace to play them faster.
+import contextlib
+import gc
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+import _thread
+import pygame
+from pygame.locals import *
+import tile_strategy
+from tile_strategy import Tile_strategy
+
+# Keys the soak plays with.
+play_keys = (K_UP, K_DOWN, K_LEFT, K_RIGHT, K_SPACE)
+# Module settings of tile_strategy the soak points at a temp folder, so it leaves the player's files alone.
+file_settings = ('save_dir', 'telemetry_dir', 'replay_dir', 'high_scores_path')
+
+
+class Soak_failed(Exception):
+    pass
+
+
+# Raised from get_events once enough turns were played, to get out of Tile_strategy.main.
+class Soak_over(Exception):
+    pass
+
+
+# One memory sample: how far the soak got, and how much memory was in use then.
+class Sample:
+    # traced is None when tracemalloc isn't on, and resident is None where it can't be read.
+    def __init__(self, turns, games, seconds, traced, resident, blocks):
+        self.turns = turns
+        self.games = games
+        self.seconds = seconds
+        self.traced = traced
+        self.resident = resident
+        self.blocks = blocks
+
+
+# Returns the resident size of this process in bytes, or None where /proc isn't available.
+def resident_size():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# Stands in for the window's clock so frames don't wait for each other: every tick reports a frame's worth of time
+# as if the game ran at its frame rate. Days of kiosk time go by in minutes this way.
+class Fast_clock:
+    def __init__(self):
+        self.time = 0
+
+    def tick(self, framerate = 0):
+        self.time = 1000 // framerate if framerate else 0
+        return self.time
+
+    def get_time(self):
+        return self.time
+
+
+def key_event(key, text = ''):
+    return pygame.event.Event(KEYDOWN, key = key, unicode = text, mod = 0, scancode = 0)
+
+
+# A game whose input comes from the soak. Every screen reads its events through get_events, so nothing else is changed.
+class Soak_game(Tile_strategy):
+    def __init__(self, turns, turns_per_frame, sample_interval, memory_threshold, seed):
+        super().__init__()
+        self.turns = turns
+        self.turns_per_frame = turns_per_frame
+        self.sample_interval = sample_interval
+        self.memory_threshold = memory_threshold
+        self.policy = random.Random(seed)
+        # The screen the game is on, which decides what keys it gets.
+        self.screen_name = None
+        # Turns of the games that are over, and how many there were.
+        self.finished_turns = 0
+        self.games = 0
+        self.samples = []
+        self.baseline = None
+        self.next_sample = sample_interval
+        self.start_time = time.perf_counter()
+        # When the game last asked for input, and where it was stuck if it stopped. The watchdog sets stall.
+        self.last_input = time.perf_counter()
+        self.stall = None
+
+    def open_window(self):
+        super().open_window()
+        self.clock = Fast_clock()
+
+    # A save.dat left by an old version belongs to the player, so the soak doesn't import it.
+    def import_old_save(self):
+        pass
+
+    def start(self):
+        self.screen_name = 'start'
+        super().start()
+
+    def run(self):
+        self.screen_name = 'run'
+        super().run()
+
+    # The game over screen prints the frame stats of every game, which would flood the console.
+    def game_over(self):
+        self.screen_name = 'game_over'
+        self.games += 1
+        self.finished_turns += self.total_turn
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            super().game_over()
+
+    def score_board(self):
+        self.screen_name = 'score_board'
+        super().score_board()
+
+    def turns_played(self):
+        if self.screen_name == 'run':
+            return self.finished_turns + self.total_turn
+        return self.finished_turns
+
+    # Plays turns_per_frame random keys each frame of a game, enters a name on the game over screen,
+    # and presses Space on the title screen and the score board.
+    def get_events(self):
+        self.last_input = time.perf_counter()
+        # The dummy window still has events of its own, which are dropped.
+        pygame.event.get()
+        if self.screen_name == 'run':
+            turns = self.turns_played()
+            if turns >= self.next_sample or turns >= self.turns:
+                self.sample(turns)
+                self.next_sample = turns + self.sample_interval
+            if turns >= self.turns:
+                raise Soak_over()
+            return [key_event(self.policy.choice(play_keys)) for i in range(self.turns_per_frame)]
+        elif self.screen_name == 'game_over':
+            return [key_event(K_s, 's'), key_event(K_RETURN)]
+        return [key_event(K_SPACE)]
+
+    # Samples the memory in use. The first sample is the baseline the others are measured against.
+    def sample(self, turns):
+        gc.collect()
+        tracing = tracemalloc.is_tracing()
+        traced = tracemalloc.get_traced_memory()[0] if tracing else None
+        sample = Sample(turns, self.games, time.perf_counter() - self.start_time, traced, resident_size(),
+                        sys.getallocatedblocks())
+        self.samples.append(sample)
+        first = self.samples[0]
+        print(format_sample(sample, first))
+        if len(self.samples) == 1:
+            if tracing:
+                self.baseline = tracemalloc.take_snapshot()
+            return
+        grown = tracing and sample.traced - first.traced > self.memory_threshold
+        if sample.resident is not None and first.resident is not None:
+            grown = grown or sample.resident - first.resident > self.memory_threshold
+        if not grown:
+            return
+        message = 'Memory grew more than %d KB in %d turns.' % (self.memory_threshold // 1024, turns - first.turns)
+        if tracing:
+            growth = tracemalloc.take_snapshot().compare_to(self.baseline, 'lineno')
+            message += ' Biggest growth:\n' + '\n'.join(str(stat) for stat in growth[:10])
+        else:
+            message += ' Run it again with tracemalloc on to see where.'
+        raise Soak_failed(message)
+
+
+def format_sample(sample, first):
+    line = '%10d turns %6d games %7.0f turns/s   blocks %8d (%+d)' % (
+        sample.turns, sample.games, sample.turns / sample.seconds, sample.blocks, sample.blocks - first.blocks)
+    if sample.traced is not None:
+        line += '   traced %8.1f KB (%+.1f)' % (sample.traced / 1024, (sample.traced - first.traced) / 1024)
+    if sample.resident is not None:
+        line += '   resident %8.1f KB (%+.1f)' % (sample.resident / 1024, (sample.resident - first.resident) / 1024)
+    return line
+
+
+# Watches the game from another thread. If it goes stall_time seconds without asking for input, this records
+# where the main thread is and interrupts it.
+def watch(game, stall_time, stopped, main_thread):
+    while not stopped.wait(stall_time / 4):
+        if time.perf_counter() - game.last_input > stall_time:
+            frame = sys._current_frames().get(main_thread)
+            game.stall = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            _thread.interrupt_main()
+            return
+
+
+# Plays turns turns and returns the memory samples. Raises Soak_failed if memory grew too much or the game stalled.
+# trace turns tracemalloc on.
+def soak(turns = 1000000, turns_per_frame = 256, sample_interval = 50000, memory_threshold = 16 << 20,
+         stall_time = 10.0, trace = True, seed = 0):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    random.seed(seed)
+    settings = {name: getattr(tile_strategy, name) for name in file_settings}
+    print_combat_log = tile_strategy.print_combat_log
+    folder = tempfile.TemporaryDirectory(prefix = 'soak-')
+    for name in file_settings:
+        setattr(tile_strategy, name, os.path.join(folder.name, settings[name]))
+    tile_strategy.print_combat_log = False
+    if trace:
+        tracemalloc.start()
+    game = Soak_game(turns, turns_per_frame, sample_interval, memory_threshold, seed + 1)
+    stopped = threading.Event()
+    watchdog = threading.Thread(target = watch, args = (game, stall_time, stopped, threading.get_ident()),
+                                name = 'soak watchdog', daemon = True)
+    watchdog.start()
+    try:
+        game.main()
+    except Soak_over:
+        game.autosaver.stop(discard = True)
+    except KeyboardInterrupt:
+        if game.stall is None:
+            raise
+        raise Soak_failed('No input was asked for in %g seconds, on the %s screen after %d turns. The game was at:\n%s' %
+                          (stall_time, game.screen_name, game.turns_played(), game.stall))
+    finally:
+        stopped.set()
+        tracemalloc.stop()
+        pygame.quit()
+        for name, value in settings.items():
+            setattr(tile_strategy, name, value)
+        tile_strategy.print_combat_log = print_combat_log
+        folder.cleanup()
+    return game.samples
+
+
+if __name__ == '__main__':
+    arguments = [argument for argument in sys.argv[1:] if argument != '--no-trace']
+    turns = int(arguments[0]) if arguments else 1000000
+    try:
+        samples = soak(turns, trace = '--no-trace' not in sys.argv[1:])
+    except Soak_failed as error:
+        print('Soak failed: %s' % error)
+        sys.exit(1)
+    last = samples[-1]
+    print('Soak passed: %d turns in %d games, %.0f turns per second.' % (last.turns, last.games, last.turns / last.seconds))
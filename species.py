@@ -0,0 +1,39 @@
+# Species registry for Tile Strategy.
+# Enemy species are read from a data file instead of being written into the game code.
+# Each row gives the species' tile number, name, sprite, base stats, and how fast the stats grow.
+# An enemy's stats grow with the length of the game and the floor: stat = base + growth * (total_turn // 5 + floor).
+import csv
+import numpy as np
+
+
+class Species_registry:
+    # Loads the species table from a csv file.
+    def __init__(self, path):
+        with open(path, newline = '') as f:
+            rows = list(csv.DictReader(f))
+        self.tiles = np.array([int(row['tile']) for row in rows])
+        self.names = [row['name'] for row in rows]
+        self.images = [row['image'] for row in rows]
+        # Stats are stored as vectors, one row per species: [hp, atk].
+        self.base = np.array([[int(row['hp']), int(row['atk'])] for row in rows])
+        self.growth = np.array([[int(row['hp_growth']), int(row['atk_growth'])] for row in rows])
+        # index maps a tile number to its row in the table, or -1 if the tile isn't an enemy.
+        self.index = np.full(self.tiles.max() + 1, -1)
+        self.index[self.tiles] = np.arange(len(rows))
+
+    def __len__(self):
+        return len(self.tiles)
+
+    # Returns the species name of an enemy tile, for combat messages.
+    def name(self, enemy_type):
+        return self.names[self.index[enemy_type]]
+
+    # Returns the stats [hp, atk, exp] of newly spawned enemies.
+    # enemy_types, total_turn and floor can be single numbers or arrays of any shape that broadcast together,
+    # so the stats of many enemies across many games come out of one vectorized expression.
+    def stats(self, enemy_types, total_turn, floor):
+        rows = self.index[np.asarray(enemy_types)]
+        scale = (np.asarray(total_turn) // 5 + np.asarray(floor))[..., np.newaxis]
+        hp_atk = self.base[rows] + self.growth[rows] * scale
+        enemy_exp = hp_atk.sum(axis = -1, keepdims = True) // 2
+        return np.concatenate([hp_atk, enemy_exp], axis = -1)
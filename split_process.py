@@ -0,0 +1,206 @@
+# Runs Tile Strategy as two processes: the game logic in one, the window and all the drawing in the other.
+# The logic process publishes the game into a shared memory block after every turn: the board, laid out like self.array,
+# the player values, the last combat event and the turn's motions. The render process copies it out whenever it changed
+# and draws at its own pace, so slow drawing never holds up a turn. Key presses go back to the logic process on a queue.
+# A sequence counter (a seqlock) keeps reads consistent without locks: the logic process makes the counter odd while it writes
+# and even again when it's done, and the render process only keeps a copy if the counter was even and unchanged around it.
+# Run this file to play this way. With 'autoplay', the logic process plays with the autoplay policy as fast as it can
+# while the other process watches.
+import multiprocessing
+import queue
+import random
+import sys
+import time
+import numpy as np
+import pygame
+from autoplay import choose_action
+from multiprocessing import shared_memory
+from pygame.locals import *
+from combat_log import event_dtype
+from tile_strategy import (Tile_strategy, fps, board_width, board_height, state_scalars, up, down, left, right)
+
+# Header fields at the start of the shared block.
+sequence = 0
+closed = 1
+combat_count = 2
+motion_count = 3
+is_dead = 4
+header_size = 5
+# Sent on the key queue when the window is closed.
+quit_key = -1
+# Seconds the last frame stays up once the game is over.
+linger_time = 1.0
+
+key_directions = {K_UP: up, K_DOWN: down, K_LEFT: left, K_RIGHT: right}
+
+
+# Returns where each part of a shared block goes, as (name, dtype, shape, offset), and the size of the block.
+# The block holds the header, the player values, the last combat event, up to two motions per cell and the board.
+def block_layout(width, height):
+    parts = []
+    offset = 0
+    for name, dtype, shape in (('header', np.int64, (header_size,)), ('scalars', np.int64, (len(state_scalars),)),
+                               ('event', event_dtype, (1,)), ('motions', np.int64, (2 * width * height, 5)),
+                               ('board', np.int64, (width, height, 6))):
+        parts.append((name, dtype, shape, offset))
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        # Keeps every part aligned to 8 bytes.
+        offset += -offset % 8
+    return parts, offset
+
+
+# Returns NumPy views of the parts of a shared block, or of a copy of one, by name.
+def block_views(buffer, width, height):
+    parts = block_layout(width, height)[0]
+    return {name: np.frombuffer(buffer, dtype = dtype, count = int(np.prod(shape)), offset = offset).reshape(shape)
+            for name, dtype, shape, offset in parts}
+
+
+class Shared_board:
+    # Makes a new shared block, or attaches to the one called name.
+    def __init__(self, name = None, width = board_width, height = board_height):
+        self.size = block_layout(width, height)[1]
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create = True, size = self.size)
+        else:
+            self.memory = shared_memory.SharedMemory(name = name)
+        self.width = width
+        self.height = height
+        self.views = block_views(self.memory.buf, width, height)
+        self.header = self.views['header']
+        self.last_sequence = -1
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    # Writes the game into the block. The game's motions are handed over and cleared.
+    def publish(self, game):
+        views = self.views
+        self.header[sequence] += 1
+        views['board'][:] = game.array
+        views['scalars'][:] = game.get_scalars()
+        last_event = game.combat_log.last()
+        if last_event is not None:
+            views['event'][0] = last_event
+        self.header[combat_count] = game.combat_log.count
+        motions = game.motions[:len(views['motions'])]
+        for i, (kind, (x, y), (to_x, to_y)) in enumerate(motions):
+            views['motions'][i] = (kind == 'attack', x, y, to_x, to_y)
+        self.header[motion_count] = len(motions)
+        game.motions = []
+        self.header[is_dead] = bool(game.is_dead)
+        self.header[sequence] += 1
+
+    def close_game(self):
+        self.header[closed] = 1
+
+    # Returns a consistent copy of the block as a dict of views, or None if nothing was published since the last read.
+    def read(self):
+        while True:
+            start = int(self.header[sequence])
+            if start == self.last_sequence:
+                return None
+            if start % 2 == 1:
+                time.sleep(0)
+                continue
+            data = bytearray(self.memory.buf[:self.size])
+            if int(self.header[sequence]) == start:
+                self.last_sequence = start
+                return block_views(data, self.width, self.height)
+
+    def close(self, unlink = False):
+        self.views = None
+        self.header = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+# The render process: opens the window, draws whatever the logic process published and sends the keys back.
+def render_main(name, keys):
+    board = Shared_board(name)
+    view = Tile_strategy()
+    view.load = False
+    view.open_window()
+    pygame.display.set_caption('Tile Strategy')
+    view.setup_game()
+    combat_events = 0
+    over_since = None
+    while True:
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                keys.put(quit_key)
+            elif event.type == KEYDOWN:
+                keys.put(event.key)
+        state = board.read()
+        if state is not None:
+            header = state['header']
+            view.array = state['board']
+            for name, value in zip(state_scalars, state['scalars'].tolist()):
+                setattr(view, name, value)
+            if header[combat_count] != combat_events:
+                combat_events = int(header[combat_count])
+                view.combat_log.record(*state['event'][0].tolist())
+            motions = [('attack' if kind else 'move', (x, y), (to_x, to_y)) for kind, x, y, to_x, to_y in
+                       state['motions'][:header[motion_count]].tolist()]
+            if motions:
+                view.animator.start(motions)
+            view.renderer.request()
+            if (header[closed] or header[is_dead]) and over_since is None:
+                over_since = time.perf_counter()
+        if over_since is not None and time.perf_counter() - over_since > linger_time:
+            break
+        view.renderer.flush()
+        pygame.display.update()
+        if view.animator.advance(view.clock.tick(fps) / 1000):
+            view.renderer.request()
+    board.close()
+    pygame.quit()
+
+
+# The logic process: plays the game from the keys the render process sends, or with the autoplay policy when autoplay is True.
+# Returns the finished game.
+def run(autoplay = False, max_turns = None, seed = None):
+    random.seed(seed)
+    game = Tile_strategy()
+    game.load = False
+    game.setup_game()
+    board = Shared_board()
+    context = multiprocessing.get_context('spawn')
+    keys = context.Queue()
+    renderer = context.Process(target = render_main, args = (board.name, keys), name = 'render', daemon = True)
+    renderer.start()
+    board.publish(game)
+    try:
+        while not game.is_dead and (max_turns is None or game.total_turn < max_turns):
+            try:
+                key = keys.get(block = not autoplay, timeout = None if autoplay else 0.5)
+            except queue.Empty:
+                key = None
+                if not autoplay and not renderer.is_alive():
+                    break
+            if key == quit_key or key == K_ESCAPE:
+                break
+            if autoplay:
+                game.act(choose_action(game))
+            elif key == K_SPACE:
+                game.act(None)
+            elif key in key_directions:
+                game.act(key_directions[key])
+            else:
+                continue
+            board.publish(game)
+    finally:
+        board.close_game()
+        renderer.join(timeout = 5)
+        board.close(unlink = True)
+    return game
+
+
+if __name__ == '__main__':
+    autoplay = 'autoplay' in sys.argv[1:]
+    start = time.perf_counter()
+    game = run(autoplay = autoplay)
+    print('Game over on turn %d, score %d. The logic process played %.0f turns per second.' %
+          (game.total_turn, game.get_score(), game.total_turn / (time.perf_counter() - start)))
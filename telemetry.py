@@ -0,0 +1,70 @@
+# Telemetry for Tile Strategy.
+# Every turn of a game becomes one row: the turn, the floor, where the player stood, their hp, the damage they took,
+# the enemies they killed, the potions used, whether they changed floors, and if they died, what killed them and their score.
+# Rows go into columnar buffers, one NumPy array per column, and are written out a chunk at a time as compressed .npz files.
+# telemetry_analysis.py reads the chunks back.
+import os
+import numpy as np
+
+# The columns of a row, in the order record takes them.
+# floor_change is +1 for a turn that went up a floor and -1 for one that went down. cause is the tile of the enemy that killed the player.
+columns = (('turn', np.int32), ('floor', np.int16), ('x', np.int16), ('y', np.int16), ('hp', np.int32),
+           ('damage', np.int32), ('kills', np.int16), ('potions', np.int16), ('floor_change', np.int8),
+           ('dead', np.bool_), ('cause', np.int16), ('score', np.int32))
+
+
+class Telemetry:
+    # Chunks are written to directory, named after the session, which is any number that tells games apart.
+    # chunk is how many rows are collected before they're written.
+    def __init__(self, directory, session, chunk = 4096):
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+        self.session = session
+        self.buffers = [np.zeros(chunk, dtype = dtype) for name, dtype in columns]
+        self.rows = 0
+        self.chunks = 0
+        # Rows in the chunks written so far.
+        self.written = 0
+
+    # The number of rows recorded, written or not.
+    def __len__(self):
+        return self.written + self.rows
+
+    def chunk_path(self, number):
+        return os.path.join(self.directory, 'session_%d_%05d.npz' % (self.session, number))
+
+    # Adds a row. Takes one value per column, in the order of columns.
+    def record(self, *row):
+        for buffer, value in zip(self.buffers, row):
+            buffer[self.rows] = value
+        self.rows += 1
+        if self.rows == len(self.buffers[0]):
+            self.flush()
+
+    # Writes the rows collected so far as the next chunk of the session.
+    def flush(self):
+        if self.rows == 0:
+            return
+        data = {name: buffer[:self.rows] for (name, dtype), buffer in zip(columns, self.buffers)}
+        np.savez_compressed(self.chunk_path(self.chunks), session = np.int64(self.session), **data)
+        self.written += self.rows
+        self.rows = 0
+        self.chunks += 1
+
+    # Drops every row after the first count, like when turns are taken back. Rows that were already written
+    # are read back from their chunk, whose file is deleted; they're written again with the next chunk.
+    def rewind(self, count):
+        while count < self.written:
+            self.chunks -= 1
+            path = self.chunk_path(self.chunks)
+            with np.load(path) as chunk:
+                self.rows = len(chunk['turn'])
+                for (name, dtype), buffer in zip(columns, self.buffers):
+                    buffer[:self.rows] = chunk[name]
+            os.remove(path)
+            self.written -= self.rows
+        self.rows = count - self.written
+
+    # Writes whatever is left. Called when the game ends or is quit.
+    def close(self):
+        self.flush()
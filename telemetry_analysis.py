@@ -0,0 +1,103 @@
+# Analysis of Tile Strategy telemetry (see telemetry.py).
+# Reads the chunk files one at a time and adds them up with bincounts, so memory stays flat however many turns there are:
+# heatmaps of where players stand and where they die, turns spent and deaths on each floor, how many runs survive to
+# each floor, what kills players, and how scores are distributed.
+# Run this file with a telemetry directory to print a summary.
+import glob
+import os
+import sys
+import time
+import numpy as np
+
+
+# Returns the chunk files in a telemetry directory, in order.
+def chunk_files(directory):
+    return sorted(glob.glob(os.path.join(directory, 'session_*.npz')))
+
+
+# Adds counts onto a running total, growing the total if the counts are longer.
+def add_counts(total, counts):
+    if len(counts) > len(total):
+        total = np.pad(total, (0, len(counts) - len(total)))
+    total[:len(counts)] += counts
+    return total
+
+
+# Sums up the turns in the given chunk files. width and height are the size of the board.
+# Scores are counted in bins of score_bin points.
+def summarize(files, width = 8, height = 8, score_bin = 50):
+    positions = np.zeros(width * height, dtype = np.int64)
+    deaths = np.zeros(width * height, dtype = np.int64)
+    turns_by_floor = np.zeros(1, dtype = np.int64)
+    deaths_by_floor = np.zeros(1, dtype = np.int64)
+    causes = np.zeros(1, dtype = np.int64)
+    scores = np.zeros(1, dtype = np.int64)
+    # The highest floor each session reached, and the sessions that ended in death.
+    highest_floor = {}
+    dead_sessions = set()
+    turns = 0
+    for path in files:
+        with np.load(path) as chunk:
+            x = chunk['x'].astype(np.intp)
+            y = chunk['y'].astype(np.intp)
+            floor = chunk['floor'].astype(np.intp)
+            dead = chunk['dead']
+            cells = x * height + y
+            session = int(chunk['session'])
+            highest_floor[session] = max(highest_floor.get(session, 0), int(floor.max()))
+            if dead.any():
+                dead_sessions.add(session)
+            turns += len(x)
+            positions += np.bincount(cells, minlength = width * height)
+            deaths += np.bincount(cells[dead], minlength = width * height)
+            turns_by_floor = add_counts(turns_by_floor, np.bincount(floor))
+            deaths_by_floor = add_counts(deaths_by_floor, np.bincount(floor[dead]))
+            causes = add_counts(causes, np.bincount(chunk['cause'][dead].astype(np.intp)))
+            scores = add_counts(scores, np.bincount(chunk['score'][dead].astype(np.intp) // score_bin))
+    # A run survived to a floor if the highest floor it reached is that floor or above. Runs that were quit don't count.
+    runs = len(dead_sessions)
+    highest = np.bincount(np.array([highest_floor[session] for session in dead_sessions], dtype = np.intp), minlength = len(turns_by_floor))
+    reached = np.cumsum(highest[::-1])[::-1]
+    return {'turns': turns,
+            'sessions': len(highest_floor),
+            'runs': runs,
+            'positions': positions.reshape(width, height),
+            'deaths': deaths.reshape(width, height),
+            'turns_by_floor': turns_by_floor,
+            'deaths_by_floor': deaths_by_floor,
+            'survival': reached / max(runs, 1),
+            'causes': causes,
+            'scores': scores,
+            'score_bin': score_bin}
+
+
+# Formats a heatmap as rows of text, one row per y, like the board is drawn.
+def heatmap_text(counts):
+    return '\n'.join(' '.join('%6d' % counts[x][y] for x in range(counts.shape[0])) for y in range(counts.shape[1]))
+
+
+def report(summary):
+    lines = ['%d turns from %d sessions, %d runs ended in death.' % (summary['turns'], summary['sessions'], summary['runs'])]
+    lines.append('Where players stood:')
+    lines.append(heatmap_text(summary['positions']))
+    lines.append('Where players died:')
+    lines.append(heatmap_text(summary['deaths']))
+    lines.append('Floor  turns  deaths  survival')
+    for floor in range(1, len(summary['turns_by_floor'])):
+        deaths = summary['deaths_by_floor'][floor] if floor < len(summary['deaths_by_floor']) else 0
+        survival = summary['survival'][floor] if floor < len(summary['survival']) else 0.0
+        lines.append('%5d %6d %7d %8.1f%%' % (floor, summary['turns_by_floor'][floor], deaths, survival * 100))
+    lines.append('Killed by: ' + ', '.join('tile %d: %d' % (cause, count) for cause, count in enumerate(summary['causes']) if count))
+    lines.append('Scores:')
+    for i, count in enumerate(summary['scores']):
+        if count:
+            lines.append('%5d-%-5d %d' % (i * summary['score_bin'], (i + 1) * summary['score_bin'] - 1, count))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'telemetry'
+    start = time.perf_counter()
+    summary = summarize(chunk_files(directory))
+    print(report(summary))
+    print('Summarized in %.2f s.' % (time.perf_counter() - start))
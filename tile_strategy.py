@@ -1,12 +1,33 @@
 # Tile Strategy by Felix Chu
 # Tile Strategy is a roguelike game where the player attempts to survive as long as possible within an 8 by 8 matrix.
 # Game controls are Up, Down, Left, and Right, which move the player, and Space, which skips your turn.
+# Z takes back the last turn, as many times as the undo history goes back, and Y plays a turn taken back again.
 import sys
 import os
 import random
+import time
 import pickle
+import threading
 import pygame
 import numpy as np
+import board_delta
+import autosave
+from render_scheduler import Render_scheduler
+from animation import Animator, Frame_timer
+from timeline import Timeline
+from species import Species_registry
+from combat_log import Combat_log, hit, potion_used
+from floor_gen import Floor_pregenerator, generate_floor
+from floor_cache import Floor_cache
+from telemetry import Telemetry
+from replay import Replay_recorder
+from latency import Latency_probe
+from undo import Undo_buffer
+import save_slots
+import kernels
+import line_of_sight
+import autoplay
+import leaderboard
 from pygame.locals import *
 
 # Define things for readability. Never changed in-game.
@@ -28,13 +49,15 @@ down  = 'down'
 left  = 'left'
 right = 'right'
 
-# Define tile types for use in the array
+# Define tile types for use in the array. Enemy species are listed in species.csv.
 grass  = 0
 player = 1
 slime  = 2
 wolf   = 3
 potion = 4
 stairs = 5
+wall   = 6
+down_stairs = 7
 
 # Define tile stat locations for use in the array
 tile   = 0
@@ -44,11 +67,101 @@ exp    = 3
 moved  = 4
 ground = 5
 
+# Each cell starts out as a wall with this chance, then the walls go through this many cellular automaton passes.
+# A handful of passes turns the noise into caves on big boards; on the 8 by 8 board the walls are left as scattered obstacles.
+wall_density = 0.12
+wall_passes = 0
+
+# With fog of war, the player only sees the cells in their line of sight, walls blocking it, and enemies only chase a player
+# they can see. See line_of_sight.py.
+fog_of_war = False
+
+# Floors the player left are kept for the down-stairs. Up to this many bytes of them stay in memory;
+# older ones are kept as deltas from their generated layout, or written to floor_spill_dir if it is set.
+floor_cache_budget = 1 << 16
+floor_spill_dir = None
+
+# Enemies spawn every spawn_cooldown turns on a floor, as long as there are fewer than max_enemies.
+spawn_cooldown = 8
+max_enemies = 8
+
+# Player values that make up the game state, in the order they are saved.
+state_scalars = ('player_x', 'player_y', 'player_max_hp', 'player_hp', 'player_atk', 'player_exp', 'level',
+                 'level_ups', 'potion_count', 'floor', 'total_turn', 'enemy_count', 'floor_turn')
+
+# How long, in seconds, sprites take to slide into their new cells.
+animation_time = 0.12
+
+# The game is saved in the background every this many turns, into its save slot in save_dir.
+autosave_interval = 20
+save_dir = 'saves'
+
+# Pressing A in a game lets the autoplay policy (see autoplay.py) play it, as fast as it can, until A is pressed again.
+# A frame is then only shown once autoplay_every turns were played since the last one, and at most autoplay_fps times a second.
+autoplay_every = 1
+autoplay_fps = 30
+
+# Turns taken back with Z can be played again with Y. Up to this many bytes of turns are kept, as board deltas, for each floor;
+# the history starts over on every floor. 0 turns undo off.
+undo_budget = 1 << 18
+
+# When True, every key press that plays a turn is timed until its frame is shown, and the game over screen prints
+# the histograms. See latency.py.
+measure_latency = False
+
+# When True, combat events are printed to the console, a batch at a time.
+print_combat_log = True
+
+# Every turn of a game is recorded for telemetry_analysis.py, in files written to this directory. None turns it off.
+telemetry_dir = 'telemetry'
+
+# Every game is recorded as a replay in this directory, viewable with replay_viewer.py. None turns it off.
+replay_dir = 'replays'
+
+# The score board: the top 10 scores as a pickled list of (score, name) pairs.
+high_scores_path = 'high scores.dat'
+
+# Scores are also sent to the shared leaderboard at this address, like 'http://localhost:8135' (see leaderboard.py).
+# None turns it off.
+leaderboard_url = None
+
+# When True, every turn's board delta is checked by decoding it again. Slow; only for debugging.
+verify_deltas = False
+
 
 class Tile_strategy:
+    # Loads the game data that doesn't need a window: the enemy species, their stats and where their sprites are.
+    def __init__(self):
+        self.species = Species_registry('species.csv')
+        self.enemies = [int(enemy_type) for enemy_type in self.species.tiles]
+        # Floors are generated from the game's seed, the next one ahead of time on a worker thread.
+        self.pregenerator = Floor_pregenerator()
+        # Floors the player has left, in case they come back down.
+        self.floor_cache = Floor_cache(self.floor_base, floor_cache_budget, floor_spill_dir)
+        # With Numba installed, the enemy turn and the player's attacks run as compiled kernels (see kernels.py).
+        # The kernels write what happened into these buffers, and is_enemy tells them which tiles are enemies.
+        self.use_kernels = kernels.compiled
+        self.is_enemy = np.zeros(max(self.enemies) + 1, dtype=bool)
+        self.is_enemy[self.enemies] = True
+        self.kernel_events = np.zeros((2 * board_width * board_height, 4), dtype=np.int64)
+        self.kernel_motions = np.zeros((2 * board_width * board_height, 5), dtype=np.int64)
+        self.fog_of_war = fog_of_war
+        # What the player sees without fog of war: everything.
+        self.all_visible = np.ones((board_width, board_height), dtype=bool)
+
     # The main function loads necessary game elements such as the fps clock, window, fonts, sprites, etc. 
     # It then runs each of the game functions in order: the title screen, the game itself, the game over screen, then finally the score board.
+    # Restarting from the score board goes around the loop again, so any number of games can be played in one window.
     def main(self):
+        self.open_window()
+        while True:
+            self.start()
+            self.run()
+            self.game_over()
+            self.score_board()
+
+    # Opens the game window and loads the fonts and sprites. The replay viewer uses this too.
+    def open_window(self):
         pygame.init() 
         self.clock = pygame.time.Clock() 
         self.screen = pygame.display.set_mode((window_width, window_height)) 
@@ -56,62 +169,94 @@ class Tile_strategy:
         self.big_font = pygame.font.Font('freesansbold.ttf', 48) 
         self.images = {grass  : pygame.image.load('grass.png'), 
                        player : pygame.image.load('player.png'),
-                       slime  : pygame.image.load('slime.png'),
-                       wolf   : pygame.image.load('wolf.png'),
                        potion : pygame.image.load('potion.png'),
                        stairs : pygame.image.load('stairs.png')}
-        self.enemies = [slime, wolf] 
-        self.species_list = [None, None, 'slime', 'wolf']
+        self.images[down_stairs] = pygame.transform.flip(self.images[stairs], False, True)
+        # Enemy sprites come from the species table.
+        for enemy_type, image in zip(self.enemies, self.species.images):
+            self.images[enemy_type] = pygame.image.load(image)
         pygame.display.set_caption('Tile Strategy') 
         pygame.display.set_icon(pygame.image.load('player.png'))
-        self.start() 
-        self.run()
-        self.game_over()
-        self.score_board()
 
-    # Runs the start screen. The player can start a new game or continue from a saved game here.
-    # Any save data will be deleted when the game starts.
+    # Runs the start screen. The player can start a new game or continue one of the saved games here.
+    # Up and Down pick a save, Return resumes it and Delete removes it. Space starts a new game in a new save slot.
+    # Only the headers of the saves are read, so the list shows up right away however many saves there are.
     def start(self):
-        # The following code makes the screen black, then displays the title screen text.
-        self.screen.fill(black)
-        title_text = self.big_font.render('Tile Strategy', True, white)
-        title_text_rect = title_text.get_rect()
-        title_text_rect.center = (window_width / 2, window_height / 2 - 36)
-        self.screen.blit(title_text, title_text_rect)
-        start_text = self.font.render('Press Space to start a new game', True, white)
-        start_text_rect = start_text.get_rect()
-        start_text_rect.center = (window_width / 2, window_height / 2)
-        self.screen.blit(start_text, start_text_rect)
-        # If there is a save data, show the option to resume from save. Otherwise don't show this.
-        if os.path.exists('save.dat'):
-            continue_text = self.font.render('Press Enter/Return to resume from save', True, white)
-            continue_text_rect = continue_text.get_rect()
-            continue_text_rect.center = (window_height / 2 + 100, window_height / 2 + 32)
-            self.screen.blit(continue_text, continue_text_rect)
+        self.import_old_save()
+        slots = save_slots.list_slots(save_dir)
+        selected = 0
+        self.draw_title(slots, selected)
         # Infinite loop keeps the title screen running.
         # Pressing Space or Return ends the title screen, starting the game.
-        # self.load tells the game whether or not it's loading a save state.
+        # self.load tells the game whether or not it's loading a save state, and self.save_path which slot the game saves to.
         while True:
-            for event in pygame.event.get():
+            for event in self.get_events():
                 if event.type == QUIT:
                     self.quit()
                 elif event.type == KEYDOWN:
                     if event.key == K_ESCAPE:
                         self.quit()
-                    elif event.key == K_RETURN:
-                        if os.path.exists('save.dat'):
-                            self.load = True
-                        else:
-                            self.load = False
+                    elif event.key == K_UP and selected > 0:
+                        selected -= 1
+                    elif event.key == K_DOWN and selected < len(slots) - 1:
+                        selected += 1
+                    elif event.key == K_DELETE and slots:
+                        os.remove(slots.pop(selected).path)
+                        selected = max(0, min(selected, len(slots) - 1))
+                    elif event.key == K_RETURN and slots:
+                        self.load = True
+                        self.save_path = slots[selected].path
                         return
-                    elif event.key == K_SPACE:
-                        if os.path.exists('save.dat'):
-                            os.remove('save.dat')
+                    elif event.key == K_RETURN or event.key == K_SPACE:
                         self.load = False
+                        self.save_path = save_slots.new_slot_path(save_dir)
                         return
+                    self.draw_title(slots, selected)
             pygame.display.update()
             self.clock.tick(fps)
 
+    # Draws the title screen: the title, then a list of the saves with a thumbnail of each board.
+    # Only slots_shown saves fit, so the list scrolls to keep the selected one in view.
+    def draw_title(self, slots, selected):
+        slots_shown = 7
+        row_height = 48
+        list_top = 184
+        list_left = 100
+        cell_size = 5
+        self.screen.fill(black)
+        title_text = self.big_font.render('Tile Strategy', True, white)
+        title_text_rect = title_text.get_rect()
+        title_text_rect.center = (window_width / 2, 64)
+        self.screen.blit(title_text, title_text_rect)
+        start_text = self.font.render('Press Space to start a new game', True, white)
+        start_text_rect = start_text.get_rect()
+        start_text_rect.center = (window_width / 2, 120)
+        self.screen.blit(start_text, start_text_rect)
+        # If there are saves, show the option to resume one. Otherwise don't show this.
+        if slots:
+            continue_text = self.font.render('Press Enter/Return to resume a save', True, white)
+            continue_text_rect = continue_text.get_rect()
+            continue_text_rect.center = (window_width / 2, 152)
+            self.screen.blit(continue_text, continue_text_rect)
+        thumbnail_colors = {grass: (34, 139, 34), player: white, potion: (255, 0, 255), stairs: (255, 215, 0),
+                            wall: grey, down_stairs: (184, 134, 11)}
+        first = min(max(0, selected - slots_shown // 2), max(0, len(slots) - slots_shown))
+        for row, slot in enumerate(slots[first:first + slots_shown]):
+            top = list_top + row * row_height
+            if first + row == selected:
+                pygame.draw.rect(self.screen, grey, (list_left - 8, top - 4, window_width - 2 * list_left + 16, row_height - 4), 2)
+            for x in range(save_slots.thumbnail_size):
+                for y in range(save_slots.thumbnail_size):
+                    color = thumbnail_colors.get(slot.thumbnail[x][y], red)
+                    pygame.draw.rect(self.screen, color, (list_left + x * cell_size, top + y * cell_size, cell_size, cell_size))
+            slot_text = self.font.render('Floor %d   Level %d   Turn %d   %s' % (slot.floor, slot.level, slot.turn,
+                                         time.strftime('%Y-%m-%d %H:%M', time.localtime(slot.timestamp))), True, white)
+            self.screen.blit(slot_text, (list_left + 56, top + 8))
+
+    # Returns the window's events since the last call. Every screen reads its input through here.
+    def get_events(self):
+        return pygame.event.get()
+
     #Quits the game. It's only called when pressing ESC or clicking the X button.
     def quit(self): 
         pygame.quit()
@@ -119,11 +264,143 @@ class Tile_strategy:
 
     # Runs the game itself. Keeps running until the player dies or quits.
     def run(self):
+        self.setup_game()
+        if print_combat_log:
+            self.combat_log.add_sink(self.print_combat_events)
+        self.renderer.request()
+        # The autosaver writes the save slot on a worker thread so saving never stalls the game.
+        self.autosaver = autosave.Autosaver(self.save_path)
+        self.last_save_turn = self.total_turn
+        session = int(time.time() * 1000)
+        if telemetry_dir is not None:
+            self.telemetry = Telemetry(telemetry_dir, session)
+        if replay_dir is not None:
+            self.recorder = Replay_recorder(self, os.path.join(replay_dir, 'replay_%d.dat' % session))
+        if measure_latency:
+            self.latency = Latency_probe()
+        # direction starts out as None. It changes depending on which key is pressed.
+        direction = None
+        while True:
+            frame_start = self.frame_timer.frame_start()
+            for event in self.get_events():
+                if event.type == QUIT:
+                    self.save_game(wait = True)
+                    self.close_telemetry()
+                    self.save_replay()
+                    self.print_latency()
+                    quit()
+                elif event.type == KEYDOWN:
+                    key_time = time.perf_counter()
+                    if event.key == K_ESCAPE:
+                        self.save_game(wait = True)
+                        self.close_telemetry()
+                        self.save_replay()
+                        self.print_latency()
+                        quit()
+                    elif event.key == K_UP:
+                        direction = up
+                    elif event.key == K_DOWN:
+                        direction = down
+                    elif event.key == K_LEFT:
+                        direction = left
+                    elif event.key == K_RIGHT:
+                        direction = right
+                    elif event.key == K_SPACE:
+                        self.act(None)
+                        self.frame_timer.turn(time.perf_counter() - key_time)
+                        if self.latency is not None:
+                            self.latency.acted(key_time)
+                    elif event.key == K_a:
+                        self.autoplaying = not self.autoplaying
+                        self.autoplay_mark = (time.perf_counter(), self.total_turn)
+                        self.autoplay_rate = 0.0
+                        self.renderer.request()
+                    # Undoing stops autoplay, or it would play the turns again straight away.
+                    elif event.key == K_z and self.undo is not None:
+                        self.autoplaying = False
+                        self.undo_turn()
+                        self.last_save_turn = min(self.last_save_turn, self.total_turn)
+                    elif event.key == K_y and self.undo is not None:
+                        self.redo_turn()
+                    # Upon a successful player action, the rest of the turn is played out.
+                    if direction != None and self.act(direction) == True:
+                        self.frame_timer.turn(time.perf_counter() - key_time)
+                        if self.latency is not None:
+                            self.latency.acted(key_time)
+                        direction = None
+                    # Ends the function when the player dies.
+                    if self.is_dead == True: 
+                        self.finish_game()
+                        return
+            if self.autoplaying:
+                self.autoplay_turns(frame_start)
+                if self.is_dead:
+                    self.finish_game()
+                    return
+            if self.total_turn - self.last_save_turn >= autosave_interval:
+                self.save_game()
+            self.combat_log.flush()
+            # The turns played this frame are already resolved. Their animations start now, cutting short any older ones.
+            if self.motions:
+                self.animator.start(self.motions)
+                self.motions = []
+            self.renderer.flush()
+            if self.latency is not None:
+                self.latency.drawn()
+            pygame.display.update()
+            if self.latency is not None:
+                self.latency.shown()
+            self.frame_timer.frame_end(frame_start, self.animator.is_active())
+            # Autoplay sets its own pace, so the frame rate isn't capped then.
+            tick_start = time.perf_counter()
+            frame_time = self.clock.tick(0 if self.autoplaying else fps)
+            if self.latency is not None:
+                self.latency.ticked(time.perf_counter() - tick_start)
+            if self.animator.advance(frame_time / 1000):
+                self.renderer.request()
+
+    # Cleans up after the player died. A dead game can't be resumed, so its save is thrown away.
+    def finish_game(self):
+        self.combat_log.flush()
+        self.close_telemetry()
+        self.save_replay()
+        self.autosaver.stop(discard = True)
+        if os.path.exists(self.save_path):
+            os.remove(self.save_path)
+
+    # Plays turns with the autoplay policy until at least autoplay_every turns were played and the next frame is due,
+    # going by autoplay_fps from frame_start, or until the player dies. Turns played this fast aren't animated.
+    def autoplay_turns(self, frame_start):
+        frame_due = frame_start + 1 / autoplay_fps
+        turns = 0
+        while not self.is_dead and (turns < autoplay_every or time.perf_counter() < frame_due):
+            self.act(autoplay.choose_action(self))
+            turns += 1
+        self.motions = []
+        # The turns per second shown on screen are measured over half a second or so.
+        now = time.perf_counter()
+        mark_time, mark_turn = self.autoplay_mark
+        if now - mark_time >= 0.5:
+            self.autoplay_rate = (self.total_turn - mark_turn) / (now - mark_time)
+            self.autoplay_mark = (now, self.total_turn)
+
+    # Sets up everything a game needs before its first turn: loads the save if self.load is True, otherwise starts a new game.
+    # Nothing here needs the game window, so a game can also be played without one by calling check_move and play_turn.
+    def setup_game(self):
+        # The timeline holds everything scheduled for a later turn, like enemy spawns.
+        self.timeline = Timeline()
+        # Floors of an earlier game can't be visited in this one.
+        self.floor_cache.clear()
         # If the game isn't loading from save, it starts the game with a blank slate.
         if self.load == True:
             self.load_game()
+            # Floors left before the save aren't in it; going down from here generates them again.
+            # The cache only needs arguments that generate the same layout every time.
+            self.floor_args = self.get_floor_args(self.floor, self.player_x, self.player_y)
+            self.schedule_floor_events()
+            self.pregenerate_next_floor()
         else:
-            self.array = np.zeros((8,8,6), dtype=np.int)
+            self.array = np.zeros((8,8,6), dtype=int)
             self.player_x = 0
             self.player_y = 0
             self.player_max_hp = 20
@@ -135,96 +412,198 @@ class Tile_strategy:
             self.potion_count = 0
             self.floor = 1
             self.total_turn = 0
+            self.seed = random.getrandbits(32)
             self.build_board()
             self.enemy_count = 0
             self.floor_turn = 0
-        # combat_message contains a string displayed on the bottom of the screen.
-        # It begins as None and changes when combat happens.
-        self.combat_message = None
+        # The combat log keeps the latest combat events. The message on the bottom of the screen is made from the last one.
+        self.combat_log = Combat_log()
+        # Telemetry, the replay recorder and the latency probe are started by run(), so games played without a window don't have them.
+        # telemetry_events and telemetry_floor mark where the last recorded turn left off.
+        self.telemetry = None
+        self.recorder = None
+        self.latency = None
+        self.telemetry_events = 0
+        self.telemetry_floor = self.floor
         # Once this bool is True, it's game over. 
         self.is_dead = False
+        # Autoplay starts out off. autoplay_mark is the time and turn the turns per second are measured from.
+        self.autoplaying = False
+        self.autoplay_rate = 0.0
+        self.autoplay_mark = (time.perf_counter(), self.total_turn)
         # arange creates an array of integers from 1-100.
         self.levels = np.arange(1, 101)
         # The for loop determines the player's EXP curve.
         for x in range(len(self.levels)):
             self.levels[x] += x * x * 2
-        # self.draw() draws the game onto the game window.
-        self.draw()
-        # direction starts out as None. It changes depending on which key is pressed.
-        direction = None
-        while True:
-            for event in pygame.event.get():
-                if event.type == QUIT:
-                    self.save_game()
-                    quit()
-                elif event.type == KEYDOWN:
-                    if event.key == K_ESCAPE:
-                        self.save_game()
-                        quit()
-                    elif event.key == K_UP:
-                        direction = up
-                    elif event.key == K_DOWN:
-                        direction = down
-                    elif event.key == K_LEFT:
-                        direction = left
-                    elif event.key == K_RIGHT:
-                        direction = right
-                    elif event.key == K_SPACE:
-                        self.play_turn()
-                    # Upon a successful player action, the rest of the turn is played out.
-                    if direction != None and self.check_move(direction) == True:
-                        self.draw()
-                        self.play_turn()
-                        direction = None
-                    # Ends the function when the player dies
-                    if self.is_dead == True: 
-                        return
-            pygame.display.update()
-            self.clock.tick(fps)
+        # delta_base holds the board and player values as of the last turn. Each turn's delta is measured against it.
+        self.delta_base = (self.array.copy(), self.get_scalars())
+        self.delta = None
+        # The turns that can be taken back. undo_delta is the delta that takes back the last turn played.
+        self.undo = Undo_buffer(undo_budget) if undo_budget > 0 else None
+        self.undo_delta = None
+        # The renderer calls self.draw() at most once per frame, whenever something asked for a repaint.
+        self.renderer = Render_scheduler(self.draw)
+        # motions collects the moves and attacks of each turn. The animator turns them into sliding sprites at a fixed timestep.
+        self.motions = []
+        self.animator = Animator(1 / fps, animation_time)
+        self.frame_timer = Frame_timer(1 / fps)
 
-    # This function saves the game state as an array, then saves that array as a binary file.
-    def save_game(self):
-        game_state = [self.array, self.player_x, self.player_y, self.player_max_hp, self.player_hp, 
-                      self.player_atk, self.player_exp, self.level, self.level_ups, self.potion_count,
-                      self.floor, self.total_turn, self.enemy_count, self.floor_turn]
-        with open('save.dat', 'wb') as f:
-            pickle.dump(game_state, f)
+    # Takes a snapshot of the game state as a list: the board first, then the values in state_scalars, then the seed.
+    # The board is copied so the game can keep playing while the snapshot is being written.
+    def get_game_state(self):
+        return [self.array.copy()] + self.get_scalars() + [self.seed]
 
-    # This function loads the save data file as an array, then deletes the save data.
+    # This function saves the game state as an array, then saves that array as a binary file, after the slot's header.
+    # The file is written by the autosaver's worker thread. wait makes it block until the save is on disk, for quitting.
+    def save_game(self, wait = False):
+        game_state = self.get_game_state()
+        self.autosaver.submit(game_state, self.save_header(game_state))
+        self.last_save_turn = self.total_turn
+        if wait:
+            self.autosaver.stop()
+
+    # This function loads the save data file as an array.
     # It then sets the game state values based on the array contents.
+    # The save is kept, since the autosaver keeps overwriting it; it's deleted when the player dies.
     def load_game(self):
-        with open('save.dat', 'rb') as f:
-            game_state = pickle.load(f)
-        os.remove('save.dat')
-        self.array         = game_state[0]
-        self.player_x      = game_state[1]
-        self.player_y      = game_state[2]
-        self.player_max_hp = game_state[3]
-        self.player_hp     = game_state[4]
-        self.player_atk    = game_state[5]
-        self.player_exp    = game_state[6]
-        self.level         = game_state[7]
-        self.level_ups     = game_state[8]
-        self.potion_count  = game_state[9]
-        self.floor         = game_state[10]
-        self.total_turn    = game_state[11]
-        self.enemy_count   = game_state[12]
-        self.floor_turn    = game_state[13]
-
-    # Creates a blank board.
-    # Called in new games and whenever the player steps on stairs.
+        self.set_game_state(save_slots.load_slot(self.save_path))
+
+    # Makes the header of a save slot from a game state: the floor, level and turn, and a thumbnail of the board
+    # with the items on the ground showing through empty tiles.
+    def save_header(self, game_state):
+        values = dict(zip(state_scalars, game_state[1:]))
+        array = game_state[0]
+        cells = np.where(array[:, :, tile] != grass, array[:, :, tile], array[:, :, ground])
+        return save_slots.pack_header(values['floor'], values['level'], values['total_turn'], cells)
+
+    # Games saved before there were save slots are in save.dat. It's moved into a slot of its own.
+    def import_old_save(self):
+        if os.path.exists('save.dat'):
+            with open('save.dat', 'rb') as f:
+                game_state = pickle.load(f)
+            save_slots.write_slot(save_slots.new_slot_path(save_dir), game_state, self.save_header(game_state))
+            os.remove('save.dat')
+
+    # Sets the board, the player values and the seed from a snapshot made by get_game_state.
+    def set_game_state(self, game_state):
+        self.array = game_state[0].copy()
+        for name, value in zip(state_scalars, game_state[1:]):
+            setattr(self, name, value)
+        # Saves from before floors had seeds get a new seed for the floors still to come.
+        if len(game_state) > len(state_scalars) + 1:
+            self.seed = game_state[len(state_scalars) + 1]
+        else:
+            self.seed = random.getrandbits(32)
+
+    # Takes a snapshot of everything a replay needs to carry on from this turn: the game state, the floors in the cache,
+    # and the state of the random numbers, which decide the enemy spawns.
+    # floors can be the floor_args and floor snapshot of an earlier keyframe on the same floor, which are reused:
+    # the cache only changes when the player changes floors, and snapshotting it takes time for every floor in it.
+    def get_keyframe(self, floors = None):
+        if floors is None:
+            floors = (self.floor_args, self.floor_cache.snapshot())
+        return [self.get_game_state(), floors[0], floors[1], random.getstate()]
+
+    # Puts the game in the state of a keyframe, as if it had been played up to that turn.
+    def restore_keyframe(self, keyframe):
+        game_state, self.floor_args, floors, random_state = keyframe
+        self.set_game_state(game_state)
+        self.floor_cache.restore(floors)
+        random.setstate(random_state)
+        self.is_dead = False
+        self.motions = []
+        self.timeline = Timeline()
+        self.schedule_floor_events()
+        self.pregenerate_next_floor()
+        self.delta_base = (self.array.copy(), self.get_scalars())
+        if self.undo is not None:
+            self.undo.clear()
+        self.renderer.request()
+
+    # Creates a blank board for floor number self.floor.
+    # Called in new games and whenever the player reaches a floor that isn't cached.
     def build_board(self):
+        # Nothing on the old floor is left to animate.
+        self.motions = []
         self.enemy_count = 0
         self.floor_turn = 0
-        self.array.fill(grass)
+        # Places the walls, stairs and potions. The layout comes from the seed and was usually generated while the last floor was played.
+        # The stairs are always reachable.
+        self.floor_args = self.get_floor_args(self.floor, self.player_x, self.player_y)
+        self.lay_out_floor(self.pregenerator.take(*self.floor_args), self.floor, self.array)
+        self.array[self.player_x][self.player_y][tile] = player
+        self.schedule_floor_events()
+        self.pregenerate_next_floor()
+
+    # The arguments generate_floor takes for a floor of this game.
+    def get_floor_args(self, floor, player_x, player_y):
+        return (self.seed, floor, player_x, player_y, board_width, board_height, wall_density, wall_passes)
+
+    # Writes a floor's layout onto a board array, without the player. Above the first floor,
+    # the player arrives on down-stairs.
+    def lay_out_floor(self, plan, floor, array):
+        array.fill(grass)
+        array[:, :, tile][plan.walls] = wall
+        stairs_x, stairs_y = plan.stairs
+        array[stairs_x][stairs_y][ground] = stairs
+        for potion_x, potion_y in plan.potions:
+            array[potion_x][potion_y][ground] = potion
+        if floor > 1:
+            array[plan.arrival[0]][plan.arrival[1]][ground] = down_stairs
+        return array
+
+    # Generates a floor again from the arguments it was first generated with. Used by the floor cache.
+    def floor_base(self, args):
+        return self.lay_out_floor(generate_floor(*args), args[1], np.zeros((board_width, board_height, 6), dtype=int))
+
+    # Starts generating the next floor in the background. The player will arrive there at this floor's stairs.
+    # Floors that were visited before come from the cache instead.
+    def pregenerate_next_floor(self):
+        if self.floor + 1 in self.floor_cache:
+            return
+        stairs_x, stairs_y = np.argwhere(self.array[:, :, ground] == stairs)[0]
+        self.pregenerator.request(*self.get_floor_args(self.floor + 1, int(stairs_x), int(stairs_y)))
+
+    # Takes the player to another floor. The floor being left is cached as it is, without the player.
+    # A floor visited before comes back the way the player left it, with the player on the stairs they took.
+    def change_floor(self, floor):
+        left_floor = self.array.copy()
+        left_floor[self.player_x][self.player_y][tile] = grass
+        self.floor_cache.store(self.floor, left_floor, [self.floor_turn, self.enemy_count], self.floor_args)
+        arrive_on = down_stairs if floor > self.floor else stairs
+        self.floor = floor
+        cached = self.floor_cache.take(floor)
+        if cached is None:
+            self.build_board()
+            return
+        array, (self.floor_turn, self.enemy_count), self.floor_args = cached
+        self.motions = []
+        self.array[:] = array
+        self.player_x, self.player_y = (int(i) for i in np.argwhere(self.array[:, :, ground] == arrive_on)[0])
+        # An enemy standing on the stairs is pushed off the floor to make room for the player.
+        if self.array[self.player_x][self.player_y][tile] != grass:
+            self.enemy_count -= 1
         self.array[self.player_x][self.player_y][tile] = player
-        stairs_x, stairs_y = self.check_tile()
-        self.array[stairs_x][stairs_y][ground] = stairs
-        # Randomly spawns potions on the ground. Higher floors are likely to have more potions.
-        num_potions = random.randint(0, (self.floor //2))
-        for i in range(num_potions):
-            potion_x, potion_y = self.check_tile()
-            self.array[potion_x][potion_y][ground] = potion
+        self.schedule_floor_events()
+        self.pregenerate_next_floor()
+
+    # Puts the current floor's events on the timeline, replacing those of the previous floor.
+    # The next spawn is lined up with floor_turn, so this also works for a floor loaded from a save.
+    def schedule_floor_events(self):
+        self.timeline.cancel('floor')
+        spawn_delay = -self.floor_turn % spawn_cooldown
+        self.timeline.schedule(self.total_turn + spawn_delay, self.spawn_enemy, tag = 'floor')
+
+    # Returns a bool array of the cells the player can see. Sight is symmetric, so these are also the cells that can see the player.
+    def visible_cells(self):
+        if not self.fog_of_war:
+            return self.all_visible
+        return line_of_sight.visible_cells(self.array[:, :, tile] == wall, self.player_x, self.player_y)
+
+    # Checks if any tile is left for an enemy to spawn on.
+    def has_free_tile(self):
+        return bool(((self.array[:, :, tile] == grass) & (self.array[:, :, ground] == grass)).any())
 
     # Checks if potential spawn tile is unoccupied.
     def check_tile(self): 
@@ -235,7 +614,7 @@ class Tile_strategy:
                 return x, y
 
     # Draws the screen onto the game window.
-    # Called whenever something on the screen changes, like movement.
+    # Called by self.renderer once per frame whenever something on the screen changed, like movement.
     def draw(self):
         #Defines variables to draw the board onto the screen.
         top_border = 8
@@ -249,26 +628,41 @@ class Tile_strategy:
         self.screen.fill(black)
         # Draws the grey borders onto the screen.
         pygame.draw.rect(self.screen, grey, (left_border, top_border, board_size, board_size))
-        # Fills the entire board with grass tiles.
+        # Fills the entire board with grass tiles. Cells the player can't see stay dark, and nothing in them is drawn.
+        visible = self.visible_cells()
         for x in range(board_width):
             for y in range(board_height):
                 current_box = (board_left + box_spread * x, board_top + box_spread * y)
-                self.screen.blit(self.images[grass], current_box)
-        # Draws each game object onto the screen, from the player to items to enemies.
+                if visible[x][y]:
+                    self.screen.blit(self.images[grass], current_box)
+                else:
+                    pygame.draw.rect(self.screen, black, (current_box[0], current_box[1], box_size, box_size))
+        # Draws the walls and the items on the ground first, so sprites sliding between cells are never covered by them.
         for x in range(board_width):
             for y in range(board_height):
-                board_tile = self.array[x][y][tile]
+                if not visible[x][y]:
+                    continue
                 current_box = (board_left + box_spread * x, board_top + box_spread * y)
+                if self.array[x][y][tile] == wall:
+                    pygame.draw.rect(self.screen, grey, (current_box[0], current_box[1], box_size, box_size))
                 if self.array[x][y][ground] == potion:
                     self.screen.blit(self.images[potion], current_box)
                 elif self.array[x][y][ground] == stairs:
                     self.screen.blit(self.images[stairs], current_box)
+                elif self.array[x][y][ground] == down_stairs:
+                    self.screen.blit(self.images[down_stairs], current_box)
+        # Draws the player and enemies, shifted by any animation they're in the middle of.
+        for x in range(board_width):
+            for y in range(board_height):
+                if not visible[x][y]:
+                    continue
+                board_tile = self.array[x][y][tile]
+                offset_x, offset_y = self.animator.offset((x, y))
+                current_box = (board_left + box_spread * (x + offset_x), board_top + box_spread * (y + offset_y))
                 if board_tile == player:
                     self.screen.blit(self.images[player], current_box)
-                elif board_tile == slime:
-                    self.screen.blit(self.images[slime], current_box)
-                elif board_tile == wolf:
-                    self.screen.blit(self.images[wolf], current_box)
+                elif board_tile in self.enemies:
+                    self.screen.blit(self.images[board_tile], current_box)
         # Draw the UI. I'm sure I could lower the amount of lines but hey, it works
         text_space = 32
         floor_text = self.font.render('Floor %d' % self.floor, True, white)
@@ -297,36 +691,53 @@ class Tile_strategy:
         # If the player doesn't have any potions, the potion count is not displayed.
         if self.potion_count > 0:
             self.screen.blit(potion_text, potion_text_rect)
-        bottom_text = self.font.render(self.combat_message, True, white)
+        if self.autoplaying:
+            autoplay_text = self.font.render('Autoplay', True, white)
+            autoplay_text_rect = autoplay_text.get_rect()
+            autoplay_text_rect.topleft = (board_size + board_left, top_border + text_space * 7)
+            self.screen.blit(autoplay_text, autoplay_text_rect)
+            rate_text = self.font.render('%d turns/s' % self.autoplay_rate, True, white)
+            rate_text_rect = rate_text.get_rect()
+            rate_text_rect.topleft = (board_size + board_left, top_border + text_space * 8)
+            self.screen.blit(rate_text, rate_text_rect)
+        bottom_text = self.font.render(self.combat_text(self.combat_log.last()), True, white)
         bottom_text_rect = bottom_text.get_rect()
         bottom_text_rect.topleft = (left_border, board_size + line_width + top_border)
         self.screen.blit(bottom_text, bottom_text_rect)
 
     # Checks if the player able to move to the input direction, then moves if possible.
-    # If the input direction is occupied with an enemy, the player attacks the enemy.
+    # If the input direction is occupied with an enemy, the player attacks the enemy. Walls can't be walked into.
     def check_move(self, direction): 
         if direction == up:
             if self.player_y > 0:
                 if self.array[self.player_x][self.player_y - 1][tile] in self.enemies:
                     return self.player_attack(direction)
+                elif self.array[self.player_x][self.player_y - 1][tile] == wall:
+                    return False
                 else:
                     return self.move_player(direction)
         elif direction == down:
             if self.player_y < board_height - 1:
                 if self.array[self.player_x][self.player_y + 1][tile] in self.enemies:
                     return self.player_attack(direction)
+                elif self.array[self.player_x][self.player_y + 1][tile] == wall:
+                    return False
                 else:
                     return self.move_player(direction)
         elif direction == right:
             if self.player_x < board_width - 1:
                 if self.array[self.player_x + 1][self.player_y][tile] in self.enemies:
                     return self.player_attack(direction)
+                elif self.array[self.player_x + 1][self.player_y][tile] == wall:
+                    return False
                 else:
                     return self.move_player(direction)
         elif direction == left:
             if self.player_x > 0:
                 if self.array[self.player_x - 1][self.player_y][tile] in self.enemies:
                     return self.player_attack(direction)
+                elif self.array[self.player_x - 1][self.player_y][tile] == wall:
+                    return False
                 else:
                     return self.move_player(direction)
         else:
@@ -334,6 +745,7 @@ class Tile_strategy:
 
     # Moves the player by editing the array.
     def move_player(self, direction):
+        start = (self.player_x, self.player_y)
         if direction == up:
             self.array[self.player_x][self.player_y][tile] = grass
             self.player_y -= 1
@@ -347,14 +759,16 @@ class Tile_strategy:
             self.array[self.player_x][self.player_y][tile] = grass
             self.player_x += 1
         self.array[self.player_x][self.player_y][tile] = player
+        self.motions.append(('move', start, (self.player_x, self.player_y)))
         # If the tile the player moved to has a potion, pick up the potion.
         if self.array[self.player_x][self.player_y][ground] == potion:
             self.potion_count += 1
             self.array[self.player_x][self.player_y][ground] = grass
-        # If the tile the player moved to is stairs, go up the stairs.
+        # If the tile the player moved to is stairs, go up the stairs. Down-stairs go back to the floor below.
         if self.array[self.player_x][self.player_y][ground] == stairs:
-            self.build_board()
-            self.floor += 1
+            self.change_floor(self.floor + 1)
+        elif self.array[self.player_x][self.player_y][ground] == down_stairs:
+            self.change_floor(self.floor - 1)
         return True
     
     # Attacks the enemy in the input direction.
@@ -362,43 +776,36 @@ class Tile_strategy:
         x = self.player_x
         y = self.player_y
         if direction == up:
-            # Reduced HP of enemy by the player's attack stat
-            self.array[x][y - 1][hp] -= self.player_atk
-            # Updates combat message, because combat is happening.
-            self.combat_message = ('The %s took %d damage. ' % (self.species_list[int(self.array[x][y - 1][tile])], self.player_atk))
-            # Checks to see if the enemy died. If it did, the player receives EXP.
-            if self.array[x][y - 1][hp] <= 0:
-                self.combat_message += ('The %s died. You gained %d exp.' % (self.species_list[int(self.array[x][y - 1][tile])], self.array[x][y - 1][exp]))
-                self.player_exp += self.array[x][y - 1][exp]
-                self.array[x][y - 1][tile] = grass
-                self.enemy_count -= 1
+            target_x, target_y = x, y - 1
         elif direction == down:
-            self.combat_message = ('The %s took %d damage. ' % (self.species_list[int(self.array[x][y + 1][tile])], self.player_atk))
-            self.array[x][y + 1][hp] -= self.player_atk
-            if self.array[x][y + 1][hp] <= 0:
-                self.combat_message += ('The %s died. You gained %d exp.' % (self.species_list[int(self.array[x][y + 1][tile])], self.array[x][y + 1][exp]))
-                self.player_exp += self.array[x][y + 1][exp]
-                self.array[x][y + 1][tile] = grass
-                self.enemy_count -= 1
+            target_x, target_y = x, y + 1
         elif direction == left:
-            self.array[x - 1][y][hp] -= self.player_atk
-            self.combat_message = ('The %s took %d damage. ' % (self.species_list[int(self.array[x - 1][y][tile])], self.player_atk))
-            if self.array[x - 1][y][hp] <= 0:
-                self.combat_message += ('The %s died. You gained %d exp.' % (self.species_list[int(self.array[x - 1][y][tile])], self.array[x - 1][y][exp]))
-                self.player_exp += self.array[x - 1][y][exp]
-                self.array[x - 1][y][tile] = grass
-                self.enemy_count -= 1
+            target_x, target_y = x - 1, y
         elif direction == right:
-            self.array[x + 1][y][hp] -= self.player_atk
-            self.combat_message = ('The %s took %d damage. ' % (self.species_list[int(self.array[x + 1][y][tile])], self.player_atk))
-            if self.array[x + 1][y][hp] <= 0:
-                self.combat_message += ('The %s died. You gained %d exp.' % (self.species_list[int(self.array[x + 1][y][tile])], self.array[x + 1][y][exp]))
-                self.player_exp += self.array[x + 1][y][exp]
-                self.array[x + 1][y][tile] = grass
-                self.enemy_count -= 1
+            target_x, target_y = x + 1, y
+        if self.use_kernels:
+            enemy_type, killed, gained_exp = kernels.resolve_attack(self.array, target_x, target_y, self.player_atk)
+            enemy_type = int(enemy_type)
+            gained_exp = int(gained_exp)
+        else:
+            enemy = self.array[target_x][target_y]
+            enemy_type = int(enemy[tile])
+            # Reduced HP of enemy by the player's attack stat
+            enemy[hp] -= self.player_atk
+            # Checks to see if the enemy died. If it did, the player receives EXP.
+            killed = enemy[hp] <= 0
+            gained_exp = 0
+            if killed:
+                gained_exp = int(enemy[exp])
+                enemy[tile] = grass
+        if killed:
+            self.player_exp += gained_exp
+            self.enemy_count -= 1
+        # Records the attack in the combat log, which is also where the combat message comes from.
+        self.combat_log.record(self.total_turn, hit, player, enemy_type, self.player_atk, killed, gained_exp)
+        self.motions.append(('attack', (x, y), (target_x, target_y)))
         # Checks to see if the player leveled up.
         self.level_update()
-        print(self.combat_message)
         return True
 
     # Checks to see if the player leveled up.
@@ -423,20 +830,134 @@ class Tile_strategy:
         if level_up == 1:
             self.player_hp = self.player_max_hp
 
-    # Each turn is as follows: Enemies move, enemies are spawned, and the board is drawn.
+    # Each turn is as follows: Enemies move, events due this turn (like spawns) happen, and the board is marked to be redrawn.
     def play_turn(self):
         self.move_enemies()
-        self.spawn_enemy()
+        self.timeline.run_due(self.total_turn)
         self.floor_turn += 1
         self.total_turn += 1
-        self.draw()
+        self.emit_delta()
+        if self.telemetry is not None:
+            self.record_telemetry()
+        self.renderer.request()
+
+    # Adds the turn to the telemetry. The combat events since the last turn give the damage taken, kills and potions used,
+    # including the player's own attack, which happens right before play_turn.
+    def record_telemetry(self):
+        events = self.combat_log.recent(self.combat_log.count - self.telemetry_events)
+        self.telemetry_events = self.combat_log.count
+        hits_taken = (events['kind'] == hit) & (events['target'] == player)
+        kills = (events['kind'] == hit) & (events['attacker'] == player) & events['kill']
+        killers = events['attacker'][hits_taken & events['kill']]
+        cause = int(killers[0]) if self.is_dead and len(killers) else 0
+        self.telemetry.record(self.total_turn, self.floor, self.player_x, self.player_y, self.player_hp,
+                              events['damage'][hits_taken].sum(), kills.sum(), (events['kind'] == potion_used).sum(),
+                              self.floor - self.telemetry_floor, bool(self.is_dead), cause, self.get_score())
+        self.telemetry_floor = self.floor
+
+    # Plays a turn with the player's action: a direction to move or attack in, or None to skip the turn.
+    # Returns False, without playing the turn, if the player can't move that way.
+    def act(self, direction):
+        floor = self.floor
+        # How far the combat log and the telemetry went before the turn, for undo to set them back to.
+        marks = (self.combat_log.count, 0 if self.telemetry is None else len(self.telemetry))
+        if direction is not None:
+            if not self.check_move(direction):
+                return False
+            self.renderer.request()
+        if self.latency is not None:
+            self.latency.moved()
+        self.play_turn()
+        if self.latency is not None:
+            self.latency.played()
+        if self.undo is not None:
+            if self.floor == floor:
+                self.undo.record(self.undo_delta, self.delta, direction, marks, self.combat_log.count)
+            else:
+                self.undo.clear()
+        if self.recorder is not None:
+            self.recorder.record(direction)
+        return True
+
+    # Takes back the last turn in the undo history. Returns False if there's none.
+    # The enemies that spawn from here on may not be the ones that spawned the first time.
+    # The turn's combat events and telemetry row are taken back with it.
+    def undo_turn(self):
+        scalars = self.get_scalars()
+        delta, marks = self.undo.undo(self.array, scalars)
+        if delta is None:
+            return False
+        events, rows = marks
+        self.rewind(delta, scalars)
+        self.combat_log.rewind(events)
+        if self.telemetry is not None:
+            self.telemetry.rewind(rows)
+            self.telemetry_events = events
+        if self.recorder is not None:
+            self.recorder.undone()
+        return True
+
+    # Plays the last turn taken back again, just as it went the first time. Returns False if there's none.
+    def redo_turn(self):
+        scalars = self.get_scalars()
+        delta, action, events = self.undo.redo(self.array, scalars)
+        if delta is None:
+            return False
+        self.rewind(delta, scalars)
+        self.combat_log.rewind(events)
+        if self.telemetry is not None:
+            self.record_telemetry()
+        if self.recorder is not None:
+            self.recorder.redone(action)
+        return True
+
+    # Brings the rest of the game in line with a board and player values an undo or redo delta was applied to.
+    # Everything but the timeline takes time proportional to the cells the delta changed.
+    def rewind(self, delta, scalars):
+        for name, value in zip(state_scalars, scalars):
+            setattr(self, name, value)
+        old_array, old_scalars = self.delta_base
+        delta.apply(old_array, old_scalars)
+        self.delta = delta
+        self.motions = []
+        self.schedule_floor_events()
+        self.renderer.request()
+
+    def save_replay(self):
+        if self.recorder is not None:
+            self.recorder.save()
+
+    def close_telemetry(self):
+        if self.telemetry is not None:
+            self.telemetry.close()
+
+    # Returns the player values listed in state_scalars, in order.
+    def get_scalars(self):
+        return [int(getattr(self, name)) for name in state_scalars]
+
+    # Builds self.delta: the board cells and player values that changed since the previous turn.
+    # This includes the player's own move, since that happens right before play_turn.
+    def emit_delta(self):
+        old_array, old_scalars = self.delta_base
+        scalars = self.get_scalars()
+        self.delta = board_delta.encode(self.total_turn, old_array, self.array, old_scalars, scalars)
+        if verify_deltas:
+            board_delta.verify(self.delta, old_array, self.array, old_scalars, scalars)
+        if self.undo is not None:
+            self.undo_delta = board_delta.reverse(self.delta, old_array, old_scalars)
+        # Reuses the old buffer instead of copying the whole board every turn.
+        old_array[...] = self.array
+        self.delta_base = (old_array, scalars)
 
     # AI for the enemies. They will follow the player and attack if the player is adjacent.
     def move_enemies(self):
+        if self.use_kernels:
+            return self.move_enemies_compiled()
         # Sets the "moved" flag for all enemies to 0.
         for i in range(board_width):
             for j in range(board_height):
                 self.array[i][j][moved] = 0
+        sees_player = self.visible_cells()
         # Goes through entire board looking for enemies
         for x in range(board_width):
             for y in range(board_height):
@@ -448,24 +969,50 @@ class Tile_strategy:
                                          (x > 0 and self.array[x - 1][y][tile] == player) or \
                                          (x < board_width - 1 and self.array[x + 1][y][tile] == player)
                     if  player_is_adjacent: # Attack
+                        self.motions.append(('attack', (x, y), (self.player_x, self.player_y)))
                         self.player_hp -= self.array[x][y][atk]
-                        self.combat_message = ('You took %d damage. ' % self.array[x][y][atk])
-                        print(self.combat_message)
+                        # The attack is marked as a kill if the player has no potion left to survive it.
+                        killed = self.player_hp <= 0 and self.potion_count == 0
+                        self.combat_log.record(self.total_turn, hit, self.array[x][y][tile], player, self.array[x][y][atk], killed)
                         # Checks to see if the player died from the enemy's attack
                         self.is_dead = self.death_check()
+                    # An enemy that can't see the player stays where it is.
+                    elif not sees_player[x][y]:
+                        continue
                     # If the player isn't adjacent, the enemy moves towards the player.
                     elif self.player_y < y and self.array[x][y - 1][tile] == grass: # Move up
                         self.array[x][y - 1][0:5] = self.array[x][y][0:5]
                         self.array[x][y][tile] = grass
+                        self.motions.append(('move', (x, y), (x, y - 1)))
                     elif self.player_y > y and self.array[x][y + 1][tile] == grass: # Move down
                         self.array[x][y + 1][0:5] = self.array[x][y][0:5]
                         self.array[x][y][tile] = grass
+                        self.motions.append(('move', (x, y), (x, y + 1)))
                     elif self.player_x < x and self.array[x - 1][y][tile] == grass: # Move left
                         self.array[x - 1][y][0:5] = self.array[x][y][0:5]
                         self.array[x][y][tile] = grass
+                        self.motions.append(('move', (x, y), (x - 1, y)))
                     elif self.player_x > x and self.array[x + 1][y][tile] == grass: # Move right
                         self.array[x + 1][y][0:5] = self.array[x][y][0:5]
                         self.array[x][y][tile] = grass
+                        self.motions.append(('move', (x, y), (x + 1, y)))
+
+    # Same as move_enemies, with the board scan done by the compiled kernel.
+    # The kernel fills in the combat events and motions, which are then added to the combat log and self.motions in order.
+    def move_enemies_compiled(self):
+        self.player_hp, self.potion_count, dead, event_count, motion_count = kernels.enemy_turn(
+            self.array, self.is_enemy, self.visible_cells(), self.player_x, self.player_y, self.player_hp, self.player_max_hp,
+            self.potion_count, self.kernel_events, self.kernel_motions)
+        for kind, attacker, damage, value in self.kernel_events[:event_count].tolist():
+            if kind == hit:
+                self.combat_log.record(self.total_turn, hit, attacker, player, damage, bool(value))
+            else:
+                self.combat_log.record(self.total_turn, potion_used, player, player, potions = value)
+        for kind, x, y, to_x, to_y in self.kernel_motions[:motion_count].tolist():
+            self.motions.append(('attack' if kind == kernels.attack_motion else 'move', (x, y), (to_x, to_y)))
+        # Like move_enemies, the death flag only changes when an enemy attacked.
+        if event_count:
+            self.is_dead = dead
 
     # Checks to see if the player died. 
     def death_check(self):
@@ -474,20 +1021,40 @@ class Tile_strategy:
             if self.potion_count > 0:
                 self.player_hp = self.player_max_hp
                 self.potion_count -= 1
-                self.combat_message = ('You used a potion. Potions left: %d' % self.potion_count)
-                print(self.combat_message)
+                self.combat_log.record(self.total_turn, potion_used, player, player, potions = self.potion_count)
                 return False
             # If the player's out of potions, set the death bool to True.
+            # The attack that killed the player was already logged as a kill.
             else:
-                self.combat_message = ('You died.')
-                print(self.combat_message)
                 return True
 
+    # Builds the combat message shown at the bottom of the screen from a combat event.
+    def combat_text(self, event):
+        if event is None:
+            return None
+        if event['kind'] == potion_used:
+            return 'You used a potion. Potions left: %d' % event['potions']
+        if event['attacker'] == player:
+            name = self.species.name(event['target'])
+            text = 'The %s took %d damage. ' % (name, event['damage'])
+            if event['kill']:
+                text += 'The %s died. You gained %d exp.' % (name, event['exp'])
+        else:
+            text = 'You took %d damage. ' % event['damage']
+            if event['kill']:
+                text += 'You died.'
+        return text
+
+    # Combat log sink that prints a batch of combat events to the console in one go.
+    def print_combat_events(self, events):
+        print('\n'.join(self.combat_text(event) for event in events))
+
     # Every 8 turns, an enemy is spawned in a random location.
+    # Runs from the timeline, and puts the next spawn on the timeline.
     def spawn_enemy(self):
-        spawn_cooldown = 8
-        max_enemies = 8
-        if self.floor_turn % spawn_cooldown == 0 and self.enemy_count < max_enemies:
+        self.timeline.schedule(self.total_turn + spawn_cooldown, self.spawn_enemy, tag = 'floor')
+        # Walls can leave a floor with no room for another enemy, and check_tile would never find a cell.
+        if self.enemy_count < max_enemies and self.has_free_tile():
             enemy_type = self.enemies[random.randint(0, len(self.enemies) - 1)]
             enemy = self.get_stats(enemy_type)
             x = enemy[6]
@@ -497,24 +1064,31 @@ class Tile_strategy:
             self.enemy_count += 1
 
     # Sets the newly spawned enemy's stats based on the game length and the floor the player has reached.
+    # The stat formulas live in the species table.
     def get_stats(self, enemy_type):
-        if enemy_type == slime:
-            enemy_hp = 15 + self.total_turn // 5 + self.floor
-            enemy_atk = 4 + self.total_turn // 5 + self.floor
-        elif enemy_type == wolf:
-            enemy_hp = 8 + self.total_turn // 5 + self.floor
-            enemy_atk = 8 + self.total_turn // 5 + self.floor
-        enemy_exp = (enemy_hp + enemy_atk) // 2
+        enemy_hp, enemy_atk, enemy_exp = self.species.stats(enemy_type, self.total_turn, self.floor)
         x, y = self.check_tile()
-        return enemy_type, enemy_hp, enemy_atk, enemy_exp, 0, 0, x, y
+        return enemy_type, int(enemy_hp), int(enemy_atk), int(enemy_exp), 0, 0, x, y
+
+    # The score: 5 points per turn survived, the player's EXP, and 10 points per floor reached.
+    def get_score(self):
+        return self.total_turn * 5 + self.player_exp + self.floor * 10
+
+    # Prints the latency histograms, if latency is measured. Done at game over, and on quitting, so no measurements are lost.
+    def print_latency(self):
+        if self.latency is not None:
+            print(self.latency.report())
 
     # Game Over screen. Shows the player's score and prompts them to enter their name for the Score Board.
     def game_over(self):
         print('Game over.')
+        print('Frames drawn: %d. Redundant draws skipped: %d.' % (self.renderer.draws, self.renderer.saved))
+        print(self.frame_timer.report())
+        self.print_latency()
         game_over_text = self.big_font.render('GAME OVER', True, red)
         game_over_text_rect = game_over_text.get_rect()
         game_over_text_rect.center = (window_width/2, window_height/2 - 48)
-        self.score = self.total_turn * 5 + self.player_exp + self.floor * 10
+        self.score = self.get_score()
         score_text = self.font.render('Score: %d' % self.score, True, white)
         score_text_rect = score_text.get_rect()
         score_text_rect.center = (window_width/2, window_height/2)
@@ -523,7 +1097,7 @@ class Tile_strategy:
         name_prompt_text_rect.center = (window_width/2 - 50, window_height/2 + 32)
         self.name = ''
         while True:
-            for event in pygame.event.get():
+            for event in self.get_events():
                 if event.type == QUIT:
                     self.quit()
                 elif event.type == KEYDOWN:
@@ -532,6 +1106,7 @@ class Tile_strategy:
                     elif event.key == K_BACKSPACE:
                         self.name = self.name[:-1]
                     elif event.key == K_RETURN:
+                        self.submit_score()
                         return
                     elif event.key == K_ESCAPE:
                         self.quit()
@@ -546,19 +1121,32 @@ class Tile_strategy:
             pygame.display.update()
             self.clock.tick(fps)
 
-    # Loads up the list of scores, then saves the new score to it and shows the top 10
+    # Sends the score to the shared leaderboard on a worker thread, so a slow or missing service never holds up the game.
+    # The reply, the score's rank on the leaderboard, shows up on the score board once it arrives.
+    def submit_score(self):
+        self.leaderboard_reply = None
+        if leaderboard_url is None:
+            return
+        def send():
+            try:
+                self.leaderboard_reply = leaderboard.submit_score(leaderboard_url, self.name, self.score)
+            except (OSError, ValueError) as error:
+                print('Could not send the score to the leaderboard: %s' % error)
+        threading.Thread(target = send, name = 'leaderboard', daemon = True).start()
+
+    # Loads up the list of scores, then saves the new score to it and shows the top 10.
+    # Returns when the player presses Space to restart.
     def score_board(self):
-        if os.path.exists('high scores.dat'):
-            with open('high scores.dat', 'rb') as f:
+        if os.path.exists(high_scores_path):
+            with open(high_scores_path, 'rb') as f:
                 score_board = pickle.load(f)
         else:
             score_board = [('99', 'default')]
         score_board.append((str(self.score), self.name))
         score_board.sort(key = lambda score: int(score[0]), reverse = True)
-        print (score_board)
         while len(score_board) > 10:
            del score_board[-1]
-        with open('high scores.dat', 'wb') as f:
+        with open(high_scores_path, 'wb') as f:
             pickle.dump(score_board, f)
         font_spacing = 8
         top_border = 24
@@ -578,15 +1166,23 @@ class Tile_strategy:
         restart_text_rect = restart_text.get_rect()
         restart_text_rect.center = (window_width / 2, window_height - 32)
         self.screen.blit(restart_text, restart_text_rect)
+        rank_shown = False
         while True:
-            for event in pygame.event.get():
+            for event in self.get_events():
                 if event.type == QUIT:
                     self.quit()
                 if event.type == KEYDOWN:
                     if event.key == K_ESCAPE:
                         self.quit()
                     elif event.key == K_SPACE:
-                        self.main()
+                        return
+            reply = self.leaderboard_reply
+            if reply is not None and not rank_shown:
+                rank_text = self.font.render('Leaderboard rank: %d of %d' % (reply['rank'], reply['total']), True, white)
+                rank_text_rect = rank_text.get_rect()
+                rank_text_rect.center = (window_width / 2, window_height - 72)
+                self.screen.blit(rank_text, rank_text_rect)
+                rank_shown = True
             pygame.display.update()
             self.clock.tick(fps)
 
@@ -0,0 +1,55 @@
+# Timeline of scheduled events for Tile Strategy.
+# Anything that should happen on a later turn (spawns, regeneration, delayed effects, floor events) is put on the timeline
+# instead of being checked every turn. Each turn only looks at the events that are due, so the cost of a turn
+# depends on how many events fire, not on how many kinds of events exist.
+import heapq
+import itertools
+
+
+class Event:
+    def __init__(self, turn, order, action, args, tag):
+        self.turn = turn
+        self.order = order
+        self.action = action
+        self.args = args
+        self.tag = tag
+
+    # Events due on the same turn fire in the order they were scheduled.
+    def __lt__(self, other):
+        return (self.turn, self.order) < (other.turn, other.order)
+
+
+class Timeline:
+    def __init__(self):
+        self.queue = []
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.queue)
+
+    # Schedules action(*args) to run on the given turn. tag groups events so they can be cancelled together.
+    def schedule(self, turn, action, *args, tag = None):
+        event = Event(turn, next(self.counter), action, args, tag)
+        heapq.heappush(self.queue, event)
+        return event
+
+    # Removes every event with the given tag, like the events of a floor the player just left.
+    def cancel(self, tag):
+        self.queue = [event for event in self.queue if event.tag != tag]
+        heapq.heapify(self.queue)
+
+    # Returns the turn of the next event, or None if nothing is scheduled.
+    def next_turn(self):
+        if self.queue:
+            return self.queue[0].turn
+        return None
+
+    # Runs every event due on or before turn, including ones scheduled for this turn by the events themselves.
+    # Returns how many events ran.
+    def run_due(self, turn):
+        count = 0
+        while self.queue and self.queue[0].turn <= turn:
+            event = heapq.heappop(self.queue)
+            event.action(*event.args)
+            count += 1
+        return count
@@ -0,0 +1,228 @@
+# Undo for Tile Strategy.
+# Every turn played is kept as a pair of board deltas (see board_delta.py): a reverse one that takes the board and the player
+# values back to before the turn, and a forward one that puts them back to after it. Both hold only the cells that changed,
+# so undoing or redoing a turn costs as much as the turn changed, and a turn takes tens of bytes instead of a copy of the board.
+# Turns are kept in a ring buffer, up to a budget in bytes. Past the budget, the oldest turns are dropped.
+# Playing a turn after undoing drops the turns that could have been redone.
+# Along with the deltas, a turn keeps whatever the game needs to set the rest of its history back, like how long its combat log was.
+# Run this file to check undoing and redoing against copies of the game, and to time them.
+import os
+import sys
+import time
+import numpy as np
+import board_delta
+
+
+class Undo_buffer:
+    # budget is how many bytes of deltas are kept.
+    def __init__(self, budget = 1 << 16):
+        self.budget = budget
+        # The ring starts with a few slots and doubles when it's full but under the budget.
+        self.slots = [None] * 64
+        # first is the slot of the oldest turn kept. Of the count turns kept, the first position are played
+        # and can be undone; the rest were undone and can be redone.
+        self.first = 0
+        self.count = 0
+        self.position = 0
+        self.size = 0
+
+    def slot(self, i):
+        return (self.first + i) % len(self.slots)
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < self.count
+
+    def clear(self):
+        self.slots = [None] * 64
+        self.first = 0
+        self.count = 0
+        self.position = 0
+        self.size = 0
+
+    # Keeps a turn that was just played, by its reverse and forward deltas (see board_delta.reverse).
+    # action is the player's action that turn, kept so the turn can be recorded again when it's redone.
+    # before and after are the game's own marks from before and after the turn, handed back by undo and redo.
+    def record(self, reverse, forward, action = None, before = None, after = None):
+        entry = (reverse.to_bytes(), forward.to_bytes(), action, before, after)
+        # The turns that could have been redone are gone now.
+        while self.count > self.position:
+            self.drop(self.count - 1)
+        while self.count and self.size + len(entry[0]) + len(entry[1]) > self.budget:
+            self.drop(0)
+            self.first = self.slot(1)
+            self.position -= 1
+        if self.count == len(self.slots):
+            self.slots = [self.slots[self.slot(i)] for i in range(self.count)] + [None] * self.count
+            self.first = 0
+        self.slots[self.slot(self.count)] = entry
+        self.count += 1
+        self.position += 1
+        self.size += len(entry[0]) + len(entry[1])
+
+    def drop(self, i):
+        entry = self.slots[self.slot(i)]
+        self.slots[self.slot(i)] = None
+        self.size -= len(entry[0]) + len(entry[1])
+        self.count -= 1
+
+    # Takes back the last turn played, writing it onto a board array and a list of player values, in place.
+    # Returns the delta that was applied and the marks from before the turn, or (None, None) if there's no turn to undo.
+    def undo(self, array, scalars):
+        if not self.can_undo():
+            return None, None
+        self.position -= 1
+        reverse, forward, action, before, after = self.slots[self.slot(self.position)]
+        delta = board_delta.Board_delta.from_bytes(reverse)
+        delta.apply(array, scalars)
+        return delta, before
+
+    # Plays the last turn undone again. Returns the delta that was applied, the action of the turn and the marks from
+    # after it, or (None, None, None) if there's no turn to redo.
+    def redo(self, array, scalars):
+        if not self.can_redo():
+            return None, None, None
+        reverse, forward, action, before, after = self.slots[self.slot(self.position)]
+        self.position += 1
+        delta = board_delta.Board_delta.from_bytes(forward)
+        delta.apply(array, scalars)
+        return delta, action, after
+
+
+# The parts of a game undo has to set back: the board, the player values, the last combat event and the telemetry rows.
+def game_state(game):
+    event = game.combat_log.last()
+    return game.array.copy(), game.get_scalars(), None if event is None else event.item(), len(game.telemetry)
+
+
+# Plays games with random actions, keeping a copy of the state after every turn, and now and then undoes some turns,
+# redoes some of them and plays on, checking the game against the copies every step of the way.
+# The history starts over on every floor, like the game's. The telemetry is written in small chunks, so undo reads some back,
+# and at the end of a game it has to hold one row for every turn left in the history.
+# Returns how many undos and redos were checked.
+def verify(games = 20, turns = 300, seed = 0):
+    import random
+    import tempfile
+    from telemetry import Telemetry
+    from tile_strategy import Tile_strategy
+    rng = random.Random(seed)
+    random.seed(seed)
+    game = Tile_strategy()
+    game.load = False
+    checked = 0
+    with tempfile.TemporaryDirectory(prefix = 'undo-') as folder:
+        for i in range(games):
+            game.setup_game()
+            game.telemetry = Telemetry(folder, i, chunk = 16)
+            # states[t] is the state after t turns of this floor's history.
+            states = [game_state(game)]
+            while not game.is_dead and game.total_turn < turns:
+                floor = game.floor
+                if game.act(rng.choice([None, 'up', 'down', 'left', 'right'])):
+                    states.append(game_state(game))
+                    if game.floor != floor:
+                        states = states[-1:]
+                if rng.random() < 0.1 and game.undo.can_undo():
+                    steps = rng.randint(1, 20)
+                    undone = 0
+                    while undone < steps and game.undo_turn():
+                        undone += 1
+                        array, scalars, event, rows = states[len(states) - 1 - undone]
+                        assert np.array_equal(game.array, array) and game.get_scalars() == scalars, 'Undo lost a turn'
+                        assert game_state(game)[2:] == (event, rows), 'Undo left the combat log or telemetry behind'
+                        checked += 1
+                    redone = rng.randint(0, undone)
+                    for j in range(redone):
+                        assert game.redo_turn(), 'Redo lost a turn'
+                        array, scalars, event, rows = states[len(states) - 1 - undone + j + 1]
+                        assert np.array_equal(game.array, array) and game.get_scalars() == scalars, 'Redo lost a turn'
+                        assert game_state(game)[2:] == (event, rows), 'Redo left the combat log or telemetry behind'
+                        checked += 1
+                    states = states[:len(states) - undone + redone]
+                game.motions = []
+            game.telemetry.close()
+            rows = []
+            for chunk in range(game.telemetry.chunks):
+                with np.load(game.telemetry.chunk_path(chunk)) as data:
+                    rows.extend(data['turn'].tolist())
+            assert rows == list(range(1, game.total_turn + 1)), 'The telemetry kept turns that were undone'
+    return checked
+
+
+# Plays games with random actions, then undoes every turn kept and redoes them all.
+# Returns how many turns that was, the seconds an undo and a redo took on average, and the bytes a turn took.
+def benchmark(games = 20, turns = 2000, seed = 0):
+    import random
+    from tile_strategy import Tile_strategy
+    rng = random.Random(seed)
+    random.seed(seed)
+    game = Tile_strategy()
+    game.load = False
+    played = 0
+    size = 0
+    times = [0.0, 0.0]
+    for i in range(games):
+        game.setup_game()
+        game.undo = Undo_buffer(1 << 30)
+        while not game.is_dead and game.total_turn < turns:
+            game.act(rng.choice([None, 'up', 'down', 'left', 'right']))
+            game.motions = []
+        played += game.undo.count
+        size += game.undo.size
+        for j, step in enumerate((game.undo_turn, game.redo_turn)):
+            start = time.perf_counter()
+            while step():
+                pass
+            times[j] += time.perf_counter() - start
+    return played, times[0] / played, times[1] / played, size / played
+
+
+# Lets autoplay (see autoplay.py) take a game down until floors floors are in its cache, then records it with a replay
+# recorder, plays random turns and times undoing and redoing them all, like benchmark. Every undo and redo keyframes the
+# replay, which has to take time for the board, not for the floors in the cache.
+# Returns how many turns that was, how many floors were cached, and the seconds an undo and a redo took on average.
+def benchmark_recorder(floors = 24, turns = 500, potions = 1000, seed = 0):
+    import random
+    import tempfile
+    import autoplay
+    from replay import Replay_recorder
+    from tile_strategy import Tile_strategy
+    rng = random.Random(seed)
+    random.seed(seed)
+    game = Tile_strategy()
+    game.load = False
+    game.setup_game()
+    game.potion_count = potions
+    while len(game.floor_cache) < floors:
+        game.act(autoplay.choose_action(game))
+        game.motions = []
+    with tempfile.TemporaryDirectory(prefix = 'undo-') as folder:
+        game.recorder = Replay_recorder(game, os.path.join(folder, 'replay.dat'))
+        game.undo.clear()
+        end = game.total_turn + turns
+        while not game.is_dead and game.total_turn < end:
+            game.act(rng.choice([None, 'up', 'down', 'left', 'right']))
+            game.motions = []
+        played = game.undo.count
+        times = []
+        for step in (game.undo_turn, game.redo_turn):
+            start = time.perf_counter()
+            while step():
+                pass
+            times.append((time.perf_counter() - start) / played)
+    return played, len(game.floor_cache), times[0], times[1]
+
+
+if __name__ == '__main__':
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print('Checked %d undone and redone turns against copies of the game.' % verify(games))
+    played, undo_time, redo_time, size = benchmark()
+    print('Over %d turns: %.1f us to undo a turn, %.1f us to redo one, %.0f bytes kept per turn.' % (
+        played, undo_time * 1e6, redo_time * 1e6, size))
+    played, floors, undo_time, redo_time = benchmark_recorder()
+    print('Recording a replay, with %d floors cached, over %d turns: %.1f us to undo a turn, %.1f us to redo one.' % (
+        floors, played, undo_time * 1e6, redo_time * 1e6))
+    # Snapshotting the floor cache on every rewind takes milliseconds with this many floors.
+    assert undo_time + redo_time < 1e-3, 'Undo and redo take time for every cached floor'
@@ -0,0 +1,277 @@
+# Zobrist hashing and a transposition table for Tile Strategy.
+# A game state hashes to a 64-bit key: the XOR of one random-looking key per feature of the state.
+# The features are every enemy (type, hp, atk and exp in its cell), every wall, every potion and stairs on the ground, and the player values.
+# Floors the player left aren't part of the key.
+# Changing one feature only needs two XORs, so the key follows each move, attack and spawn in constant time.
+# Keys come from a hash function instead of a table, since enemy stats have no upper bound.
+# Run this file to check the incremental keys against full recomputes and to try the table on a small look-ahead search.
+import random
+import sys
+import numpy as np
+from bitboard import Bitboard_game
+from tile_strategy import (Tile_strategy, up, down, left, right, grass, player,
+                           potion, stairs, wall, down_stairs, tile, hp, atk, exp, ground, state_scalars)
+
+mask = (1 << 64) - 1
+seed = 0x2545F4914F6CDD1D
+# Feature numbers of the player values come after those of the board cells.
+scalar_features = 1 << 20
+
+
+# SplitMix64: spreads any 64-bit number over all 64 bits.
+def splitmix64(x):
+    x = (x + 0x9E3779B97F4A7C15) & mask
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & mask
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & mask
+    return x ^ (x >> 31)
+
+
+# The key of one feature of the state having a value. Cell features are numbered cell * 8 + layer.
+def key(feature, value):
+    return splitmix64(seed ^ (feature << 32) ^ (value & 0xFFFFFFFF))
+
+
+# Same as key, on NumPy arrays. uint64 arithmetic wraps around on its own.
+def keys(features, values):
+    with np.errstate(over = 'ignore'):
+        x = np.uint64(seed) ^ (features.astype(np.uint64) << np.uint64(32)) ^ (values.astype(np.int64).astype(np.uint64) & np.uint64(0xFFFFFFFF))
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+# The part of the key that comes from an enemy standing in cell i.
+def enemy_key(i, enemy_type, enemy_hp, enemy_atk, enemy_exp):
+    return key(i * 8 + tile, enemy_type) ^ key(i * 8 + hp, enemy_hp) ^ key(i * 8 + atk, enemy_atk) ^ key(i * 8 + exp, enemy_exp)
+
+
+# The part of the key that comes from the player values, given in the order of state_scalars.
+def scalars_hash(scalars):
+    h = 0
+    for i, value in enumerate(scalars):
+        h ^= key(scalar_features + i, int(value))
+    return h
+
+
+# The part of the key that comes from a Tile_strategy board array, computed from scratch.
+# Only meaningful layers count: the stats of empty cells and the moved flags are leftovers and are ignored.
+def array_hash(array, cells = None):
+    flat = array.reshape(-1, array.shape[-1])
+    if cells is None:
+        cells = np.arange(len(flat))
+    flat = flat[cells]
+    walls = flat[:, tile] == wall
+    enemies = (flat[:, tile] > player) & ~walls
+    items = flat[:, ground] != grass
+    parts = [keys(cells[enemies] * 8 + layer, flat[enemies, layer]) for layer in (tile, hp, atk, exp)]
+    parts.append(keys(cells[walls] * 8 + tile, flat[walls, tile]))
+    parts.append(keys(cells[items] * 8 + ground, flat[items, ground]))
+    h = np.uint64(0)
+    for part in parts:
+        h ^= np.bitwise_xor.reduce(part, initial = np.uint64(0))
+    return int(h)
+
+
+# The key of a Tile_strategy game.
+def game_hash(game):
+    return array_hash(game.array) ^ scalars_hash(game.get_scalars())
+
+
+# Updates the board part of a key with a turn's board delta (see board_delta.py), in time proportional to the cells that changed.
+# old_array is the board before the turn.
+def update_with_delta(board_hash, old_array, delta):
+    new_cells = old_array.reshape(-1, old_array.shape[-1]).copy()
+    new_cells[delta.cells] = delta.values
+    return board_hash ^ array_hash(old_array, delta.cells) ^ array_hash(new_cells, delta.cells)
+
+
+# A bitboard game that keeps the board part of its key up to date as it plays.
+class Hashed_bitboard_game(Bitboard_game):
+    def __init__(self, species, rng = random):
+        Bitboard_game.__init__(self, species, rng)
+        self.board_hash = 0
+
+    # Returns the key of the whole game state.
+    def hash(self):
+        return self.board_hash ^ scalars_hash([getattr(self, name) for name in state_scalars])
+
+    # Computes the board part of the key from scratch.
+    def full_board_hash(self):
+        h = 0
+        for i in range(64):
+            if self.enemy_bits >> i & 1:
+                h ^= self.cell_key(i)
+            elif self.wall_bits >> i & 1:
+                h ^= key(i * 8 + tile, wall)
+            if self.potion_bits >> i & 1:
+                h ^= key(i * 8 + ground, potion)
+            elif self.stairs_bits >> i & 1:
+                h ^= key(i * 8 + ground, stairs)
+            elif self.down_bits >> i & 1:
+                h ^= key(i * 8 + ground, down_stairs)
+        return h
+
+    def cell_key(self, i):
+        return enemy_key(i, self.enemy_type[i], self.enemy_hp[i], self.enemy_atk[i], self.enemy_exp[i])
+
+    # A new floor changes most of the board, so its key is computed from scratch. Walls only change with the floor.
+    def build_board(self):
+        Bitboard_game.build_board(self)
+        self.board_hash = self.full_board_hash()
+
+    # A floor that comes back from the cache gets its key computed from scratch, like a new one.
+    def change_floor(self, floor):
+        Bitboard_game.change_floor(self, floor)
+        self.board_hash = self.full_board_hash()
+
+    def set_enemy(self, i, enemy_type, enemy_hp, enemy_atk, enemy_exp):
+        if self.enemy_bits >> i & 1:
+            self.board_hash ^= self.cell_key(i)
+        Bitboard_game.set_enemy(self, i, enemy_type, enemy_hp, enemy_atk, enemy_exp)
+        self.board_hash ^= self.cell_key(i)
+
+    def move_enemy(self, i, j):
+        self.board_hash ^= self.cell_key(i)
+        Bitboard_game.move_enemy(self, i, j)
+        self.board_hash ^= self.cell_key(j)
+
+    # The enemy's old key comes out first. If it survived, it goes back in with its new hp.
+    def player_attack(self, target):
+        self.board_hash ^= self.cell_key(target)
+        Bitboard_game.player_attack(self, target)
+        if self.enemy_bits >> target & 1:
+            self.board_hash ^= self.cell_key(target)
+
+    def move_player(self, target):
+        floor = self.floor
+        had_potion = self.potion_bits >> target & 1
+        Bitboard_game.move_player(self, target)
+        if had_potion and self.floor == floor:
+            self.board_hash ^= key(target * 8 + ground, potion)
+
+
+# A fixed-size table of search results, keyed by Zobrist key.
+# Each slot is a bucket of two entries. The first keeps the deepest result, unless it's from an older search;
+# the second always takes the newest result. So deep results survive while fresh ones still get stored.
+class Transposition_table:
+    # size is the number of buckets and is rounded up to a power of two.
+    def __init__(self, size = 1 << 16):
+        self.size = 1 << max(0, (size - 1).bit_length())
+        self.mask = self.size - 1
+        self.keys = [None] * (2 * self.size)
+        self.depths = [0] * (2 * self.size)
+        self.values = [None] * (2 * self.size)
+        self.ages = [0] * (2 * self.size)
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    # Starts a new search. Results from older searches get replaced first.
+    def new_search(self):
+        self.age += 1
+
+    # Returns the value stored for a key with at least the given depth, or None.
+    def probe(self, key, depth = 0):
+        self.probes += 1
+        slot = (key & self.mask) * 2
+        for i in (slot, slot + 1):
+            if self.keys[i] == key and self.depths[i] >= depth:
+                self.hits += 1
+                return self.values[i]
+        return None
+
+    def store(self, key, depth, value):
+        self.stores += 1
+        slot = (key & self.mask) * 2
+        if self.keys[slot] == key or self.keys[slot] is None or depth >= self.depths[slot] or self.ages[slot] != self.age:
+            i = slot
+        else:
+            i = slot + 1
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.values[i] = value
+        self.ages[i] = self.age
+
+    def hit_rate(self):
+        if self.probes == 0:
+            return 0.0
+        return self.hits / self.probes
+
+
+# A hashed bitboard game for searching: spawns are left out, since they are random and a search can't plan for them.
+class Search_game(Hashed_bitboard_game):
+    def spawn_enemy(self):
+        pass
+
+
+# Scores a position for the look-ahead: the game's own score, plus health so it avoids getting hit.
+def evaluate(board):
+    if board.is_dead:
+        return -1000000
+    return board.total_turn * 5 + board.player_exp + board.floor * 10 + board.player_hp
+
+
+# Depth-limited look-ahead over the player's actions, using the table to skip positions already searched.
+# Different move orders often reach the same position, which is where the table pays off.
+def lookahead(board, depth, table):
+    h = board.hash()
+    value = table.probe(h, depth)
+    if value is not None:
+        return value
+    if depth == 0 or board.is_dead:
+        value = evaluate(board)
+    else:
+        value = None
+        for action in (up, down, left, right, None):
+            child = board.clone()
+            floor = child.floor
+            if action is not None and not child.check_move(action):
+                continue
+            child.play_turn()
+            # Taking the stairs leads to a random new floor, so the search stops there.
+            if child.floor != floor:
+                result = evaluate(child)
+            else:
+                result = lookahead(child, depth - 1, table)
+            if value is None or result > value:
+                value = result
+    table.store(h, depth, value)
+    return value
+
+
+# Checks the incremental keys against keys computed from scratch, on both engines, over random games.
+def verify(games = 50, max_turns = 500, seed = 0):
+    rng = random.Random(seed)
+    species = Tile_strategy().species
+    actions = [up, down, left, right, None]
+    array = np.zeros((8, 8, 6), dtype = int)
+    turns = 0
+    for g in range(games):
+        board = Hashed_bitboard_game(species, rng)
+        board.new_game()
+        for turn in range(max_turns):
+            if board.is_dead:
+                break
+            action = rng.choice(actions)
+            if action is None or board.check_move(action):
+                board.play_turn()
+            assert board.board_hash == board.full_board_hash(), 'Game %d, turn %d: incremental key is off' % (g, turn)
+            assert board.board_hash == array_hash(board.to_array(array)), 'Game %d, turn %d: engines disagree' % (g, turn)
+            turns += 1
+    return turns
+
+
+if __name__ == '__main__':
+    print('Checked %d turns of incremental keys.' % verify())
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    # Searches from the first turn of a new game, once the first enemy has spawned.
+    start = Hashed_bitboard_game(Tile_strategy().species, random.Random(0))
+    start.new_game()
+    start.play_turn()
+    board = start.clone(Search_game)
+    table = Transposition_table()
+    table.new_search()
+    print('Look-ahead value at depth %d: %d' % (depth, lookahead(board, depth, table)))
+    print('Transposition table: %d probes, hit rate %.1f%%.' % (table.probes, table.hit_rate() * 100))